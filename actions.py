@@ -9,12 +9,15 @@ import exceptions
 from pprint import pprint
 
 from equipment_types import EquipmentType
+from scheduler import ACTION_COST
 
 if TYPE_CHECKING:
     from engine import Engine
     from entity import Actor, Entity, Item
 
 class Action:
+    cost = ACTION_COST  # How long this action keeps its actor busy, at normal speed.
+
     def __init__(self, entity: Actor) -> None:
         super().__init__()
         self.entity = entity
@@ -39,16 +42,18 @@ class PickupAction(Action):
         super().__init__(entity)
 
     def perform(self) -> None:
+        from entity import Item
+
         actor_location_x = self.entity.x
         actor_location_y = self.entity.y
         inventory = self.entity.inventory
 
-        for item in self.engine.game_map.items:
-            if actor_location_x == item.x and actor_location_y == item.y:
+        for item in self.engine.game_map.get_entities_at_location(actor_location_x, actor_location_y):
+            if isinstance(item, Item):
                 if len(inventory.items) >= inventory.capacity:
                     raise exceptions.Impossible("Your inventory is full.")
 
-                self.engine.game_map.entities.remove(item)
+                self.engine.game_map.remove_entity(item)
                 item.parent = self.entity.inventory
                 inventory.items.append(item)
 
@@ -180,24 +185,31 @@ class ReloadAction(Action):
             raise exceptions.Impossible("You can't reload your weapon.")
 
 class WaitAction(Action):
+    def __init__(self, entity: Actor, turns: int = 1):
+        super().__init__(entity)
+        self.cost = ACTION_COST * turns
+
     def perform(self) -> None:
         pass
 
 class TakeStairsAction(Action):
     def perform(self) -> None:
         """
-        Take the stairs, if any exist at the entity's location.
+        Take the stairs, up or down, if any exist at the entity's location.
         """
-        if (self.entity.x, self.entity.y) == self.engine.game_map.downstairs_location:
-            self.engine.game_world.generate_floor()
-            self.engine.sound.mixer.stop()
-            self.engine.sound.play_music(self.engine.game_map.music)
-            self.engine.sound.play_sound('stairs')
-            self.engine.message_log.add_message(
-                "You descend the staircase.", color.descend
-            )
+        location = self.entity.x, self.entity.y
+        if location == self.engine.game_map.downstairs_location:
+            self.engine.game_world.descend()
+            message = "You descend the staircase."
+        elif location == self.engine.game_map.upstairs_location:
+            self.engine.game_world.ascend()
+            message = "You ascend the staircase."
         else:
             raise exceptions.Impossible("There are no stairs here.")
+        self.engine.sound.mixer.stop()
+        self.engine.sound.play_music(self.engine.game_map.music)
+        self.engine.sound.play_sound('stairs')
+        self.engine.message_log.add_message(message, color.descend)
 
 class ActivateAction(Action):
     def perform(self) -> None:
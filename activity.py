@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+from enum import auto, Enum
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+
+import numpy as np  # type: ignore
+
+if TYPE_CHECKING:
+    from component_store import ComponentStore
+    from entity import Actor
+    from maps import GameMap
+
+# How far (in tiles) different noises carry before they stop waking dormant actors.
+GUNSHOT_NOISE_RADIUS = 30
+EXPLOSION_NOISE_RADIUS = 40
+
+
+class ActivityTier(Enum):
+    ACTIVE = auto()  # Near the player, or alerted: simulated every turn.
+    BACKGROUND = auto()  # Further out: simulated every few turns.
+    DORMANT = auto()  # Far away: frozen until the player comes close or a noise wakes it.
+
+
+# The tier codes kept per component store slot, and the tier each stands for.
+_DORMANT, _ACTIVE, _BACKGROUND = 0, 1, 2
+_TIERS = (ActivityTier.DORMANT, ActivityTier.ACTIVE, ActivityTier.BACKGROUND)
+
+
+class ActivityTracker:
+    """
+    Sorts the actors on a map into activity tiers around the player.
+
+    The tiers are worked out for every slot of the map's component store in one array operation and
+    compared with the previous turn's, so only the actors that changed tier cost any Python work.
+    """
+
+    def __init__(
+        self,
+        active_radius: int = 25,
+        background_radius: int = 50,
+        background_interval: int = 4,
+        alert_turns: int = 20,
+    ):
+        self.active_radius = active_radius
+        self.background_radius = background_radius
+        self.background_interval = background_interval
+        self.alert_turns = alert_turns
+
+        self.tiers: Dict[Actor, ActivityTier] = {}  # Every actor that is not dormant.
+        self.alerted: Dict[Actor, int] = {}  # Actors woken by noise, and how many turns they stay awake.
+        self._reset_slots(None)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # The per-slot state belongs to a component store, which is rebuilt when a game is loaded.
+        for name in ("_store", "_tier", "_serials", "_awake"):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        state.pop("active", None)
+        state.pop("background", None)
+        self.__dict__.update(state)
+        self._reset_slots(None)
+
+    def _reset_slots(self, store: Optional[ComponentStore]) -> None:
+        self._store = store
+        capacity = store.capacity if store is not None else 0
+        self._tier = np.zeros(capacity, dtype=np.int8)
+        self._serials = store.serials.copy() if store is not None else np.zeros(0, dtype=np.int64)
+        self._awake: Dict[int, Actor] = {}  # The actor in each slot that is not dormant.
+
+    def update(self, game_map: GameMap, player: Actor) -> Tuple[List[Actor], List[Actor]]:
+        """Work out the tiers around the player for the coming turn.
+
+        Returns the actors that woke up, in map order, and the ones that fell asleep.
+        """
+        asleep: List[Actor] = []
+        store = game_map.components
+        if store is not self._store:
+            # A new map, or the same one after a load: carry over whoever is still awake on it.
+            self._reset_slots(store)
+            for actor, tier in list(self.tiers.items()):
+                slot = store.slot(actor)
+                if slot is None:
+                    del self.tiers[actor]
+                    asleep.append(actor)
+                else:
+                    self._tier[slot] = _TIERS.index(tier)
+                    self._awake[slot] = actor
+        elif len(self._tier) < store.capacity:
+            grown = store.capacity - len(self._tier)
+            self._tier = np.concatenate([self._tier, np.zeros(grown, dtype=np.int8)])
+            self._serials = np.concatenate([self._serials, np.zeros(grown, dtype=np.int64)])
+
+        # Slots that changed hands since the last turn: whoever was awake in them is gone from this map.
+        for slot in np.flatnonzero(self._serials != store.serials):
+            actor = self._awake.pop(int(slot), None)
+            if actor is not None:
+                del self.tiers[actor]
+                asleep.append(actor)
+            self._tier[slot] = _DORMANT
+        self._serials = store.serials.copy()
+
+        columns = store.columns
+        distance = np.maximum(np.abs(columns["x"] - player.x), np.abs(columns["y"] - player.y))  # Chebyshev.
+        tier = np.where(distance <= self.background_radius, _BACKGROUND, _DORMANT).astype(np.int8)
+        tier[distance <= self.active_radius] = _ACTIVE
+        for actor, turns_left in list(self.alerted.items()):
+            slot = store.slot(actor)
+            if turns_left <= 1 or slot is None or not actor.is_alive:
+                del self.alerted[actor]
+                continue
+            self.alerted[actor] = turns_left - 1
+            tier[slot] = _ACTIVE
+        tier[~columns["alive"]] = _DORMANT
+        player_slot = store.slot(player)
+        if player_slot is not None:
+            tier[player_slot] = _DORMANT
+
+        woken: List[Actor] = []
+        for slot in np.flatnonzero(tier != self._tier):
+            slot = int(slot)
+            if tier[slot] == _DORMANT:
+                actor = self._awake.pop(slot)
+                del self.tiers[actor]
+                asleep.append(actor)
+                continue
+            actor = store.actors[slot]
+            if slot not in self._awake:
+                self._awake[slot] = actor
+                woken.append(actor)
+            self.tiers[actor] = _TIERS[tier[slot]]
+        self._tier = tier
+        # In map order, so who acts first doesn't depend on slot order, which changes when a game is reloaded.
+        woken.sort(key=lambda actor: (actor.x, actor.y))
+        return woken, asleep
+
+    def wake(self, game_map: GameMap, x: int, y: int, radius: int) -> List[Actor]:
+        """Alert every actor within `radius` of a noise at (x, y), so it stays active for a while.
+
+        Returns the actors that were alerted.
+        """
+        woken = []
+        for entity in game_map.get_entities_in_radius(x, y, radius):
+            if getattr(entity, "is_alive", False) and entity is not game_map.engine.player:
+                self.alerted[entity] = self.alert_turns
+                woken.append(entity)
+        return woken
+
+    def tier_of(self, actor: Actor) -> ActivityTier:
+        return self.tiers.get(actor, ActivityTier.DORMANT)
+
+    def slowdown(self, actor: Actor) -> int:
+        """How many times longer than usual `actor` waits between actions, given its tier."""
+        if self.tier_of(actor) is ActivityTier.BACKGROUND:
+            return self.background_interval
+        return 1
+
+    def describe(self, game_map: GameMap) -> str:
+        """Return a one line summary of the tiers, for debug output."""
+        active = int(np.count_nonzero(self._tier == _ACTIVE))
+        background = int(np.count_nonzero(self._tier == _BACKGROUND))
+        # Dormant actors are never visited during a turn, so they are only counted here.
+        dormant = sum(1 for _ in game_map.enemies) - active - background
+        return (
+            f"Active:{active} Background:{background} "
+            f"Dormant:{max(dormant, 0)} Alerted:{len(self.alerted)}"
+        )
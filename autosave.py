@@ -0,0 +1,113 @@
+"""Periodic saves written on a background thread, with the journal of the turns in between."""
+from __future__ import annotations
+
+import logging
+import threading
+from typing import Optional, Tuple, TYPE_CHECKING
+
+from journal import Journal
+import savefile
+
+if TYPE_CHECKING:
+    from engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Turns between autosaves.  Changing floors also saves.
+AUTOSAVE_INTERVAL = 50
+
+
+class Autosaver:
+    """
+    Saves the game every `interval` turns and whenever the player changes floors.
+
+    The game is only touched while taking a snapshot, which pickles just what can still change, mostly the
+    floor the player is on, so its cost doesn't grow with the rest of the world.  Pickling the parts that are
+    done changing, compressing and writing happen on a worker thread.  If a save is still being written when the next one is due, only the newest
+    waiting snapshot is kept.  Every turn in between goes into the save's journal, so loading loses nothing,
+    and the journal is trimmed each time a save is written.
+    """
+
+    def __init__(self, interval: int = AUTOSAVE_INTERVAL):
+        self.interval = interval
+        self.engine: Optional[Engine] = None
+        self.last_saved: Optional[Tuple[int, int]] = None  # (turn, floor) of the last save.
+        self.journal: Optional[Journal] = None
+        # The waiting snapshot, with where it goes, its journal and the last journal record it includes.
+        self._pending: Optional[Tuple[savefile.Snapshot, str, Journal, int]] = None
+        self._condition = threading.Condition()
+        self._worker: Optional[threading.Thread] = None
+        self._writing = False
+
+    def update(self, engine: Engine) -> None:
+        """Save if enough turns passed or the floor changed since the last save.  Call this after turns pass."""
+        turn, floor = engine.turn, engine.game_world.current_floor
+        if engine is not self.engine:
+            # Count from whenever the game was started or loaded, and journal into its save slot.
+            self.detach()
+            self.engine = engine
+            engine.autosaver = self
+            self.last_saved = turn, floor
+            self.journal = Journal(engine.save_path + ".journal")
+            self.journal.attach(engine)
+        elif turn - self.last_saved[0] >= self.interval or floor != self.last_saved[1]:
+            self.save(engine)
+
+    def save(self, engine: Engine) -> None:
+        """Snapshot the engine now and write it out in the background."""
+        if not engine.player.is_alive:
+            return  # A finished game isn't saved; GameOverEventHandler deletes the save.
+        snapshot = savefile.snapshot(engine)
+        self.last_saved = engine.turn, engine.game_world.current_floor
+        with self._condition:
+            if self._pending is not None:
+                self._pending[0].close()  # Superseded before it was written.
+            self._pending = snapshot, engine.save_path, self.journal, engine.journal_seq
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="autosave", daemon=True)
+                self._worker.start()
+            self._condition.notify_all()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while self._pending is None:
+                    self._condition.wait()
+                (snapshot, filename, journal, journal_seq), self._pending = self._pending, None
+                self._writing = True
+            try:
+                savefile.write(snapshot, filename)
+                journal.compact(journal_seq)
+            except Exception:
+                logger.exception("Autosave to %s failed", filename)
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+    def flush(self) -> None:
+        """Wait until every snapshot taken so far is written, e.g. before saving on the main thread."""
+        with self._condition:
+            while self._pending is not None or self._writing:
+                self._condition.wait()
+
+    def detach(self) -> None:
+        """Finish writing the current game's saves and close its journal, e.g. before they are read back.
+
+        The next `update` starts saving whichever game it is given, the same one included.
+        """
+        self.flush()
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        if self.engine is not None:
+            self.engine.autosaver = None
+            self.engine = None
+
+    def cancel(self) -> None:
+        """Drop the waiting snapshot and wait for any save being written, e.g. before the save is deleted."""
+        with self._condition:
+            if self._pending is not None:
+                self._pending[0].close()
+                self._pending = None
+            while self._writing:
+                self._condition.wait()
@@ -0,0 +1,175 @@
+"""Time each map generator across a grid of map sizes and seeds, and report on the maps it makes.
+
+Run from the repository root with `python -m benchmarks.generation`.  Results are written as CSV or JSON.
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import io
+import json
+import random
+import time
+import tracemalloc
+from typing import Callable, Dict, List, TYPE_CHECKING
+
+import numpy as np  # type: ignore
+import tcod
+
+import headless
+from navigation import CARDINAL_COST, DIAGONAL_COST
+import procgen
+
+if TYPE_CHECKING:
+    from engine import Engine
+    from maps import GameMap
+
+Generator = Callable[["Engine", int, int], "GameMap"]
+
+
+def arrive(engine: Engine, game_map: GameMap) -> GameMap:
+    """Put the player where a dungeon generator says they start, as GameWorld.descend does."""
+    engine.player.place(*game_map.player_start, game_map)
+    return game_map
+
+
+def dungeon(engine: Engine, width: int, height: int) -> GameMap:
+    world = engine.game_world
+    return arrive(engine, procgen.generate_dungeon(
+        max_rooms=world.max_rooms,
+        room_min_size=world.room_min_size,
+        room_max_size=world.room_max_size,
+        map_width=width,
+        map_height=height,
+        engine=engine,
+        floor_number=world.current_floor,
+        rng=random.Random(random.getrandbits(64)),
+    ))
+
+
+def bsp_dungeon(engine: Engine, width: int, height: int) -> GameMap:
+    world = engine.game_world
+    return arrive(engine, procgen.generate_bsp_dungeon(
+        max_rooms=world.max_rooms,
+        room_min_size=world.room_min_size,
+        room_max_size=world.room_max_size,
+        map_width=width,
+        map_height=height,
+        engine=engine,
+        floor_number=world.current_floor,
+        rng=random.Random(random.getrandbits(64)),
+    ))
+
+
+def overworld(engine: Engine, width: int, height: int) -> GameMap:
+    return procgen.generate_random_overworld(map_width=width, map_height=height, engine=engine)
+
+
+GENERATORS: Dict[str, Generator] = {
+    "dungeon": dungeon,
+    "bsp_dungeon": bsp_dungeon,
+    "overworld": overworld,
+}
+
+FIELDS = [
+    "generator", "width", "height", "seed", "seconds", "peak_memory_kb", "rooms",
+    "walkable_tiles", "reachable_fraction", "stairs_reachable", "entities",
+]
+
+
+def quality(game_map: GameMap) -> Dict:
+    """Measure how much of the map the player can walk to from where they start."""
+    player = game_map.engine.player
+    walkable = game_map.tiles["walkable"]
+    distance = tcod.path.maxarray(walkable.shape, dtype=np.int32, order="F")
+    distance[player.x, player.y] = 0
+    tcod.path.dijkstra2d(distance, walkable.astype(np.int8), CARDINAL_COST, DIAGONAL_COST, out=distance)
+    reachable = distance != np.iinfo(distance.dtype).max
+
+    walkable_tiles = int(walkable.sum())
+    return {
+        "rooms": len(game_map.rooms),
+        "walkable_tiles": walkable_tiles,
+        "reachable_fraction": int((reachable & walkable).sum()) / walkable_tiles if walkable_tiles else 0.0,
+        "stairs_reachable": bool(reachable[game_map.downstairs_location]),
+        "entities": len(game_map.entities),
+    }
+
+
+def measure(engine: Engine, name: str, width: int, height: int, seed: int) -> Dict:
+    """Generate one map twice with the same seed: once for wall time and quality, and once under tracemalloc."""
+    generator = GENERATORS[name]
+
+    random.seed(seed)
+    start = time.perf_counter()
+    game_map = generator(engine, width, height)
+    seconds = time.perf_counter() - start
+    # Measure now, while the player is still standing on this map.
+    stats = quality(game_map)
+
+    random.seed(seed)
+    tracemalloc.start()
+    try:
+        generator(engine, width, height)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    result = {
+        "generator": name,
+        "width": width,
+        "height": height,
+        "seed": seed,
+        "seconds": seconds,
+        "peak_memory_kb": peak / 1024,
+    }
+    result.update(stats)
+    return result
+
+
+def write_report(rows: List[Dict], output_format: str) -> str:
+    if output_format == "json":
+        return json.dumps({"results": rows}, indent=2)
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FIELDS)
+    writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--generators", nargs="+", choices=sorted(GENERATORS), default=sorted(GENERATORS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[60, 100, 140, 178],
+                        help="Square map sizes to try.  GameWorld picks sizes between 51 and 178.")
+    parser.add_argument("--seeds", nargs="+", type=int, default=[1, 2, 3])
+    parser.add_argument("--floor", type=int, default=1, help="Floor number used for placing monsters and items.")
+    parser.add_argument("--format", choices=["csv", "json"], default=None,
+                        help="Defaults to the --output extension, or CSV.")
+    parser.add_argument("--output", help="Write the results to this file instead of printing them.")
+    args = parser.parse_args()
+
+    output_format = args.format
+    if output_format is None:
+        output_format = "json" if args.output and args.output.endswith(".json") else "csv"
+
+    engine = headless.new_game(seed=0)
+    engine.game_world.current_floor = args.floor
+
+    rows = [
+        measure(engine, name, size, size, seed)
+        for name in args.generators
+        for size in args.sizes
+        for seed in args.seeds
+    ]
+
+    report = write_report(rows, output_format)
+    if args.output:
+        with open(args.output, "w", newline="") as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Measure what generating the floor below in the background saves on the stairs, and what it costs the turns before.
+
+Every run plays the same turns twice from the same seed, once with prefetching and once without, and times each
+turn and each trip down the stairs.  Run from the repository root with `python -m benchmarks.prefetch`.
+Results are printed (or written) as JSON.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from typing import Dict, List
+
+import numpy as np  # type: ignore
+
+from benchmarks.turns import make_invulnerable
+import headless
+
+
+def summarise(seconds: List[float]) -> Dict:
+    milliseconds = np.array(seconds) * 1000
+    if not len(milliseconds):
+        return {"count": 0}
+    return {
+        "count": len(milliseconds),
+        "mean": float(milliseconds.mean()),
+        "p50": float(np.percentile(milliseconds, 50)),
+        "p95": float(np.percentile(milliseconds, 95)),
+        "max": float(milliseconds.max()),
+    }
+
+
+def measure(seed: int, floors: int, turns: int, prefetch: bool) -> Dict:
+    """Play `turns` turns of random wandering on each of `floors` floors, taking the stairs down after each."""
+    engine = headless.new_game(seed=seed, prefetch=prefetch)
+    make_invulnerable(engine.player)
+
+    turn_seconds: List[float] = []
+    descend_seconds: List[float] = []
+    for _ in range(floors):
+        for _ in range(turns):
+            action = headless.wander(engine)
+            start = time.perf_counter()
+            turn_passed = headless.step(engine, action)
+            elapsed = time.perf_counter() - start
+            if turn_passed:
+                turn_seconds.append(elapsed)
+        start = time.perf_counter()
+        headless.descend(engine)
+        descend_seconds.append(time.perf_counter() - start)
+
+    return {
+        "seed": seed,
+        "prefetch": prefetch,
+        "turn_latency_ms": summarise(turn_seconds),
+        "descend_ms": summarise(descend_seconds),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--floors", type=int, default=5, help="Trips down the stairs per run.")
+    parser.add_argument("--turns", type=int, default=20, help="Turns played on each floor before taking the stairs.")
+    parser.add_argument("--seeds", nargs="+", type=int, default=[1, 2, 3])
+    parser.add_argument("--output", help="Write the JSON results to this file instead of printing them.")
+    args = parser.parse_args()
+
+    results = [
+        measure(seed, args.floors, args.turns, prefetch)
+        for seed in args.seeds
+        for prefetch in (False, True)
+    ]
+
+    report = json.dumps({"results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Measure what a frame costs, layer by layer, by rendering a prepared game into an offscreen console.
+
+Run from the repository root with `python -m benchmarks.rendering`.  Results are printed (or written) as JSON.
+"""
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import time
+from typing import Callable, Dict, List, TYPE_CHECKING
+
+import numpy as np  # type: ignore
+import tcod
+
+import headless
+from message_log import MessageLog
+
+if TYPE_CHECKING:
+    from engine import Engine
+
+# The root console size used by main.main.
+SCREEN_WIDTH = 80
+SCREEN_HEIGHT = 60
+
+
+def prepare(engine: Engine, light_radius: int, explored_fraction: float, log_length: int, seed: int) -> None:
+    """Set up the light radius, explored area and message log that a configuration asks for."""
+    engine.player.light_source.radius = light_radius
+    engine.update_fov()
+    engine.update_light_levels()
+
+    game_map = engine.game_map
+    rng = np.random.default_rng(seed)
+    game_map.explored[:] = rng.random((game_map.width, game_map.height)) < explored_fraction
+
+    log = engine.message_log = MessageLog()
+    for i in range(log_length):
+        # Vary the lengths so some messages wrap over several lines.
+        log.add_message(f"Message {i}: " + "the scavenger shoots at you " * (i % 4 + 1), stack=False)
+
+
+def time_frames(engine: Engine, console: tcod.Console, frames: int, cached: bool = False) -> Dict[str, List[float]]:
+    """Render `frames` frames and return the time each layer took, in milliseconds.
+
+    Unless `cached` is set the side panes and log are redrawn every frame, as if their contents kept changing.
+    """
+    game_map = engine.game_map
+    samples: Dict[str, List[float]] = {
+        name: [] for name in ("map_tiles", "lighting", "entities", "side_panes", "message_log", "total")
+    }
+
+    def timed(name: str, function: Callable, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        samples[name].append((time.perf_counter() - start) * 1000)
+        return result
+
+    for _ in range(frames):
+        console.clear()
+        if not cached:
+            for pane in engine.panes.values():
+                pane.invalidate()
+        start = time.perf_counter()
+        s_x, s_y = game_map.get_viewport_slices()
+        graphics = timed("map_tiles", game_map.get_tile_graphics, s_x, s_y)
+        timed("lighting", game_map.render_lighting, console, s_x, s_y, graphics)
+        timed("entities", game_map.render_entities, console)
+        timed("side_panes", engine.render_side_panes, console)
+        timed("message_log", engine.render_message_log, console)
+        samples["total"].append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    values = np.array(samples)
+    return {
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "max": float(values.max()),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--floors", type=int, default=1, help="Floors to descend before rendering.")
+    parser.add_argument("--light-radii", nargs="+", type=int, default=[5, 15, 30])
+    parser.add_argument("--explored-fractions", nargs="+", type=float, default=[0.0, 0.5, 1.0])
+    parser.add_argument("--log-lengths", nargs="+", type=int, default=[10, 1000, 10000])
+    parser.add_argument("--cached", action="store_true",
+                        help="Let the side panes and log reuse their cached drawing, like unchanged frames do.")
+    parser.add_argument("--output", help="Write the JSON results to this file instead of printing them.")
+    args = parser.parse_args()
+
+    engine = headless.new_game(seed=args.seed, floors=args.floors)
+    console = tcod.Console(SCREEN_WIDTH, SCREEN_HEIGHT, order="F")
+
+    results = []
+    for light_radius, explored_fraction, log_length in itertools.product(
+        args.light_radii, args.explored_fractions, args.log_lengths
+    ):
+        prepare(engine, light_radius, explored_fraction, log_length, args.seed)
+        samples = time_frames(engine, console, args.frames, args.cached)
+        results.append({
+            "light_radius": light_radius,
+            "explored_fraction": explored_fraction,
+            "log_length": log_length,
+            "frames": args.frames,
+            "cached": args.cached,
+            "layers_ms": {name: summarize(values) for name, values in samples.items()},
+        })
+
+    report = json.dumps({"results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
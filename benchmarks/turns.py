@@ -0,0 +1,168 @@
+"""Measure how many turns per second the game sustains in a few preset scenarios.
+
+Floors aren't generated in the background during the runs (see benchmarks.prefetch for what that costs), so
+turn latencies don't pick up a worker thread's noise.
+
+Run from the repository root with `python -m benchmarks.turns`.  Results are printed (or written) as JSON.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import time
+from typing import Callable, Dict, List, TYPE_CHECKING
+
+import numpy as np  # type: ignore
+
+import entity_factories
+import headless
+from maps import GameMap
+import procgen
+import tile_types
+
+if TYPE_CHECKING:
+    from engine import Engine
+    from entity import Actor
+
+# Large enough that the player survives any run, so every scenario plays all of its turns.
+BENCHMARK_HP = 10 ** 9
+
+
+def make_invulnerable(player: Actor) -> None:
+    player.fighter.max_hp = BENCHMARK_HP
+    player.fighter.hp = BENCHMARK_HP
+
+
+def populate(game_map: GameMap, prototype: Actor, count: int) -> None:
+    """Spawn `count` copies of `prototype` on random free, walkable tiles of `game_map`."""
+    xs, ys = np.nonzero(game_map.tiles["walkable"])
+    for index in random.sample(range(len(xs)), len(xs)):
+        if count <= 0:
+            break
+        x, y = int(xs[index]), int(ys[index])
+        if not game_map.get_blocking_entity_at_location(x, y):
+            prototype.spawn(game_map, x, y)
+            count -= 1
+
+
+def refresh(engine: Engine) -> None:
+    engine.update_fov()
+    engine.update_light_levels()
+
+
+def overworld_scenario(seed: int) -> Engine:
+    """The overworld of a new game, with exactly 10 actors besides the player."""
+    engine = headless.new_game(seed=seed)
+    game_map = engine.game_map
+    enemies = list(game_map.enemies)
+    for enemy in enemies[10:]:
+        game_map.remove_entity(enemy)
+    populate(game_map, entity_factories.scav, 10 - len(enemies))
+    refresh(engine)
+    return engine
+
+
+def dungeon_scenario(seed: int) -> Engine:
+    """A generate_dungeon floor at the largest size GameWorld.build_floor can pick."""
+    engine = headless.new_game(seed=seed)
+    world = engine.game_world
+    world.current_floor = 1
+    engine.game_map = procgen.generate_dungeon(
+        max_rooms=world.max_rooms,
+        room_min_size=world.room_min_size,
+        room_max_size=world.room_max_size,
+        map_width=world.min_map_width + 128,
+        map_height=world.min_map_height + 128,
+        engine=engine,
+        floor_number=world.current_floor,
+        rng=random.Random(seed),
+    )
+    engine.player.place(*engine.game_map.player_start, engine.game_map)
+    refresh(engine)
+    return engine
+
+
+def arena_scenario(seed: int, scavs: int = 500, size: int = 120) -> Engine:
+    """An open walled arena with the player in the middle and `scavs` HostileHumanEnemy scavengers."""
+    engine = headless.new_game(seed=seed)
+    arena = GameMap(engine, size, size, "exploring_music", entities=[engine.player])
+    arena.tiles[1:-1, 1:-1] = tile_types.floor
+    arena.tiles_changed()
+    engine.player.place(size // 2, size // 2, arena)
+    engine.game_map = arena
+    populate(arena, entity_factories.scav, scavs)
+    refresh(engine)
+    return engine
+
+
+SCENARIOS: Dict[str, Callable[[int], "Engine"]] = {
+    "overworld": overworld_scenario,
+    "dungeon": dungeon_scenario,
+    "arena": arena_scenario,
+}
+
+
+def measure(engine: Engine, turns: int, warmup: int) -> Dict:
+    """Play `warmup` then `turns` turns of random wandering and report throughput and per-turn latency."""
+    make_invulnerable(engine.player)
+    headless.run(engine, headless.wander, warmup)
+
+    latencies: List[float] = []
+    attempts = 0
+    while len(latencies) < turns and attempts < turns * 10:
+        attempts += 1
+        action = headless.wander(engine)
+        start = time.perf_counter()
+        turn_passed = headless.step(engine, action)
+        elapsed = time.perf_counter() - start
+        if turn_passed:
+            latencies.append(elapsed)
+
+    latency_ms = np.array(latencies) * 1000
+    total = float(latency_ms.sum()) / 1000
+    return {
+        "turns": len(latencies),
+        "seconds": total,
+        "turns_per_second": len(latencies) / total if total else None,
+        "latency_ms": {
+            "mean": float(latency_ms.mean()) if len(latency_ms) else None,
+            "p50": float(np.percentile(latency_ms, 50)) if len(latency_ms) else None,
+            "p95": float(np.percentile(latency_ms, 95)) if len(latency_ms) else None,
+            "p99": float(np.percentile(latency_ms, 99)) if len(latency_ms) else None,
+            "max": float(latency_ms.max()) if len(latency_ms) else None,
+        },
+        "map_size": [engine.game_map.width, engine.game_map.height],
+        "actors": sum(1 for _ in engine.game_map.enemies),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS) + ["all"], default="all")
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write the JSON results to this file instead of printing them.")
+    args = parser.parse_args()
+
+    names = sorted(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    results = []
+    for name in names:
+        build_start = time.perf_counter()
+        engine = SCENARIOS[name](args.seed)
+        build_seconds = time.perf_counter() - build_start
+        result = {"scenario": name, "seed": args.seed, "build_seconds": build_seconds}
+        result.update(measure(engine, args.turns, args.warmup))
+        results.append(result)
+
+    report = json.dumps({"results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+from typing import Dict, List, Optional, TYPE_CHECKING
+
+import numpy as np  # type: ignore
+
+if TYPE_CHECKING:
+    from entity import Actor
+
+# Columns mirrored for every actor, and their types.
+COLUMNS = {
+    "x": np.int32,
+    "y": np.int32,
+    "hp": np.int32,
+    "max_hp": np.int32,
+    "power": np.int32,
+    "defense": np.int32,
+    "alive": np.bool_,
+}
+
+
+class ComponentStore:
+    """
+    Mirrors the position and combat stats of every actor on a GameMap into NumPy arrays.
+
+    Each actor gets a slot, and every column holds one value per slot, so questions like "which actors are
+    inside this blast radius" become one array operation instead of a Python loop over every actor.
+    The actors stay the source of truth: GameMap keeps positions in sync, and Fighter and Equipment
+    report stat changes.  Free slots are marked by `used` and are reused before the arrays grow.  Each
+    slot's `serials` entry changes whenever it is given to or taken from an actor, so code that keeps its own
+    per-slot arrays can tell when a slot changed hands.
+    """
+
+    def __init__(self, capacity: int = 64):
+        self.capacity = capacity
+        self.columns: Dict[str, np.ndarray] = {
+            name: np.zeros(capacity, dtype=dtype) for name, dtype in COLUMNS.items()
+        }
+        self.used = np.zeros(capacity, dtype=np.bool_)
+        self.serials = np.zeros(capacity, dtype=np.int64)
+        self._next_serial = 1
+        self.actors: List[Optional[Actor]] = [None] * capacity
+        self._slots: Dict[Actor, int] = {}
+        self._free: List[int] = list(range(capacity - 1, -1, -1))
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, actor: Actor) -> bool:
+        return actor in self._slots
+
+    def slot(self, actor: Actor) -> Optional[int]:
+        """Return the slot of `actor`, or None if it has none."""
+        return self._slots.get(actor)
+
+    def _grow(self) -> None:
+        old_capacity = self.capacity
+        self.capacity *= 2
+        for name, column in self.columns.items():
+            self.columns[name] = np.concatenate([column, np.zeros(old_capacity, dtype=column.dtype)])
+        self.used = np.concatenate([self.used, np.zeros(old_capacity, dtype=np.bool_)])
+        self.serials = np.concatenate([self.serials, np.zeros(old_capacity, dtype=np.int64)])
+        self.actors.extend([None] * old_capacity)
+        self._free.extend(range(self.capacity - 1, old_capacity - 1, -1))
+
+    def add(self, actor: Actor) -> int:
+        """Give `actor` a slot, or refresh its slot if it already has one.  Returns the slot."""
+        slot = self._slots.get(actor)
+        if slot is None:
+            if not self._free:
+                self._grow()
+            slot = self._free.pop()
+            self._slots[actor] = slot
+            self.actors[slot] = actor
+            self.used[slot] = True
+            self._bump_serial(slot)
+        self.update_position(actor)
+        self.update_stats(actor)
+        return slot
+
+    def remove(self, actor: Actor) -> None:
+        """Free the slot of `actor`.  Unknown actors are ignored."""
+        slot = self._slots.pop(actor, None)
+        if slot is None:
+            return
+        self.used[slot] = False
+        self.columns["alive"][slot] = False
+        self.actors[slot] = None
+        self._bump_serial(slot)
+        self._free.append(slot)
+
+    def _bump_serial(self, slot: int) -> None:
+        self.serials[slot] = self._next_serial
+        self._next_serial += 1
+
+    def update_position(self, actor: Actor) -> None:
+        slot = self._slots.get(actor)
+        if slot is not None:
+            self.columns["x"][slot] = actor.x
+            self.columns["y"][slot] = actor.y
+            self.columns["alive"][slot] = actor.is_alive
+
+    def update_stats(self, actor: Actor) -> None:
+        slot = self._slots.get(actor)
+        if slot is None:
+            return
+        fighter = actor.fighter
+        columns = self.columns
+        columns["hp"][slot] = fighter.hp
+        columns["max_hp"][slot] = fighter.max_hp
+        columns["power"][slot] = fighter.power
+        columns["defense"][slot] = fighter.defense
+        columns["alive"][slot] = actor.is_alive
+
+    def _select(self, mask: np.ndarray, order: Optional[np.ndarray] = None) -> List[Actor]:
+        slots = np.flatnonzero(mask)
+        # Ties, and everything when there is no `order`, go in map order rather than slot order, since slots
+        # are handed out in a different order when a saved game is loaded.
+        keys = [self.columns["y"][slots], self.columns["x"][slots]]
+        if order is not None:
+            keys.append(order[slots])
+        slots = slots[np.lexsort(keys)]
+        return [self.actors[slot] for slot in slots]
+
+    def distances(self, x: int, y: int) -> np.ndarray:
+        """Return the distance of every slot from (x, y), using the same distance as Entity.distance."""
+        return np.hypot(self.columns["x"] - x, self.columns["y"] - y)
+
+    def within_radius(self, x: int, y: int, radius: float) -> List[Actor]:
+        """Return the living actors within `radius` tiles of (x, y), nearest first."""
+        distance = self.distances(x, y)
+        return self._select(self.columns["alive"] & (distance <= radius), order=distance)
+
+    def visible(self, visible: np.ndarray, x: Optional[int] = None, y: Optional[int] = None) -> List[Actor]:
+        """Return the living actors on tiles marked in the `visible` array.
+
+        If (x, y) is given the actors are sorted nearest first.
+        """
+        columns = self.columns
+        mask = columns["alive"].copy()
+        mask[mask] = visible[columns["x"][mask], columns["y"][mask]]
+        order = self.distances(x, y) if x is not None else None
+        return self._select(mask, order=order)
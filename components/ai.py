@@ -10,43 +10,89 @@ import dice
 
 from actions import Action, BumpAction, MeleeAction, MovementAction, WaitAction, FireAction
 from equipment_types import EquipmentType
+from navigation import CachedPath
+from scheduler import ACTION_COST
 
 if TYPE_CHECKING:
     from entity import Actor
 
+# How many turns an actor with nothing to do waits before it looks around again.
+IDLE_WAIT_TURNS = 3
+
 class BaseAI(Action):
 
+    def __init__(self, entity: Actor):
+        super().__init__(entity)
+        self.cached_path: Optional[CachedPath] = None
+        self.action_cost = ACTION_COST  # Cost of the last action taken, read by the engine's scheduler.
+
     def perform(self) -> None:
         raise NotImplementedError()
 
+    def act(self, action: Action) -> None:
+        """Perform `action` on this AI's behalf, remembering how long it takes."""
+        self.action_cost = action.cost
+        return action.perform()
+
     def get_path_to(self, dest_x: int, dest_y: int) -> List[Tuple[int, int]]:
         """Compute and return a path to the target position.
 
+        The last path found is reused while nothing changed along it.
         If there is no valid path then returns an empty list.
         """
-        # Copy the walkable array.
-        cost = np.array(self.entity.gamemap.tiles["walkable"], dtype=np.int8)
+        navigation = self.entity.gamemap.navigation
+        position = self.entity.x, self.entity.y
 
-        for entity in self.entity.gamemap.entities:
-            # Check that an enitiy blocks movement and the cost isn't zero (blocking.)
-            if entity.blocks_movement and cost[entity.x, entity.y]:
-                # Add to the cost of a blocked position.
-                # A lower number means more enemies will crowd behind each other in
-                # hallways.  A higher number means enemies will take longer paths in
-                # order to surround the player.
-                cost[entity.x, entity.y] += 10
+        if self.cached_path:
+            remaining = navigation.reuse_path(self.cached_path, position, (dest_x, dest_y))
+            if remaining is not None:
+                return remaining
 
-        # Create a graph from the cost array and pass that graph to a new pathfinder.
-        graph = tcod.path.SimpleGraph(cost=cost, cardinal=2, diagonal=3)
-        pathfinder = tcod.path.Pathfinder(graph)
+        self.cached_path = navigation.find_path(position, (dest_x, dest_y))
+        return list(self.cached_path.steps)
+
+    def get_step_towards_player(self) -> List[Tuple[int, int]]:
+        """Return the next tile towards the player as a one step path, or an empty list.
+
+        This reads the engine's shared flow field, so it costs the same no matter how many actors are chasing.
+        """
+        game_map = self.entity.gamemap
+        flow_field = self.engine.get_player_flow_field()
+        step = flow_field.next_step(
+            self.entity.x, self.entity.y, is_blocked=game_map.get_blocking_entity_at_location
+        )
+        return [step] if step else []
+
+class Chaser(BaseAI):
+    """
+    An AI that hunts the player while it is in view, and walks to where it last saw the player otherwise.
+    """
 
-        pathfinder.add_root((self.entity.x, self.entity.y))  # Start position.
+    def __init__(self, entity: Actor):
+        super().__init__(entity)
+        self.path: List[Tuple[int, int]] = []
+        self.last_seen_target: Optional[Tuple[int, int]] = None
 
-        # Compute the path to the destination and remove the starting point.
-        path: List[List[int]] = pathfinder.path_to((dest_x, dest_y))[1:].tolist()
+    def chase(self) -> None:
+        """Take one step towards the player, or towards the last place the player was seen."""
+        target = self.engine.player
 
-        # Convert from List[List[int]] to List[Tuple[int, int]].
-        return [(index[0], index[1]) for index in path]
+        if self.engine.game_map.visible[self.entity.x, self.entity.y]:
+            self.path = self.get_step_towards_player()
+            self.last_seen_target = target.x, target.y
+        elif not self.path and self.last_seen_target:
+            # Lost sight of the player, so head for where they were last seen.
+            self.path = self.get_path_to(*self.last_seen_target)
+            self.last_seen_target = None
+
+        if self.path:
+            dest_x, dest_y = self.path.pop(0)
+            return self.act(MovementAction(
+                self.entity, dest_x - self.entity.x, dest_y - self.entity.y,
+            ))
+
+        # Nothing to chase, so there is no point checking again every turn.
+        return self.act(WaitAction(self.entity, turns=IDLE_WAIT_TURNS))
 
 class ConfusedEnemy(BaseAI):
     """
@@ -88,12 +134,9 @@ class ConfusedEnemy(BaseAI):
 
             # The actor will either try to move or attack in the chosen random direction.
             # Its possible the actor will just bump into the wall, wasting a turn.
-            return BumpAction(self.entity, direction_x, direction_y,).perform()
+            return self.act(BumpAction(self.entity, direction_x, direction_y,))
 
-class HostileEnemy(BaseAI):
-    def __init__(self, entity: Actor):
-        super().__init__(entity)
-        self.path: List[Tuple[int, int]] = []
+class HostileEnemy(Chaser):
 
     def perform(self) -> None:
         target = self.engine.player
@@ -103,22 +146,11 @@ class HostileEnemy(BaseAI):
 
         if self.engine.game_map.visible[self.entity.x, self.entity.y]:
             if distance <= 1:
-                return MeleeAction(self.entity, dx, dy).perform()
+                return self.act(MeleeAction(self.entity, dx, dy))
 
-            self.path = self.get_path_to(target.x, target.y)
-
-        if self.path:
-            dest_x, dest_y = self.path.pop(0)
-            return MovementAction(
-                self.entity, dest_x - self.entity.x, dest_y - self.entity.y,
-            ).perform()
+        return self.chase()
 
-        return WaitAction(self.entity).perform()
-
-class HostileHumanEnemy(BaseAI):
-    def __init__(self, entity: Actor):
-        super().__init__(entity)
-        self.path: List[Tuple[int, int]] = []
+class HostileHumanEnemy(Chaser):
 
     def perform(self) -> None:
         target = self.engine.player
@@ -153,19 +185,11 @@ class HostileHumanEnemy(BaseAI):
                     for roll in dice.roll('d20'):
                         # print(f"Fire roll: {roll}")
                         if roll > 15:
-                            return FireAction(entity=self.entity, item=self.entity.equipment.get_item_in_slot(EquipmentType.RANGED_WEAPON), target_xy=(target.x, target.y)).perform()
+                            return self.act(FireAction(entity=self.entity, item=self.entity.equipment.get_item_in_slot(EquipmentType.RANGED_WEAPON), target_xy=(target.x, target.y)))
                 if distance <= 1:
-                    return MeleeAction(self.entity, dx, dy).perform()    
+                    return self.act(MeleeAction(self.entity, dx, dy))    
             else:
                 if distance <= 1:
-                    return MeleeAction(self.entity, dx, dy).perform()
-            
-            self.path = self.get_path_to(target.x, target.y)
-
-        if self.path:
-            dest_x, dest_y = self.path.pop(0)
-            return MovementAction(
-                self.entity, dest_x - self.entity.x, dest_y - self.entity.y,
-            ).perform()
+                    return self.act(MeleeAction(self.entity, dx, dy))
 
-        return WaitAction(self.entity).perform()
\ No newline at end of file
+        return self.chase()
\ No newline at end of file
@@ -4,6 +4,7 @@ from typing import Optional, TYPE_CHECKING
 
 import actions
 import color
+from activity import EXPLOSION_NOISE_RADIUS
 import components.ai
 import components.inventory
 from components.base_component import BaseComponent
@@ -111,8 +112,8 @@ class GrenadeDamageConsumable(Consumable):
             raise Impossible("You cannot target an area that you cannot see.")
 
         targets_hit = False
-        for actor in self.engine.game_map.actors:
-            if actor.distance(*target_xy) <= self.radius:
+        for actor in self.engine.game_map.components.within_radius(*target_xy, self.radius):
+            if actor.is_alive:  # An earlier blast victim may have taken someone down with it.
                 self.engine.message_log.add_message(
                     f"The {actor.name} is engulfed in a fiery explosion, taking {self.damage} damage!"
                 )
@@ -121,6 +122,7 @@ class GrenadeDamageConsumable(Consumable):
 
         if not targets_hit:
             raise Impossible("There are no targets in the radius.")
+        self.engine.make_noise(*target_xy, EXPLOSION_NOISE_RADIUS)
         self.consume()
 
 class LightningDamageConsumable(Consumable):
@@ -131,15 +133,14 @@ class LightningDamageConsumable(Consumable):
     def activate(self, action: actions.ItemAction) -> None:
         consumer = action.entity
         target = None
-        closest_distance = self.maximum_range + 1.0
+        components = self.engine.game_map.components
 
-        for actor in self.engine.game_map.actors:
-            if actor is not consumer and self.parent.gamemap.visible[actor.x, actor.y]:
-                distance = consumer.distance(actor.x, actor.y)
-
-                if distance < closest_distance:
+        # Visible actors come back nearest first, so the first one that isn't the consumer is the target.
+        for actor in components.visible(self.engine.game_map.visible, consumer.x, consumer.y):
+            if actor is not consumer:
+                if consumer.distance(actor.x, actor.y) < self.maximum_range + 1.0:
                     target = actor
-                    closest_distance = distance
+                break
 
         if target:
             self.engine.message_log.add_message(
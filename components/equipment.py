@@ -76,6 +76,7 @@ class Equipment(BaseComponent):
                 if item_slot.item:
                     self.unequip_from_slot(item_slot.equipment_type, add_message=add_message)
                 item_slot.item = item
+                self.parent.fighter.stats_changed()
                 if add_message:
                     self.equip_message(item.name)
                     if item.equippable.equipment_type == EquipmentType.RANGED_WEAPON:
@@ -87,6 +88,7 @@ class Equipment(BaseComponent):
                 if add_message:
                     self.unequip_message(item_slot.item.name)
                 item_slot.item = None
+                self.parent.fighter.stats_changed()
                 break
 
     def toggle_equip(self, item, add_message=True):
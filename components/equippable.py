@@ -2,6 +2,7 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING,List, Set, Dict, Tuple, Optional
 
+from activity import GUNSHOT_NOISE_RADIUS
 from components.base_component import BaseComponent
 from equipment_types import EquipmentType
 from exceptions import Impossible
@@ -180,6 +181,7 @@ class Equippable(BaseComponent):
         actor.fighter.fighting = target
         target.fighter.fighting = actor
         self.engine.sound.play_sound('pistol_shot')
+        self.engine.make_noise(actor.x, actor.y, GUNSHOT_NOISE_RADIUS)
 
 
 class Blade(Equippable):
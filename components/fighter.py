@@ -17,10 +17,10 @@ class Fighter(BaseComponent):
     killer: Actor
 
     def __init__(self, hp: int, base_defense: int, base_power: int):
-        self.max_hp = hp
+        self._max_hp = hp
         self._hp = hp
-        self.base_defense = base_defense
-        self.base_power = base_power
+        self._base_defense = base_defense
+        self._base_power = base_power
         self.fighting = None
         self.killer = None
         self.victims = []
@@ -34,6 +34,41 @@ class Fighter(BaseComponent):
         self._hp = max(0, min(value, self.max_hp))
         if self._hp == 0 and self.parent.ai:
             self.die()
+        self.stats_changed()
+
+    @property
+    def max_hp(self) -> int:
+        return self._max_hp
+
+    @max_hp.setter
+    def max_hp(self, value: int) -> None:
+        self._max_hp = value
+        self.stats_changed()
+
+    @property
+    def base_defense(self) -> int:
+        return self._base_defense
+
+    @base_defense.setter
+    def base_defense(self, value: int) -> None:
+        self._base_defense = value
+        self.stats_changed()
+
+    @property
+    def base_power(self) -> int:
+        return self._base_power
+
+    @base_power.setter
+    def base_power(self, value: int) -> None:
+        self._base_power = value
+        self.stats_changed()
+
+    def stats_changed(self) -> None:
+        """Copy this fighter's stats into the component store of the map its actor is on, if any."""
+        gamemap = getattr(self.parent, "parent", None)
+        components = getattr(gamemap, "components", None)
+        if components is not None:
+            components.update_stats(self.parent)
 
     @property
     def defense(self) -> int:
@@ -97,6 +132,7 @@ class Fighter(BaseComponent):
         self.parent.char = "%"
         self.parent.color = (191, 0, 0)
         self.parent.blocks_movement = False
+        self.parent.gamemap.relocate_entity(self.parent)
         self.parent.ai = None
         self.parent.name = f"remains of {self.parent.name}"
         self.parent.render_order = RenderOrder.CORPSE
@@ -105,10 +141,7 @@ class Fighter(BaseComponent):
             while self.parent.inventory.items:
                 item = self.parent.inventory.items.pop()
                 # print(f"Spilling inventory item upon death: {item.name}")
-                item.x = self.parent.x
-                item.y = self.parent.y
-                item.parent = self.engine.game_map
-                self.engine.game_map.entities.add(item)
+                item.place(self.parent.x, self.parent.y, self.engine.game_map)
                 # print(f"Map entities now: {[x.name for x in self.engine.game_map.entities]}")
                 
 
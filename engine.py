@@ -1,12 +1,12 @@
 from __future__ import annotations
 
-import lzma
-import pickle
 import random
+import uuid
 from datetime import datetime
 from pathlib import Path
 import os.path
-from typing import TYPE_CHECKING
+from time import perf_counter
+from typing import Dict, List, Optional, Set, Tuple, TYPE_CHECKING
 from components.equipment import Equipment
 
 import tcod
@@ -14,17 +14,26 @@ from tcod.console import Console
 from tcod.map import compute_fov
 import color
 
+from activity import ActivityTracker
 import exceptions
 from message_log import MessageLog
+from navigation import FlowField
+from scheduler import ACTION_COST, action_delay, TurnScheduler
 import render_functions
+import savefile
 from equipment_types import EquipmentType
 from sound import Sound
 from input_handlers import PostMortemViewer
+import timing
+import ui
 
 if TYPE_CHECKING:
+    from actions import Action
     from entity import Actor
     from maps import GameMap, GameWorld
     from camera import Camera
+    from autosave import Autosaver
+    from journal import Journal
 
 
 class Engine:
@@ -33,22 +42,128 @@ class Engine:
     camera: Camera
     sound: Sound
 
-    def __init__(self, player: Actor):
+    def __init__(self, player: Actor, sound: Optional[Sound] = None):
         self.message_log = MessageLog()
-        self.mortem_log = MessageLog()
+        self.mortem_log = MessageLog(capacity=None)  # The post-mortem is read whole, so keep all of it.
         self.mouse_location = (0, 0)
         self.player = player
         self.game_rules = None
-        self.sound = Sound()
-
-    def handle_enemy_turns(self) -> None:
-        for entity in set(self.game_map.actors) - {self.player}:
+        self.sound = sound if sound is not None else Sound()
+        self.player_flow_field: Optional[FlowField] = None
+        self.activity = ActivityTracker()
+        self.scheduler = TurnScheduler()
+        self.turn = 0
+        self.show_debug = False
+        self.timer = timing.PhaseTimer()
+        self.panes: Dict[str, ui.CachedPane] = {}
+        self.dirty = True  # Whether anything on screen changed since the last frame.
+        # Ids of the enemies in view, and whether one came into view this turn, which stops held movement keys.
+        self.enemies_in_view: Set[int] = set()
+        self.enemy_spotted = False
+        self.game_id = uuid.uuid4().hex  # Ties a journal to the game it was written for.
+        self.journal: Optional[Journal] = None
+        self.journal_seq = 0  # The last journal record this state includes.
+        self.autosaver: Optional[Autosaver] = None  # Set while an Autosaver is saving this game.
+        self.rng_state: Optional[Tuple] = None  # The random module's state, taken when a save is made.
+        self.save_path = "savegame.sav"
+        # Seconds played in earlier sessions, and when this session started.
+        self.played_seconds = 0.0
+        self.session_start = perf_counter()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Timings, cached panes and the per-turn flow field are only meaningful to this session.
+        del state["timer"]
+        state.pop("panes", None)
+        state.pop("enemies_in_view", None)
+        state["journal"] = None
+        state["autosaver"] = None
+        state["played_seconds"] = self.playtime
+        del state["session_start"]
+        state["player_flow_field"] = None
+        return state
+
+    def __setstate__(self, state):
+        # Saves from before the journal have none of these.
+        self.__dict__.update(game_id=uuid.uuid4().hex, journal=None, journal_seq=0, rng_state=None)
+        self.__dict__.update(save_path="savegame.sav", played_seconds=0.0, autosaver=None)
+        self.__dict__.update(state)
+        self.session_start = perf_counter()
+        self.timer = timing.PhaseTimer()
+        self.panes = {}
+        self.dirty = True
+        self.enemies_in_view = set()
+        self.enemy_spotted = False
+
+    @property
+    def playtime(self) -> float:
+        """Seconds this game has been played for, over every session."""
+        return self.played_seconds + perf_counter() - self.session_start
+
+    def delete_save(self) -> None:
+        """Delete this game's save and journal, e.g. once the game is over."""
+        if self.autosaver is not None:
+            self.autosaver.cancel()  # Otherwise a waiting autosave would write the save back.
+        if self.journal is not None:
+            self.journal.close()
+        savefile.release_mapped_arrays(self)  # The map may still be mapped from the save.
+        for path in (self.save_path, self.save_path + ".journal"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def get_player_flow_field(self) -> FlowField:
+        """Return the distance-to-player flow field for this turn, computing it on first use."""
+        target = self.player.x, self.player.y
+        flow_field = self.player_flow_field
+        if flow_field is None or flow_field.target != target:
+            flow_field = FlowField(self.game_map.navigation.cost, target)
+            self.player_flow_field = flow_field
+        return flow_field
+
+    def make_noise(self, x: int, y: int, radius: int) -> None:
+        """Wake up the actors that can hear a noise made at (x, y)."""
+        for actor in self.activity.wake(self.game_map, x, y, radius):
+            self.scheduler.wake(actor)
+
+    def handle_enemy_turns(self, elapsed: int = ACTION_COST) -> None:
+        """Let every actor whose next action falls within the `elapsed` time of the player's action act."""
+        self.turn += 1
+        self.game_map.lighting.begin_turn()
+        # Every chaser this turn shares one flow field, built the first time one of them needs it.
+        self.player_flow_field = None
+        # Only actors near the player (or woken by noise) are scheduled; far away ones are dropped until they wake.
+        woken, asleep = self.activity.update(self.game_map, self.player)
+        self.scheduler.advance(elapsed)
+        self.scheduler.sync(woken, asleep)
+
+        timer = self.timer
+        for time, entity in self.scheduler.due():
+            ai = entity.ai
+            if not ai or not entity.is_alive or entity.gamemap is not self.game_map:
+                continue
+            ai.action_cost = ACTION_COST
+            start = perf_counter()
+            try:
+                ai.perform()
+            except exceptions.Impossible:
+                pass  # Ignore impossible action exceptions from AI.
+            timer.add(f"ai.{type(ai).__name__}", perf_counter() - start)
+            if entity.is_alive:
+                delay = action_delay(ai.action_cost, entity.speed) * self.activity.slowdown(entity)
+                self.scheduler.schedule(entity, time + delay)
+
+    def end_turn(self, action: Action) -> None:
+        """Let the rest of the world react to an action the player just performed."""
+        with self.timer.phase("ai"):
+            self.handle_enemy_turns(action_delay(action.cost, self.player.speed))
+        with self.timer.phase("fov"):
+            self.update_fov()
+            self.update_enemies_in_view()
+        with self.timer.phase("lighting"):
             self.update_light_levels()
-            if entity.ai:
-                try:
-                    entity.ai.perform()
-                except exceptions.Impossible:
-                    pass  # Ignore impossible action exceptions from AI.
+        # Get the floor below ready while the player is busy on this one.
+        self.game_world.prefetch_next_floor()
+        self.dirty = True
 
     def update_fov(self) -> None:
         """Recompute the visible area based on the players point of view."""
@@ -62,94 +177,178 @@ class Engine:
         # If a tile is "visible" it should be added to "explored".
         # self.game_map.explored |= self.game_map.visible
 
+    def visible_enemies(self) -> List[Actor]:
+        """Return the living actors other than the player on tiles the player can see."""
+        return [actor for actor in self.game_map.components.visible(self.game_map.visible) if actor is not self.player]
+
+    def update_enemies_in_view(self) -> None:
+        """Note which enemies the player can see, and wake the ones that just came into view."""
+        in_view = self.visible_enemies()
+        spotted = [actor for actor in in_view if id(actor) not in self.enemies_in_view]
+        # Idle chasers only look around every few turns, so bring them forward rather than give the player free turns.
+        for actor in spotted:
+            self.scheduler.wake(actor)
+        self.enemy_spotted = bool(spotted)
+        self.enemies_in_view = {id(actor) for actor in in_view}
+
     def update_light_levels(self):
-        """ Create our light map for all static light entities """
-        self.game_map.light_levels[:] = 1
-        for light in [self.player]:
-            if light == self.player:
-                light_walls = True
-            else:
-                light_walls = self.game_map.visible[light.x][light.y]
-            coords = self.game_map.get_coords_in_radius(light.x, light.y, light.light_source.radius)
-            light_fov = compute_fov(
-                self.game_map.tiles['transparent'],
-                (light.x, light.y),
-                radius=light.light_source.radius,
-                # algorithm=tcod.FOV_BASIC,
-                algorithm=tcod.FOV_SYMMETRIC_SHADOWCAST,
-                light_walls=light_walls
-            )
-            for x, y in coords:
-                if light_fov[x][y]:
-                    distance = light.distance(x, y)
-                    brightness_diff = distance / (light.light_source.radius+2)
-                    if brightness_diff < self.game_map.light_levels[x][y]:
-                        self.game_map.light_levels[x][y] = brightness_diff
+        """ Refresh the light map if a light source or the tiles around it changed """
+        self.game_map.lighting.update()
 
         explored = (self.game_map.light_levels < 1) & self.game_map.visible
         self.game_map.explored |= explored
 
+    @property
+    def light_recomputes_this_turn(self) -> int:
+        """How many times the light map was rebuilt since the current turn began."""
+        return self.game_map.lighting.recomputes
+
 
     def render(self, console: Console) -> None:
         self.game_map.render(console)
+        self.render_side_panes(console)
+        self.render_message_log(console)
+
+        # render_functions.render_names_at_mouse_location(console=console, x=21, y=44, engine=self)
+        render_functions.render_names_at_mouse_location(console=console, x=int(self.game_world.viewport_width/2), y=self.game_world.viewport_height-3, engine=self)
+
+        if self.show_debug:
+            render_functions.render_debug_info(
+                console=console,
+                lines=[
+                    f"Turn {self.turn}  {self.activity.describe(self.game_map)}",
+                    f"Light rebuilds this turn: {self.light_recomputes_this_turn}",
+                    *self.timing_report(),
+                ],
+                location=(1, 0),
+            )
+
+    def timing_report(self) -> List[str]:
+        """Return debug lines with the average time of each phase and the slowest recent turns and frames."""
+        averages = self.timer.averages()
+        phases = [name for name in ("player_action", "ai", "fov", "lighting", "render", "present") if name in averages]
+        lines = ["Avg ms: " + " ".join(f"{name} {averages[name]:.1f}" for name in phases)]
+        for sample in self.timer.slowest(3):
+            lines.append(f"{sample.label}: {sample.total * 1000:.1f} ms - {timing.describe(sample, limit=3)}")
+        return lines
 
+    def render_side_panes(self, console: Console) -> None:
+        """Render the Vitals, character, Equipped and Inventory panes to the right of the map.
+
+        Each pane is drawn into its own offscreen console and only redrawn when what it shows changed.
+        """
         info_pane_x = self.game_world.viewport_width
         info_pane_width = console.width - info_pane_x
-        info_pane_height = self.game_world.viewport_height
-        # This is debug info.  Remove it later
-        info_pane_title = f'({self.player.x},{self.player.y})'
 
         sub_pane_x = info_pane_x + 1
         sub_pane_width = info_pane_width - 2
 
-        bar_pane_x = sub_pane_x
         bar_pane_y = 1
-        bar_pane_width = sub_pane_width
         bar_pane_height = 5
-        render_functions.draw_window(console, bar_pane_x, bar_pane_y, bar_pane_width, bar_pane_height, 'Vitals')
+        self.get_pane("vitals").render(
+            console, sub_pane_x, bar_pane_y, sub_pane_width, bar_pane_height,
+            key=(self.player.fighter.hp, self.player.fighter.max_hp),
+        )
+
+        char_pane_y = bar_pane_y + bar_pane_height
+        char_pane_height = 9
+        self.get_pane("character").render(
+            console, sub_pane_x, char_pane_y, sub_pane_width, char_pane_height,
+            key=(
+                self.player.x,
+                self.player.y,
+                self.player.currency.roubles,
+                self.player.fighter.power,
+                self.player.fighter.defense,
+                self.player.level.current_level,
+                self.player.level.current_xp,
+                self.player.level.experience_to_next_level,
+                self.game_world.current_floor,
+            ),
+        )
+
+        equip_pane_y = char_pane_y + char_pane_height
+        equip_pane_height = (len(self.player.equipment.item_slots) * 2) + 2
+        self.get_pane("equipment").render(
+            console, sub_pane_x, equip_pane_y, sub_pane_width, equip_pane_height,
+            key=tuple(
+                (id(slot.item), slot.item.equippable.ammo) if slot.item else None
+                for slot in self.player.equipment.item_slots
+            ),
+        )
+
+        inv_pane_y = equip_pane_y + equip_pane_height
+        # inv_pane_height = (len(self.player.inventory.items)) + 2
+        inv_pane_height = console.height - inv_pane_y - 1
+        self.get_pane("inventory").render(
+            console, sub_pane_x, inv_pane_y, sub_pane_width, inv_pane_height,
+            key=(
+                tuple(
+                    (id(item), item.ammo_container.ammo if item.ammo_container else None)
+                    for item in self.player.inventory.items
+                ),
+                tuple(id(slot.item) for slot in self.player.equipment.item_slots),
+            ),
+        )
+
+    def get_pane(self, name: str) -> ui.CachedPane:
+        """Return the cached pane with the given name, creating it the first time it is asked for."""
+        panes = self.panes
+        if name not in panes:
+            draw = {
+                "vitals": self.draw_vitals_pane,
+                "character": self.draw_character_pane,
+                "equipment": self.draw_equipment_pane,
+                "inventory": self.draw_inventory_pane,
+                "message_log": self.draw_message_log_pane,
+            }[name]
+            panes[name] = ui.CachedPane(draw)
+        return panes[name]
+
+    def draw_vitals_pane(self, console: Console, x: int, y: int, width: int, height: int) -> None:
+        render_functions.draw_window(console, x, y, width, height, 'Vitals')
 
         render_functions.render_bar(
             console=console,
             current_value=self.player.fighter.hp,
             maximum_value=self.player.fighter.max_hp,
-            total_width=bar_pane_width - 2,
-            location=(bar_pane_x+1,bar_pane_y + 1),
+            total_width=width - 2,
+            location=(x+1,y + 1),
             caption="HP",
             bar_fill_color=color.bar_filled,
             bar_empty_color=color.bar_empty,
             bar_text_color=color.bar_text
         )
 
-        char_pane_x =  sub_pane_x
-        char_pane_y = bar_pane_y + bar_pane_height
-        char_pane_width = sub_pane_width
-        char_pane_height = 9
-        render_functions.draw_window(console, char_pane_x, char_pane_y, char_pane_width, char_pane_height, info_pane_title)
+    def draw_character_pane(self, console: Console, x: int, y: int, width: int, height: int) -> None:
+        # This is debug info.  Remove it later
+        info_pane_title = f'({self.player.x},{self.player.y})'
+        render_functions.draw_window(console, x, y, width, height, info_pane_title)
 
         render_functions.render_rouble_amount(
             console=console,
             roubles=self.player.currency.roubles,
-            location=(char_pane_x+1, char_pane_y+4),
+            location=(x+1, y+4),
         )
 
         render_functions.render_char_stats(
             console=console,
             character=self.player,
-            location=(char_pane_x+1, char_pane_y+3),
+            location=(x+1, y+3),
         )
 
         render_functions.render_char_level(
             console=console,
             character=self.player,
-            location=(char_pane_x+1, char_pane_y+2),
+            location=(x+1, y+2),
         )
 
         render_functions.render_bar(
             console=console,
             current_value=self.player.level.current_xp,
             maximum_value=self.player.level.experience_to_next_level,
-            total_width=char_pane_width - 2,
-            location=(char_pane_x+1,char_pane_y + 1),
+            total_width=width - 2,
+            location=(x+1,y + 1),
             caption="EXP",
             bar_fill_color=color.yellow,
             bar_empty_color=color.window_border_bright,
@@ -158,30 +357,27 @@ class Engine:
         # render_functions.render_coordinates(
         #     console=console,
         #     coords=(self.player.x,self.player.y),
-        #     location=(char_pane_x + 1, char_pane_y + 2),
+        #     location=(x + 1, y + 2),
         # )
         # if self.player.equipment.item_is_equipped(EquipmentType.RANGED_WEAPON):
         #     render_functions.render_ammo_status(
         #         console=console,
         #         ammo=self.player.equipment.get_item_in_slot(EquipmentType.RANGED_WEAPON).equippable.ammo,
         #         max_ammo=self.player.equipment.get_item_in_slot(EquipmentType.RANGED_WEAPON).equippable.max_ammo,
-        #         location=(char_pane_x + 1, char_pane_y + 3),
+        #         location=(x + 1, y + 3),
         #     )
 
         render_functions.render_bunker_level(
             console=console,
             bunker_level=self.game_world.current_floor,
-            location=(char_pane_x + 1,char_pane_y + 7)
+            location=(x + 1,y + 7)
         )
 
-        equip_pane_x = sub_pane_x
-        equip_pane_y = char_pane_y + char_pane_height
-        equip_pane_width = sub_pane_width
-        equip_pane_height = (len(self.player.equipment.item_slots) * 2) + 2
-        render_functions.draw_window(console, equip_pane_x, equip_pane_y, equip_pane_width, equip_pane_height, 'Equipped')
+    def draw_equipment_pane(self, console: Console, x: int, y: int, width: int, height: int) -> None:
+        render_functions.draw_window(console, x, y, width, height, 'Equipped')
 
-        equip_y = equip_pane_y + 1
-        equip_x = equip_pane_x + 1
+        equip_y = y + 1
+        equip_x = x + 1
     
         for slot in self.player.equipment.item_slots:
             bg_color = None
@@ -201,17 +397,12 @@ class Engine:
             else:
                 console.print(equip_x, equip_y + 1, item_name)
             equip_y += 2
-        
 
-        inv_pane_x = sub_pane_x
-        inv_pane_y = equip_pane_y + equip_pane_height
-        inv_pane_width = sub_pane_width
-        # inv_pane_height = (len(self.player.inventory.items)) + 2
-        inv_pane_height = console.height - inv_pane_y - 1
-        render_functions.draw_window(console, inv_pane_x, inv_pane_y, inv_pane_width, inv_pane_height, 'Inventory')
+    def draw_inventory_pane(self, console: Console, x: int, y: int, width: int, height: int) -> None:
+        render_functions.draw_window(console, x, y, width, height, 'Inventory')
 
-        inv_y = inv_pane_y + 1
-        inv_x = inv_pane_x + 1
+        inv_y = y + 1
+        inv_x = x + 1
         for item in self.player.inventory.items:
             if(item.equippable):
                     is_equipped = (self.player.equipment.item_is_equipped(item.equippable.equipment_type) and self.player.equipment.get_item_in_slot(item.equippable.equipment_type) == item)
@@ -229,22 +420,23 @@ class Engine:
             console.print(inv_x, inv_y, f'- {item_string}')
             inv_y += 1
 
-        log_pane_x = 0
+    def render_message_log(self, console: Console) -> None:
+        """Render the game log below the map, redrawing it only when a message was added."""
         log_pane_y = 0 + self.game_world.viewport_height
         log_pane_width = self.game_world.viewport_width
         log_pane_height = console.height - log_pane_y - 1
-        render_functions.draw_window(console, log_pane_x, log_pane_y, log_pane_width, log_pane_height, 'Game Log')
+        self.get_pane("message_log").render(
+            console, 0, log_pane_y, log_pane_width, log_pane_height, key=self.message_log.version,
+        )
 
-        self.message_log.render(console=console,x=log_pane_x+1,y=log_pane_y+1,width=log_pane_width-2,height=log_pane_height-2)
+    def draw_message_log_pane(self, console: Console, x: int, y: int, width: int, height: int) -> None:
+        render_functions.draw_window(console, x, y, width, height, 'Game Log')
 
-        # render_functions.render_names_at_mouse_location(console=console, x=21, y=44, engine=self)
-        render_functions.render_names_at_mouse_location(console=console, x=int(log_pane_width/2), y=log_pane_y-3, engine=self)
+        self.message_log.render(console=console,x=x+1,y=y+1,width=width-2,height=height-2)
     
     def save_as(self, filename: str) -> None:
         """Save this Engine instance as a compressed file."""
-        save_data = lzma.compress(pickle.dumps(self))
-        with open(filename, "wb") as f:
-            f.write(save_data)
+        savefile.save(self, filename)
     
     def dump_character_log(self) -> None:
         post_mortem_path = 'mortem'
@@ -313,7 +505,7 @@ class Engine:
             post_mortem_lines.append('-- History ---------------------------------------------------\n\n')
             post_mortem_lines.append(' None\n\n')
             post_mortem_lines.append('-- Messages --------------------------------------------------\n\n')
-            for log_message in self.message_log.messages:
+            for log_message in self.message_log.iter_all():
                 post_mortem_lines.append(f' {log_message.full_text}\n')
             post_mortem_lines.append('-- General ---------------------------------------------------\n\n')
             #post_mortem_lines.append(' 2 brave souls have ventured into Phobos:\n')
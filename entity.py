@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import copy
+import functools
 import math
 from time import time
 from russian_names import RussianNames
@@ -13,6 +14,7 @@ from typing import Optional, Tuple, Type, TypeVar, TYPE_CHECKING, Union
 from pprint import pprint
 
 from render_order import RenderOrder
+from scheduler import NORMAL_SPEED
 
 if TYPE_CHECKING:
     from components.ai import BaseAI
@@ -31,6 +33,13 @@ if TYPE_CHECKING:
 
 T = TypeVar("T", bound="Entity")
 
+
+@functools.lru_cache(maxsize=None)
+def name_generator() -> RussianNames:
+    """The generator of actor names.  Setting one up reads in its name lists, so there is only ever one."""
+    return RussianNames(patronymic=False, name_reduction=True, transliterate=True)
+
+
 class Entity:
     """
     A generic object to represent players, enemies, items, etc.
@@ -63,25 +72,29 @@ class Entity:
         if parent:
             # If parent isn't provided now then it will be set later.
             self.parent = parent
-            parent.entities.add(self)
+            parent.add_entity(self)
 
     @property
     def gamemap(self) -> GameMap:
         return self.parent.gamemap
     
-    def spawn(self: T, gamemap: GameMap, x: int, y: int) -> T:
-        """Spawn a copy of this instance at the given location."""
+    def spawn(self: T, gamemap: GameMap, x: int, y: int, rng: Optional[random.Random] = None) -> T:
+        """Spawn a copy of this instance at the given location.
+
+        If `rng` is given the clone's kit is rolled with it and naming the clone is left to the caller,
+        since names always come from the random module.
+        """
         clone = copy.deepcopy(self)
         if(type(clone) == Actor):
-            if(clone.gen_name):
+            if(clone.gen_name and rng is None):
                 clone.name = clone.generate_russian_name()
 
             if(clone.inventory and clone.gen_kit):
-                clone.generate_kit()
+                clone.generate_kit(rng)
         clone.x = x
         clone.y = y
         clone.parent = gamemap
-        gamemap.entities.add(clone)
+        gamemap.add_entity(clone)
         return clone
     
     def place(self, x: int, y: int, gamemap: Optional[GameMap] = None) -> None:
@@ -90,10 +103,12 @@ class Entity:
         self.y = y
         if gamemap:
             if hasattr(self, "parent"):  # Possibly uninitialized.
-                if self.parent is self.gamemap:
-                    self.gamemap.entities.remove(self)
+                if self.parent is self.gamemap and self.parent is not gamemap:
+                    self.gamemap.remove_entity(self)
             self.parent = gamemap
-            gamemap.entities.add(self)
+            gamemap.add_entity(self)
+        elif hasattr(self, "parent") and self.parent is self.gamemap:
+            self.gamemap.relocate_entity(self)
 
     def distance(self, x: int, y: int) -> float:
         """
@@ -105,6 +120,8 @@ class Entity:
         # Move the entity by a given amount
         self.x += dx
         self.y += dy
+        if self.parent is self.gamemap:
+            self.gamemap.relocate_entity(self)
 
 class Actor(Entity):
     faction: Faction
@@ -129,7 +146,8 @@ class Actor(Entity):
         gen_kit: bool = False,
         light_source=None,
         skills=None,
-        visibility=5
+        visibility=5,
+        speed: int = NORMAL_SPEED,
     ):
         super().__init__(
             x=x,
@@ -176,12 +194,13 @@ class Actor(Entity):
             self.skills.parent = self
 
         self.visibility = visibility
+        self.speed = speed  # Actions take NORMAL_SPEED / speed times as long as usual.
 
         # if(gen_name):
         #     self.name = self.generate_russian_name()
 
-    def spawn(self: T, gamemap: GameMap, x: int, y: int) -> T:
-        super().spawn(gamemap=gamemap, x=x, y=y)
+    def spawn(self: T, gamemap: GameMap, x: int, y: int, rng: Optional[random.Random] = None) -> T:
+        return super().spawn(gamemap=gamemap, x=x, y=y, rng=rng)
 
     @property
     def is_alive(self) -> bool:
@@ -189,9 +208,9 @@ class Actor(Entity):
         return bool(self.ai)
 
     def generate_russian_name(self) -> str:
-        return RussianNames(patronymic=False, name_reduction=True, transliterate=True).get_person()
+        return name_generator().get_person()
     
-    def generate_kit(self):
+    def generate_kit(self, rng: Optional[random.Random] = None):
         # print(f"Generating kit...")
         
         shirt = copy.deepcopy(entity_factories.shirt)
@@ -199,7 +218,7 @@ class Actor(Entity):
         self.inventory.items.append(shirt)
         self.equipment.toggle_equip(shirt, add_message=False)
         
-        if(random.choice([True,False,True,True])):
+        if((rng or random).choice([True,False,True,True])):
             knife = copy.deepcopy(entity_factories.kitchen_knife)
             knife.parent = self.inventory
             self.inventory.items.append(knife)
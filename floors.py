@@ -0,0 +1,228 @@
+"""The floors the player has left, kept so they can go back to them."""
+from __future__ import annotations
+
+import collections
+import io
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import weakref
+import zlib
+from typing import Any, BinaryIO, Dict, NamedTuple, Optional, Tuple, TYPE_CHECKING
+
+import numpy as np  # type: ignore
+
+import savefile
+import tile_types
+
+if TYPE_CHECKING:
+    from maps import GameMap, GameWorld
+
+# Floors kept as they are, besides the one the player is on.
+LIVE_FLOORS = 2
+# Bytes of packed floors kept in memory.  Past this the least recently visited ones go to disk.
+MEMORY_BUDGET = 16 * 1024 * 1024
+
+
+class PackedFloor(NamedTuple):
+    """A floor compacted for keeping: its tiles compressed, its explored area as bits and the rest pickled."""
+    shape: Tuple[int, int]
+    tiles: bytes
+    explored: bytes
+    entities: bytes
+
+    @property
+    def size(self) -> int:
+        return len(self.tiles) + len(self.explored) + len(self.entities)
+
+
+class _LivePack:
+    """Packs a live floor once, for whichever needs it first: a save being written, or the registry."""
+
+    def __init__(self, game_map: GameMap, world: GameWorld):
+        self.game_map = game_map
+        self.world = world
+        self.lock = threading.Lock()
+        self.packed: Optional[PackedFloor] = None
+
+    def __call__(self) -> PackedFloor:
+        with self.lock:
+            if self.packed is None:
+                self.packed = pack(self.game_map, self.world)
+            return self.packed
+
+
+class _FloorPickler(pickle.Pickler):
+    """Pickles a GameMap by itself, swapping what belongs to the rest of the game for references to it."""
+
+    def __init__(self, file: BinaryIO, game_map: GameMap, world: GameWorld):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        engine = world.engine
+        self.references: Dict[int, str] = {id(engine): "engine", id(engine.player): "player", id(world): "world"}
+        for i, faction in enumerate(world.factions or ()):
+            self.references[id(faction)] = f"faction:{i}"
+        for name in savefile.MAP_ARRAYS:
+            self.references[id(getattr(game_map, name))] = "array"
+        for name in savefile.DERIVED_STATE:
+            self.references[id(getattr(game_map, name))] = "derived"
+
+    def persistent_id(self, obj: Any) -> Optional[str]:
+        return self.references.get(id(obj))
+
+
+class _FloorUnpickler(pickle.Unpickler):
+    def __init__(self, file: BinaryIO, world: GameWorld):
+        super().__init__(file)
+        self.world = world
+
+    def persistent_load(self, pid: str) -> Any:
+        if pid == "engine":
+            return self.world.engine
+        if pid == "player":
+            return self.world.engine.player
+        if pid == "world":
+            return self.world
+        if pid.startswith("faction:"):
+            return self.world.factions[int(pid[len("faction:"):])]
+        return None  # Filled in or rebuilt once the map is loaded.
+
+
+def pack(game_map: GameMap, world: GameWorld) -> PackedFloor:
+    """Compact a floor of `world` that the player isn't on."""
+    buffer = io.BytesIO()
+    _FloorPickler(buffer, game_map, world).dump(game_map)
+    return PackedFloor(
+        shape=game_map.tiles.shape,
+        tiles=zlib.compress(game_map.tiles.tobytes(order="F"), 6),
+        explored=np.packbits(game_map.explored.ravel(order="F")).tobytes(),
+        entities=zlib.compress(buffer.getvalue(), 6),
+    )
+
+
+def unpack(packed: PackedFloor, world: GameWorld) -> GameMap:
+    """Rebuild a floor compacted by `pack`."""
+    game_map = _FloorUnpickler(io.BytesIO(zlib.decompress(packed.entities)), world).load()
+    shape = tuple(packed.shape)
+    count = shape[0] * shape[1]
+    game_map.tiles = (
+        np.frombuffer(zlib.decompress(packed.tiles), dtype=tile_types.tile_dt).reshape(shape, order="F").copy(order="F")
+    )
+    explored = np.unpackbits(np.frombuffer(packed.explored, dtype=np.uint8), count=count)
+    game_map.explored = explored.reshape(shape, order="F").astype(bool)
+    # The navigation grid and lighting are built fresh from the new tiles, so there is no need for tiles_changed.
+    game_map.rebuild_derived_state()
+    return game_map
+
+
+class FloorRegistry:
+    """
+    Every floor the player has left, by floor number.
+
+    The `live_floors` most recently left floors are kept as they are.  Older ones are packed, and packed
+    floors stay in memory up to `memory_budget` bytes, after which the least recently left ones are written to
+    a temporary directory that is deleted along with the registry.  So memory stays bounded however deep a
+    game goes.  Saves hold every floor packed: live floors are packed once, by whoever writes the first save
+    that holds them, and floors on disk are copied from their files the same way.
+    """
+
+    def __init__(self, world: GameWorld, live_floors: int = LIVE_FLOORS, memory_budget: int = MEMORY_BUDGET):
+        self.world = world
+        self.live_floors = live_floors
+        self.memory_budget = memory_budget
+        # Each of these is in the order the floors were left, least recent first.
+        self.live: collections.OrderedDict[int, GameMap] = collections.OrderedDict()
+        self.packed: collections.OrderedDict[int, PackedFloor] = collections.OrderedDict()
+        self.on_disk: Dict[int, str] = {}
+        self.packed_bytes = 0
+        self.archive_dir: Optional[str] = None
+        # Packs of live floors that were saved, made once.  Nothing changes a floor while the player is away.
+        self._live_packed: Dict[int, _LivePack] = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_finalizer", None)
+        del state["_live_packed"]
+        # The floors on disk and the live ones are saved packed, along with the rest, least recently left first.
+        # Packed floors never change, nor do live ones while the player is away, so they are packed, pickled or
+        # copied by whoever writes the save.
+        packed: collections.OrderedDict[int, savefile.Deferred] = collections.OrderedDict()
+        for floor, path in self.on_disk.items():
+            packed[floor] = savefile.Deferred(path=path, length=os.path.getsize(path))
+        for floor, packed_floor in self.packed.items():
+            packed[floor] = savefile.Deferred(packed_floor)
+        for floor, game_map in self.live.items():
+            if floor not in self._live_packed:
+                self._live_packed[floor] = _LivePack(game_map, self.world)
+            packed[floor] = savefile.Deferred(factory=self._live_packed[floor])
+        state.update(live=collections.OrderedDict(), packed=packed, on_disk={}, archive_dir=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._live_packed = {}
+        self.packed_bytes = 0
+        for floor, packed in self.packed.items():
+            packed = savefile.resolve(packed)
+            if isinstance(packed, bytes):
+                packed = pickle.loads(packed)  # A floor file, copied into the save as it was.
+            self.packed[floor] = packed
+            self.packed_bytes += packed.size
+        self._enforce_budget()
+
+    def __contains__(self, floor: int) -> bool:
+        return floor in self.live or floor in self.packed or floor in self.on_disk
+
+    def __len__(self) -> int:
+        return len(self.live) + len(self.packed) + len(self.on_disk)
+
+    def store(self, floor: int, game_map: GameMap) -> None:
+        """Keep a floor the player just left, which must no longer hold the player."""
+        # A floor loaded from a save may still map its arrays from that file, which a later save replaces.
+        # Copying them here means no floor the registry keeps, live or packed, refers to the file.
+        savefile.release_map_arrays(game_map)
+        self.live[floor] = game_map
+        while len(self.live) > self.live_floors:
+            old_floor, old_map = self.live.popitem(last=False)
+            live_pack = self._live_packed.pop(old_floor, None)
+            self.packed[old_floor] = live_pack() if live_pack is not None else pack(old_map, self.world)
+            self.packed_bytes += self.packed[old_floor].size
+        self._enforce_budget()
+
+    def take(self, floor: int) -> GameMap:
+        """Remove the floor the player is going back to and return it."""
+        if floor in self.live:
+            live_pack = self._live_packed.pop(floor, None)
+            if live_pack is not None:
+                live_pack()  # A save still to pack the floor does so before the player changes it.
+            return self.live.pop(floor)
+        if floor in self.packed:
+            packed = self.packed.pop(floor)
+            self.packed_bytes -= packed.size
+        else:
+            path = self.on_disk.pop(floor)
+            packed = self._read(path)
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # Still open for a save being written, on systems that mind.  It goes with the directory.
+        return unpack(packed, self.world)
+
+    def _enforce_budget(self) -> None:
+        while self.packed_bytes > self.memory_budget and self.packed:
+            floor, packed = self.packed.popitem(last=False)
+            self.packed_bytes -= packed.size
+            if self.archive_dir is None:
+                self.archive_dir = tempfile.mkdtemp(prefix="lurker-floors-")
+                self._finalizer = weakref.finalize(self, shutil.rmtree, self.archive_dir, True)
+            # A new file each time, so a save still copying an old one for the same floor isn't disturbed.
+            fd, path = tempfile.mkstemp(prefix=f"floor-{floor}-", suffix=".pkl", dir=self.archive_dir)
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(packed, f, protocol=pickle.HIGHEST_PROTOCOL)
+            self.on_disk[floor] = path
+
+    @staticmethod
+    def _read(path: str) -> PackedFloor:
+        with open(path, "rb") as f:
+            return pickle.load(f)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Run the game without a window, audio or rendering, driven by scripted player actions."""
+from __future__ import annotations
+
+import argparse
+import random
+from typing import Callable, Optional, TYPE_CHECKING
+
+from actions import BumpAction, WaitAction
+import exceptions
+import setup_game
+from sound import NullSound
+
+if TYPE_CHECKING:
+    from actions import Action
+    from engine import Engine
+
+# A script decides the player's next action, or returns None to stop the run.
+Script = Callable[["Engine"], Optional["Action"]]
+
+DIRECTIONS = [(-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1)]
+
+
+def new_game(seed: Optional[int] = None, floors: int = 0, prefetch: bool = False) -> Engine:
+    """Build a new game with no audio, then descend `floors` floors below the overworld.
+
+    Floors are only generated in the background if `prefetch` is set, so turns take the same work every run.
+    """
+    if seed is not None:
+        random.seed(seed)
+    engine = setup_game.new_game(sound=NullSound())
+    engine.game_world.prefetch = prefetch
+    for _ in range(floors):
+        descend(engine)
+    return engine
+
+
+def descend(engine: Engine) -> None:
+    """Move the player down to the next floor, like taking the stairs does."""
+    engine.game_world.descend()
+    engine.update_fov()
+    engine.update_light_levels()
+
+
+def step(engine: Engine, action: Action) -> bool:
+    """Perform a player action and, if it worked, let the world take its turn.
+
+    This mirrors EventHandler.handle_action.  Returns True if a turn passed.
+    """
+    try:
+        with engine.timer.phase("player_action"):
+            action.perform()
+    except exceptions.Impossible as exc:
+        engine.message_log.add_message(exc.args[0])
+        return False  # Skip enemy turn on exceptions.
+
+    engine.end_turn(action)
+    engine.timer.finish(engine.turn)
+    return True
+
+
+def run(engine: Engine, script: Script, turns: int) -> int:
+    """Play up to `turns` turns from `script`.  Returns the number of turns that passed.
+
+    The run stops early if the player dies or the script runs out of actions.
+    Actions the player can't take don't count as turns, but they do use up one of the attempts.
+    """
+    turns_passed = 0
+    for _ in range(turns):
+        if not engine.player.is_alive:
+            break
+        action = script(engine)
+        if action is None:
+            break
+        if step(engine, action):
+            turns_passed += 1
+    return turns_passed
+
+
+def wander(engine: Engine) -> Action:
+    """A script that walks (or attacks) in a random direction every turn."""
+    return BumpAction(engine.player, *random.choice(DIRECTIONS))
+
+
+def wait(engine: Engine) -> Action:
+    """A script that stands still every turn."""
+    return WaitAction(engine.player)
+
+
+SCRIPTS = {
+    "wander": wander,
+    "wait": wait,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--floors", type=int, default=0, help="Floors to descend before playing.")
+    parser.add_argument("--turns", type=int, default=100)
+    parser.add_argument("--script", choices=sorted(SCRIPTS), default="wander")
+    args = parser.parse_args()
+
+    engine = new_game(seed=args.seed, floors=args.floors)
+    turns_passed = run(engine, SCRIPTS[args.script], args.turns)
+    print(
+        f"{turns_passed} turns passed, player {'alive' if engine.player.is_alive else 'dead'} "
+        f"with {engine.player.fighter.hp}/{engine.player.fighter.max_hp} HP, "
+        f"{len(engine.game_map.entities)} entities on the map."
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Callable, Optional, Tuple, TYPE_CHECKING, Union
+from typing import Callable, Iterable, List, Optional, Set, Tuple, TYPE_CHECKING, Union
 from equipment_types import EquipmentType
 
 import tcod
@@ -19,7 +19,6 @@ from actions import (
 )
 import color
 import exceptions
-import traceback
 import os
 import sys
 # import psutil
@@ -100,9 +99,53 @@ MainGameEventHandler will become the active handler.
 """
 
 
+REDRAW_EVENTS = (
+    tcod.event.KeyDown,
+    tcod.event.MouseButtonDown,
+    tcod.event.MouseWheel,
+    tcod.event.WindowEvent,
+)
+"""Events which usually change what is on screen, or need it drawn again (such as a resized window).
+
+Mouse motion is left out: handlers mark themselves dirty when the motion actually changes something.
+"""
+
+
+def coalesce_events(events: Iterable[tcod.event.Event]) -> List[tcod.event.Event]:
+    """Drain a batch of events, collapsing the key repeats of held movement keys.
+
+    Repeats queue up faster than slow turns can be played, so from each batch only the last repeat of a held
+    movement key is kept, and repeats queued before the key was released are dropped.  A held key then takes
+    at most one turn per batch, and the player stops when the key does.
+    """
+    kept: List[tcod.event.Event] = []
+    released: Set[int] = set()
+    repeated: Set[int] = set()
+    for event in reversed(list(events)):  # Newest first, so later events decide which earlier ones still count.
+        if isinstance(event, tcod.event.KeyUp):
+            released.add(event.sym)
+        elif isinstance(event, tcod.event.KeyDown) and event.sym in MOVE_KEYS:
+            if event.repeat:
+                if event.sym in released or event.sym in repeated:
+                    continue
+                repeated.add(event.sym)
+            else:
+                # Anything older belongs to an earlier press of this key.
+                released.discard(event.sym)
+                repeated.discard(event.sym)
+        kept.append(event)
+    kept.reverse()
+    return kept
+
+
 class BaseEventHandler(tcod.event.EventDispatch[ActionOrHandler]):
+    dirty = True  # Whether the screen needs to be rendered again.  A new handler always renders once.
+    redraw_interval: Optional[float] = None  # Seconds between on_redraw_timer calls, for animated screens.
+
     def handle_events(self, event: tcod.event.Event) -> BaseEventHandler:
         """Handle an event and return the next active event handler."""
+        if isinstance(event, REDRAW_EVENTS):
+            self.dirty = True
         state = self.dispatch(event)
         if isinstance(state, BaseEventHandler):
             return state
@@ -112,6 +155,14 @@ class BaseEventHandler(tcod.event.EventDispatch[ActionOrHandler]):
     def on_render(self, console: tcod.Console) -> None:
         raise NotImplementedError()
 
+    def on_redraw_timer(self) -> Optional[BaseEventHandler]:
+        """Called every `redraw_interval` seconds while this handler is active.  Animations advance here.
+
+        Returning a handler switches to it, for screens that move on by themselves.
+        """
+        self.dirty = True
+        return None
+
     def ev_quit(self, event: tcod.event.Quit) -> Optional[Action]:
         raise SystemExit()
 
@@ -146,8 +197,19 @@ class EventHandler(BaseEventHandler):
     def __init__(self, engine: Engine):
         self.engine = engine
 
+    @property
+    def dirty(self) -> bool:
+        """Handlers with an engine share its dirty flag, so changes to the game redraw whichever screen is up."""
+        return self.engine.dirty
+
+    @dirty.setter
+    def dirty(self, value: bool) -> None:
+        self.engine.dirty = value
+
     def handle_events(self, event: tcod.event.Event) -> BaseEventHandler:
         """Handle events for input handlers with an engine."""
+        if isinstance(event, REDRAW_EVENTS):
+            self.dirty = True
         action_or_state = self.dispatch(event)
         if isinstance(action_or_state, BaseEventHandler):
             return action_or_state
@@ -170,20 +232,30 @@ class EventHandler(BaseEventHandler):
         if action is None:
             return False
 
+        journal = self.engine.journal
+        # Encode the action before it runs, while any item it uses is still in the inventory.
+        entry = journal.encode_action(self.engine, action) if journal is not None else None
+
         try:
-            action.perform()
+            with self.engine.timer.phase("player_action"):
+                action.perform()
         except exceptions.Impossible as exc:
             self.engine.message_log.add_message(exc.args[0], color.impossible)
             return False  # Skip enemy turn on exceptions.
 
-        self.engine.handle_enemy_turns()
-        self.engine.update_fov()
+        self.engine.end_turn(action)
+        if journal is not None:
+            journal.record_action(self.engine, entry)
+        # One sample per turn, however many turns pass before the next frame.
+        self.engine.timer.finish(self.engine.turn)
         return True
 
 
     def ev_mousemotion(self, event: tcod.event.MouseMotion) -> None:
-        if self.engine.game_map.in_bounds(event.tile.x, event.tile.y):
-            self.engine.mouse_location = event.tile.x, event.tile.y
+        location = event.tile.x, event.tile.y
+        if self.engine.game_map.in_bounds(*location) and location != self.engine.mouse_location:
+            self.engine.mouse_location = location
+            self.dirty = True
 
     def on_render(self, console: tcod.Console) -> None:
         self.engine.render(console)
@@ -368,12 +440,10 @@ class LevelUpEventHandler(AskUserEventHandler):
         index = key - tcod.event.K_a
 
         if 0 <= index <= 2:
-            if index == 0:
-                player.level.increase_max_hp()
-            elif index == 1:
-                player.level.increase_power()
-            else:
-                player.level.increase_defense()
+            attribute = ("max_hp", "power", "defense")[index]
+            getattr(player.level, f"increase_{attribute}")()
+            if self.engine.journal is not None:
+                self.engine.journal.record_level_up(self.engine, attribute)
         else:
             self.engine.message_log.add_message("Invalid entry.", color.invalid)
 
@@ -395,8 +465,7 @@ class EscapeMenuEventHandler(AskUserEventHandler):
     
     def restart_game(self) -> None:
         """Handle restarting a finished game."""
-        if os.path.exists("savegame.sav"):
-            os.remove("savegame.sav")  # Deletes the active save file.
+        self.engine.delete_save()  # Deletes the active save file.
         # try:
         #     p = psutil.Process(os.getpid())
         #     for handler in p.open_files() + p.connections():
@@ -448,18 +517,29 @@ class EscapeMenuEventHandler(AskUserEventHandler):
         if event.sym == tcod.event.K_q:
             raise SystemExit()
         elif event.sym == tcod.event.K_l:
-            try:
-                return MainGameEventHandler(("savegame.sav"))
-            except FileNotFoundError:
-                return PopupMessage(self, "No saved game to load.")
-            except Exception as exc:
-                traceback.print_exc()  # Print to stderr.
-                return PopupMessage(self, f"Failed to load save:\n{exc}")
+            from loading import LoadingScreen
+            from setup_game import load_game
+
+            path = self.engine.save_path
+            if self.engine.autosaver is not None:
+                # The save and journal must be written and left alone before the worker reads them.
+                self.engine.autosaver.detach()
+            return LoadingScreen(
+                self, "Loading", lambda progress: load_game(path, progress), self.load_failed, on_loaded=self.use_sound
+            )
         elif event.sym == tcod.event.K_r:
             self.restart_game()
         
         return super().ev_keydown(event)
 
+    def use_sound(self, engine: Engine) -> None:
+        engine.sound = self.engine.sound
+
+    def load_failed(self, exc: Exception) -> BaseEventHandler:
+        if isinstance(exc, FileNotFoundError):
+            return PopupMessage(self, "No saved game to load.")
+        return PopupMessage(self, f"Failed to load save:\n{exc}")
+
     def ev_mousebuttondown(
         self, event: tcod.event.MouseButtonDown
     ) -> Optional[ActionOrHandler]:
@@ -502,7 +582,10 @@ class BasicMenuHandler(AskUserEventHandler):
       return MainGameEventHandler(self.engine)
 
   def ev_mousemotion(self, event):
+    cursor = self.menu.cursor
     self.menu.mouse_select(event.tile.x, event.tile.y)
+    if self.menu.cursor != cursor:
+      self.dirty = True
 
   def ev_mousebuttondown(self, event):
     selected = self.menu.mouse_select(event.tile.x, event.tile.y)
@@ -768,16 +851,11 @@ class FireSelectIndexHandler(AskUserEventHandler):
         # print(f"Player x,y           : {player.x},{player.y}")
         # print(f"Player x,y[viewport] : {player.x - viewport[0]},{player.y - viewport[1]}")
         engine.mouse_location = player.x - viewport[0], player.y - viewport[1]
-        enemies = []
-        for enemy in self.engine.game_map.enemies:
-            # print(f"Appending: ({enemy},{enemy.distance(player.x, player.y)})")
-            enemies.append((enemy,enemy.distance(player.x, player.y)))
-        enemies.sort(key=lambda enemies: enemies[1])
-        
-        for enemy,distance in enemies:
-            if self.engine.game_map.visible[enemy.x, enemy.y]:
+        # Start on the closest visible enemy.
+        for enemy in self.engine.game_map.components.visible(self.engine.game_map.visible, player.x, player.y):
+            if enemy is not player:
                 engine.mouse_location = (enemy.x- viewport[0],enemy.y- viewport[1])
-                break       
+                break
             
 
     def on_render(self, console: tcod.Console) -> None:
@@ -931,15 +1009,21 @@ class MainGameEventHandler(EventHandler):
             tcod.event.KMOD_LSHIFT | tcod.event.KMOD_RSHIFT
         ):
             return TakeStairsAction(player)
+        if key == tcod.event.K_COMMA and modifier & (
+            tcod.event.KMOD_LSHIFT | tcod.event.KMOD_RSHIFT
+        ):
+            return TakeStairsAction(player)
 
         if key in ACTIVATE_KEYS:
             # print(f'Pressing Activate Key')
-            if (player.x, player.y) == self.engine.game_map.downstairs_location:
+            if (player.x, player.y) in (self.engine.game_map.downstairs_location, self.engine.game_map.upstairs_location):
                 return TakeStairsAction(player)
             else:
                 return ActivateAction(player)
 
         if key in MOVE_KEYS:
+            if event.repeat and self.engine.enemy_spotted:
+                return None  # Stop a held key when a monster comes into view; it has to be pressed again.
             dx, dy = MOVE_KEYS[key]
             action = BumpAction(player, dx, dy)
         elif key in WAIT_KEYS:
@@ -953,6 +1037,9 @@ class MainGameEventHandler(EventHandler):
             return self.engine.game_map.reveal_map()
         elif key == tcod.event.K_F2:
             return self.engine.player.fighter.die()
+        elif key == tcod.event.K_F3:
+            self.engine.show_debug = not self.engine.show_debug
+            return None
         elif key == tcod.event.K_f:
             action =  player.equipment.get_item_in_slot(EquipmentType.RANGED_WEAPON).equippable.get_fire_action(player) if player.equipment.item_is_equipped(EquipmentType.RANGED_WEAPON) else None
 
@@ -983,14 +1070,12 @@ class GameOverEventHandler(EventHandler):
 
     def on_quit(self) -> None:
         """Handle exiting out of a finished game."""
-        if os.path.exists("savegame.sav"):
-            os.remove("savegame.sav")  # Deletes the active save file.
+        self.engine.delete_save()  # Deletes the active save file.
         raise exceptions.QuitWithoutSaving()  # Avoid saving a finished game.
 
     def on_restart(self) -> None:
         """Handle restarting a finished game."""
-        if os.path.exists("savegame.sav"):
-            os.remove("savegame.sav")  # Deletes the active save file.
+        self.engine.delete_save()  # Deletes the active save file.
         # try:
         #     p = psutil.Process(os.getpid())
         #     for handler in p.open_files() + p.connections():
@@ -1019,13 +1104,39 @@ CURSOR_Y_KEYS = {
 }
 
 
+def scroll_log(scroll: int, log_length: int, sym: int) -> Optional[int]:
+    """Return where a key moves a log view whose bottom line is `scroll` lines above the newest one.
+
+    Returns None for keys that don't scroll.  A `log_length` of 0 means the view hasn't been drawn yet, so its
+    length is unknown and the scroll is left for the view to clamp when it draws.
+    """
+    top = log_length - 1 if log_length else sys.maxsize  # The scroll with the oldest line at the bottom.
+    if sym in CURSOR_Y_KEYS:
+        adjust = CURSOR_Y_KEYS[sym]
+        if adjust < 0 and scroll == top:
+            # Only move from the top to the bottom when you're on the edge.
+            return 0
+        if adjust > 0 and scroll == 0:
+            # Same with bottom to top movement.
+            return top
+        # Otherwise move while staying clamped to the bounds of the history log.
+        return max(0, min(scroll - adjust, top))
+    if sym == tcod.event.K_HOME:
+        return top  # Move directly to the top message.
+    if sym == tcod.event.K_END:
+        return 0  # Move directly to the last message.
+    return None
+
+
 class HistoryViewer(EventHandler):
     """Print the history on a larger window which can be navigated."""
 
     def __init__(self, engine: Engine):
         super().__init__(engine)
-        self.log_length = len(engine.message_log.messages)
-        self.cursor = self.log_length - 1
+        # How many wrapped lines above the newest one the bottom of the window is.  Counting from the end means
+        # keys can scroll before the first render has measured the log at the window's width.
+        self.log_length = 0
+        self.scroll = 0
 
     def on_render(self, console: tcod.Console) -> None:
         super().on_render(console)  # Draw the main state as the background.
@@ -1039,33 +1150,23 @@ class HistoryViewer(EventHandler):
         )
 
         # Render the message log using the cursor parameter.
-        self.engine.message_log.render_messages(
+        log = self.engine.message_log
+        self.log_length = log.line_count(log_console.width - 2)
+        self.scroll = min(self.scroll, max(self.log_length - 1, 0))
+        log.render_lines(
             log_console,
             1,
             1,
             log_console.width - 2,
             log_console.height - 2,
-            self.engine.message_log.messages[: self.cursor + 1],
+            self.log_length - 1 - self.scroll,
         )
         log_console.blit(console, 3, 3)
 
     def ev_keydown(self, event: tcod.event.KeyDown) -> Optional[MainGameEventHandler]:
-        # Fancy conditional movement to make it feel right.
-        if event.sym in CURSOR_Y_KEYS:
-            adjust = CURSOR_Y_KEYS[event.sym]
-            if adjust < 0 and self.cursor == 0:
-                # Only move from the top to the bottom when you're on the edge.
-                self.cursor = self.log_length - 1
-            elif adjust > 0 and self.cursor == self.log_length - 1:
-                # Same with bottom to top movement.
-                self.cursor = 0
-            else:
-                # Otherwise move while staying clamped to the bounds of the history log.
-                self.cursor = max(0, min(self.cursor + adjust, self.log_length - 1))
-        elif event.sym == tcod.event.K_HOME:
-            self.cursor = 0  # Move directly to the top message.
-        elif event.sym == tcod.event.K_END:
-            self.cursor = self.log_length - 1  # Move directly to the last message.
+        scroll = scroll_log(self.scroll, self.log_length, event.sym)
+        if scroll is not None:
+            self.scroll = scroll
         else:  # Any other key moves back to the main game state.
             return MainGameEventHandler(self.engine)
         return None
@@ -1075,8 +1176,10 @@ class PostMortemViewer(EventHandler):
 
     def __init__(self, engine: Engine):
         super().__init__(engine)
-        self.log_length = len(engine.message_log.messages)
-        self.cursor = self.log_length - 1
+        # How many wrapped lines above the newest one the bottom of the window is.  Counting from the end means
+        # keys can scroll before the first render has measured the log at the window's width.
+        self.log_length = 0
+        self.scroll = 0
 
     def on_render(self, console: tcod.Console) -> None:
         super().on_render(console)  # Draw the main state as the background.
@@ -1090,33 +1193,23 @@ class PostMortemViewer(EventHandler):
         )
 
         # Render the message log using the cursor parameter.
-        self.engine.mortem_log.render_messages(
+        log = self.engine.mortem_log
+        self.log_length = log.line_count(postmortem_console.width - 2)
+        self.scroll = min(self.scroll, max(self.log_length - 1, 0))
+        log.render_lines(
             postmortem_console,
             1,
             1,
             postmortem_console.width - 2,
             postmortem_console.height - 2,
-            self.engine.mortem_log.messages[: self.cursor + 1],
+            self.log_length - 1 - self.scroll,
         )
         postmortem_console.blit(console, 3, 3)
 
     def ev_keydown(self, event: tcod.event.KeyDown) -> Optional[GameOverEventHandler]:
-        # Fancy conditional movement to make it feel right.
-        if event.sym in CURSOR_Y_KEYS:
-            adjust = CURSOR_Y_KEYS[event.sym]
-            if adjust < 0 and self.cursor == 0:
-                # Only move from the top to the bottom when you're on the edge.
-                self.cursor = self.log_length - 1
-            elif adjust > 0 and self.cursor == self.log_length - 1:
-                # Same with bottom to top movement.
-                self.cursor = 0
-            else:
-                # Otherwise move while staying clamped to the bounds of the history log.
-                self.cursor = max(0, min(self.cursor + adjust, self.log_length - 1))
-        elif event.sym == tcod.event.K_HOME:
-            self.cursor = 0  # Move directly to the top message.
-        elif event.sym == tcod.event.K_END:
-            self.cursor = self.log_length - 1  # Move directly to the last message.
+        scroll = scroll_log(self.scroll, self.log_length, event.sym)
+        if scroll is not None:
+            self.scroll = scroll
         elif event.sym in QUIT_KEYS:  # Any other key moves back to the main game state.
             # return MainGameEventHandler(self.engine)
             return GameOverEventHandler(self.engine)
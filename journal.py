@@ -0,0 +1,205 @@
+"""An append-only journal of the player's actions, kept between full saves.
+
+Each line of the journal is a JSON record.  The first names the game the journal belongs to, and each one
+after that is numbered and holds either a player action that took a turn or a level up choice.  Action records
+also hold a checksum of the random number generator's state after the turn.  A save remembers the number of
+the last record it includes, so loading it replays the records after that one to bring the game up to date.
+Replaying stops early if the checksums stop matching, which means the game went differently the second time.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import random
+import threading
+from typing import Dict, IO, List, Optional, TYPE_CHECKING
+
+import actions
+import color
+import exceptions
+
+if TYPE_CHECKING:
+    from engine import Engine
+    from entity import Item
+
+logger = logging.getLogger(__name__)
+
+# Actions recorded by class name, with how to read their arguments back.
+DIRECTION_ACTIONS = {cls.__name__: cls for cls in (actions.BumpAction, actions.MovementAction, actions.MeleeAction)}
+PLAIN_ACTIONS = {cls.__name__: cls for cls in (actions.PickupAction, actions.TakeStairsAction, actions.ActivateAction)}
+ITEM_ACTIONS = {cls.__name__: cls for cls in (actions.EquipAction, actions.ReloadAction)}
+TARGETED_ITEM_ACTIONS = {cls.__name__: cls for cls in (actions.ItemAction, actions.DropItemAction, actions.FireAction)}
+
+
+def rng_checksum() -> int:
+    """A checksum of the random module's state.  It is the same between runs, unlike most hashes."""
+    return hash(random.getstate()[1]) & 0xFFFFFFFF
+
+
+def item_index(engine: Engine, item: Optional[Item]) -> Optional[int]:
+    """Where `item` is in the player's inventory, which is how records refer to items."""
+    try:
+        return engine.player.inventory.items.index(item)
+    except ValueError:
+        return None
+
+
+def encode_action(engine: Engine, action: actions.Action) -> Optional[List]:
+    """Return a player action as a JSON friendly list, or None if it can't be recorded."""
+    name = type(action).__name__
+    if isinstance(action, actions.WaitAction):
+        return ["WaitAction", action.cost // actions.ACTION_COST]
+    if name in DIRECTION_ACTIONS:
+        return [name, action.dx, action.dy]
+    if name in PLAIN_ACTIONS:
+        return [name]
+    if name in ITEM_ACTIONS or name in TARGETED_ITEM_ACTIONS:
+        # No item, such as firing with nothing equipped, is recorded as such, so replay carries on past it.
+        index = None if action.item is None else item_index(engine, action.item)
+        if index is None and action.item is not None:
+            return None
+        if name in ITEM_ACTIONS:
+            return [name, index]
+        # FireAction leaves out its target when there is nothing to fire.
+        target_xy = getattr(action, "target_xy", None)
+        return [name, index, None if target_xy is None else list(target_xy)]
+    return None
+
+
+def decode_action(engine: Engine, data: List) -> actions.Action:
+    """Rebuild an action recorded by `encode_action`, for the player of `engine`."""
+    player = engine.player
+    name, args = data[0], data[1:]
+    if name == "WaitAction":
+        return actions.WaitAction(player, *args)
+    if name in DIRECTION_ACTIONS:
+        return DIRECTION_ACTIONS[name](player, *args)
+    if name in PLAIN_ACTIONS:
+        return PLAIN_ACTIONS[name](player)
+    item = None if args[0] is None else player.inventory.items[args[0]]
+    if name in ITEM_ACTIONS:
+        return ITEM_ACTIONS[name](player, item)
+    target_xy = None if args[1] is None else tuple(args[1])
+    return TARGETED_ITEM_ACTIONS[name](player, item, target_xy)
+
+
+def read(filename: str, game_id: str) -> List[Dict]:
+    """Read the records in a journal, or nothing if it is missing, unreadable or from another game."""
+    try:
+        with open(filename, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+    except OSError:
+        return []
+    records = []
+    for line in lines:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            break  # A line cut short by a crash ends the journal.
+    if not records or records[0].get("game") != game_id:
+        return []
+    return records[1:]
+
+
+def replay(engine: Engine, filename: str) -> int:
+    """Replay the records a loaded game is missing.  Returns how many were replayed."""
+    replayed = 0
+    start_turn = engine.turn
+    for record in read(filename, engine.game_id):
+        if record["seq"] <= engine.journal_seq:
+            continue
+        if record["seq"] != engine.journal_seq + 1 or not engine.player.is_alive:
+            break
+        if "level_up" in record:
+            getattr(engine.player.level, f"increase_{record['level_up']}")()
+        else:
+            if record["action"] is None:
+                break  # This turn couldn't be recorded, so nothing after it can be replayed.
+            try:
+                action = decode_action(engine, record["action"])
+                action.perform()
+            except (exceptions.Impossible, IndexError, TypeError):
+                break
+            engine.end_turn(action)
+            if rng_checksum() != record["rng"]:
+                logger.warning("Journal replay went differently at turn %d, stopping there", engine.turn)
+                engine.journal_seq = record["seq"]
+                replayed += 1
+                break
+        engine.journal_seq = record["seq"]
+        replayed += 1
+    if engine.turn > start_turn:
+        engine.message_log.add_message(
+            f"Replayed {engine.turn - start_turn} turns since the last save.", color.welcome_text
+        )
+    return replayed
+
+
+class Journal:
+    """
+    The journal file of a save, which the running game appends to.
+
+    `attach` points it at a game, the `record_` methods append a record and flush it, and `compact` drops
+    the records that a newly written save already includes.  Appending and compacting may happen on different
+    threads.
+    """
+
+    encode_action = staticmethod(encode_action)
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.game_id: Optional[str] = None
+        self._file: Optional[IO[str]] = None
+        self._lock = threading.Lock()
+
+    def attach(self, engine: Engine) -> None:
+        """Start journaling `engine`, keeping the records its save on disk may still need."""
+        with self._lock:
+            self.game_id = engine.game_id
+            # Records past where the game is now belong to a future that replay didn't reach.
+            self._rewrite([record for record in read(self.filename, self.game_id) if record["seq"] <= engine.journal_seq])
+        engine.journal = self
+
+    def record_action(self, engine: Engine, entry: Optional[List]) -> None:
+        """Record a player action that took a turn, as encoded by `encode_action` before it was performed."""
+        self._append(engine, {"turn": engine.turn, "action": entry, "rng": rng_checksum()})
+
+    def record_level_up(self, engine: Engine, attribute: str) -> None:
+        """Record a level up choice: "max_hp", "power" or "defense"."""
+        self._append(engine, {"turn": engine.turn, "level_up": attribute})
+
+    def _append(self, engine: Engine, record: Dict) -> None:
+        engine.journal_seq += 1
+        record["seq"] = engine.journal_seq
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+
+    def compact(self, seq: int) -> None:
+        """Drop the records up to `seq`, once a save that includes them is safely written."""
+        with self._lock:
+            if self._file is None:
+                return
+            self._rewrite([record for record in read(self.filename, self.game_id) if record["seq"] > seq])
+
+    def _rewrite(self, records: List[Dict]) -> None:
+        if self._file is not None:
+            self._file.close()
+        temp_filename = self.filename + ".tmp"
+        # A new game's slot directory may not exist until its first save is written.
+        os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+        with open(temp_filename, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"game": self.game_id}) + "\n")
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        os.replace(temp_filename, self.filename)
+        self._file = open(self.filename, "a", encoding="utf-8")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
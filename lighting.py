@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import functools
+from typing import Optional, Tuple, TYPE_CHECKING
+
+import numpy as np  # type: ignore
+import tcod
+from tcod.map import compute_fov
+
+if TYPE_CHECKING:
+    from entity import Entity
+    from maps import GameMap
+
+
+@functools.lru_cache(maxsize=None)
+def light_falloff(radius: int) -> np.ndarray:
+    """
+    Return the brightness falloff of a light with the given radius, as a (2r+1, 2r+1) array centred on the light.
+
+    A value of 0 is fully lit and 1 is unlit, matching GameMap.light_levels.  Tiles further than `radius`
+    from the centre are 1.  The array is shared between callers, so it is read-only.
+    """
+    offsets = np.arange(-radius, radius + 1)
+    distance = np.sqrt(offsets[:, np.newaxis] ** 2 + offsets[np.newaxis, :] ** 2)
+    falloff = np.where(distance <= radius, distance / (radius + 2), 1.0)
+    falloff.flags.writeable = False
+    return falloff
+
+
+class LightingSystem:
+    """
+    Owns the light map of a GameMap and rebuilds it only when something that affects it changed.
+
+    A light map depends on where each light source is, how far it reaches, and which tiles inside
+    that reach are transparent.  Those inputs are summarised in a signature after every rebuild,
+    and `update` skips the rebuild while the signature stays the same.
+    """
+
+    def __init__(self, gamemap: GameMap):
+        self.gamemap = gamemap
+        self._signature: Optional[Tuple] = None
+        self.recomputes = 0  # Rebuilds since the current turn began.
+        self.total_recomputes = 0
+
+    def begin_turn(self) -> None:
+        """Start counting rebuilds for a new turn."""
+        self.recomputes = 0
+
+    def invalidate(self) -> None:
+        """Force the next update to rebuild the light map, e.g. after tiles were changed."""
+        self._signature = None
+
+    def light_window(self, light: Entity) -> Tuple[slice, slice]:
+        """Return the slices of the map a light can reach, clipped to the map bounds."""
+        radius = light.light_source.radius
+        return (
+            slice(max(light.x - radius, 0), min(light.x + radius + 1, self.gamemap.width)),
+            slice(max(light.y - radius, 0), min(light.y + radius + 1, self.gamemap.height)),
+        )
+
+    def lights_walls(self, light: Entity) -> bool:
+        if light is self.gamemap.engine.player:
+            return True
+        return bool(self.gamemap.visible[light.x, light.y])
+
+    def light_signature(self, light: Entity) -> Tuple:
+        """Return everything about `light` that its contribution to the light map depends on."""
+        transparency = self.gamemap.tiles["transparent"][self.light_window(light)].tobytes()
+        return light.x, light.y, light.light_source.radius, self.lights_walls(light), transparency
+
+    def update(self) -> bool:
+        """Rebuild the light map if any light moved or its surroundings changed.
+
+        Returns True if the light map was rebuilt.
+        """
+        lights = list(self.gamemap.lights)
+        signature = tuple(sorted((id(light), self.light_signature(light)) for light in lights))
+        if signature == self._signature:
+            return False
+
+        self.recompute(lights)
+        self._signature = signature
+        self.recomputes += 1
+        self.total_recomputes += 1
+        return True
+
+    def recompute(self, lights) -> None:
+        """ Create our light map for all static light entities """
+        gamemap = self.gamemap
+        gamemap.light_levels[:] = 1
+        for light in lights:
+            radius = light.light_source.radius
+            x_window, y_window = self.light_window(light)
+            light_fov = compute_fov(
+                gamemap.tiles['transparent'][x_window, y_window],
+                (light.x - x_window.start, light.y - y_window.start),
+                radius=radius,
+                # algorithm=tcod.FOV_BASIC,
+                algorithm=tcod.FOV_SYMMETRIC_SHADOWCAST,
+                light_walls=self.lights_walls(light)
+            )
+            # Line the cached falloff up with the part of the window that is inside the map.
+            kernel_x = x_window.start - (light.x - radius)
+            kernel_y = y_window.start - (light.y - radius)
+            falloff = light_falloff(radius)[
+                kernel_x : kernel_x + light_fov.shape[0],
+                kernel_y : kernel_y + light_fov.shape[1],
+            ]
+            window_levels = gamemap.light_levels[x_window, y_window]
+            np.minimum(window_levels, np.where(light_fov, falloff, 1.0), out=window_levels)
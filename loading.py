@@ -0,0 +1,96 @@
+"""Start or load a game on a worker thread while the window keeps drawing a progress screen."""
+from __future__ import annotations
+
+import threading
+import traceback
+from typing import Callable, Optional, TYPE_CHECKING
+
+import tcod
+
+import color
+import input_handlers
+
+if TYPE_CHECKING:
+    from engine import Engine
+
+# Called by a loading job as it goes, with what it is doing now and how far along it is, from 0 to 1.
+Progress = Callable[[str, float], None]
+
+SPINNER = "|/-\\"
+
+
+def no_progress(stage: str, fraction: float) -> None:
+    """The progress callback for loading with no one watching."""
+
+
+class LoadingScreen(input_handlers.BaseEventHandler):
+    """
+    Run `job` on a worker thread and show its progress until it is done.
+
+    The job is given a `Progress` callback and returns the loaded Engine, which is given to `on_loaded` on the
+    main thread, if there is one, and then handed to a MainGameEventHandler.  If it raises, `on_error` is given
+    the exception and returns the handler to show instead.  The main loop keeps pumping events meanwhile, so
+    the window stays responsive.  The job must not touch anything the main thread is using, such as the audio
+    device; the game it builds is its own until it returns, and `on_loaded` is the place to finish it off.
+    """
+
+    redraw_interval = 0.1
+
+    def __init__(
+        self,
+        parent: input_handlers.BaseEventHandler,
+        title: str,
+        job: Callable[[Progress], Engine],
+        on_error: Callable[[Exception], input_handlers.BaseEventHandler],
+        on_loaded: Optional[Callable[[Engine], None]] = None,
+    ):
+        self.parent = parent
+        self.title = title
+        self.job = job
+        self.on_error = on_error
+        self.on_loaded = on_loaded
+        # Written by the worker, read by the main thread.  Each is replaced whole, never changed in place.
+        self.stage = "Starting"
+        self.fraction = 0.0
+        self.engine: Optional[Engine] = None
+        self.error: Optional[Exception] = None
+        self.frame = 0
+        self.worker = threading.Thread(target=self.run, name="loading", daemon=True)
+        self.worker.start()
+
+    def run(self) -> None:
+        try:
+            self.engine = self.job(self.progress)
+        except Exception as exc:
+            traceback.print_exc()  # Print to stderr.
+            self.error = exc
+
+    def progress(self, stage: str, fraction: float) -> None:
+        self.stage = stage
+        self.fraction = fraction
+
+    def on_redraw_timer(self) -> Optional[input_handlers.BaseEventHandler]:
+        if not self.worker.is_alive():
+            if self.error is not None:
+                return self.on_error(self.error)
+            assert self.engine is not None
+            if self.on_loaded is not None:
+                self.on_loaded(self.engine)
+            return input_handlers.MainGameEventHandler(self.engine)
+        self.frame += 1
+        self.dirty = True
+        return None
+
+    def on_render(self, console: tcod.Console) -> None:
+        self.parent.on_render(console)
+        width = min(console.width - 4, 40)
+        x = (console.width - width) // 2
+        y = console.height // 2 - 3
+        console.draw_frame(x, y, width, 6, title=self.title, clear=True, fg=color.white, bg=color.black)
+        stage = f"{SPINNER[self.frame % len(SPINNER)]} {self.stage}..."
+        console.print(x + 2, y + 2, stage[: width - 4], fg=color.menu_text)
+        bar_width = width - 4
+        filled = int(bar_width * min(max(self.fraction, 0.0), 1.0))
+        console.draw_rect(x + 2, y + 3, bar_width, 1, ch=ord(" "), bg=color.bar_empty)
+        if filled > 0:
+            console.draw_rect(x + 2, y + 3, filled, 1, ch=ord(" "), bg=color.bar_filled)
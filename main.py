@@ -1,12 +1,16 @@
 #!/usr/bin/env python3
+import time
 import traceback
+from typing import Optional
 
 import tcod
 
+import autosave
 import color
 import exceptions
 import input_handlers
 import setup_game
+import timing
 
 # WIDTH, HEIGHT = 720, 480
 WIDTH, HEIGHT = 1280, 720
@@ -14,13 +18,20 @@ WIDTH, HEIGHT = 1280, 720
 FLAGS = tcod.context.SDL_WINDOW_MAXIMIZED | tcod.context.SDL_WINDOW_RESIZABLE
 # FLAGS = tcod.context.SDL_WINDOW_RESIZABLE
 
-def save_game(handler: input_handlers.BaseEventHandler, filename: str) -> None:
-    """If the current event handler has an active Engine then save it."""
+def save_game(handler: input_handlers.BaseEventHandler) -> None:
+    """If the current event handler has an active Engine then save it to its slot."""
     if isinstance(handler, input_handlers.EventHandler):
-        handler.engine.save_as(filename)
+        handler.engine.save_as(handler.engine.save_path)
         print("Game saved.")
 
 
+def get_timer(handler: input_handlers.BaseEventHandler) -> timing.PhaseTimer:
+    """Return the phase timer of the current handler's engine, or a timer that records nothing."""
+    if isinstance(handler, input_handlers.EventHandler):
+        return handler.engine.timer
+    return timing.NULL_TIMER
+
+
 def main() -> None:
     screen_width = 80
     screen_height = 60
@@ -34,6 +45,8 @@ def main() -> None:
     )
 
     handler: input_handlers.BaseEventHandler = setup_game.MainMenu()
+    # Saves every few turns in the background, so a crash that skips the save on exit loses little.
+    autosaver = autosave.Autosaver()
 
     # root_console = context.new_console(
     #     min_columns=min_c,
@@ -59,15 +72,41 @@ def main() -> None:
         renderer=tcod.context.RENDERER_OPENGL2
     ) as context:
         try:
+            rendered_handler: Optional[input_handlers.BaseEventHandler] = None
+            next_redraw = None
             while True:
-                root_console.clear()
-                handler.on_render(console=root_console)
-                context.present(root_console, keep_aspect=True)
+                # Only draw when something on screen changed, so an idle game sleeps in tcod.event.wait.
+                if handler.dirty or handler is not rendered_handler:
+                    timer = get_timer(handler)
+                    with timer.phase("render"):
+                        root_console.clear()
+                        handler.on_render(console=root_console)
+                    with timer.phase("present"):
+                        context.present(root_console, keep_aspect=True)
+                    if isinstance(handler, input_handlers.EventHandler):
+                        timer.finish(handler.engine.turn, "frame")
+                    handler.dirty = False
+                    if handler is not rendered_handler:
+                        rendered_handler = handler
+                        next_redraw = None
+
+                # Handlers that animate ask to be woken up every redraw_interval seconds, even with no input.
+                timeout = None
+                if handler.redraw_interval is not None:
+                    if next_redraw is None:
+                        next_redraw = time.perf_counter() + handler.redraw_interval
+                    timeout = max(0.0, next_redraw - time.perf_counter())
 
                 try:
-                    for event in tcod.event.wait():
+                    # Take everything queued at once; the frame is only drawn again after the whole batch.
+                    for event in input_handlers.coalesce_events(tcod.event.wait(timeout)):
                         context.convert_event(event)
                         handler = handler.handle_events(event)
+                    if isinstance(handler, input_handlers.EventHandler):
+                        autosaver.update(handler.engine)
+                    if next_redraw is not None and handler is rendered_handler and time.perf_counter() >= next_redraw:
+                        next_redraw = time.perf_counter() + handler.redraw_interval
+                        handler = handler.on_redraw_timer() or handler
                 except Exception:  # Handle exceptions in game.
                     traceback.print_exc()  # Print error to stderr.
                     # Then print the error to the message log.
@@ -75,13 +114,17 @@ def main() -> None:
                         handler.engine.message_log.add_message(
                             traceback.format_exc(), color.error
                         )
+                        handler.dirty = True
         except exceptions.QuitWithoutSaving:
+            autosaver.flush()
             raise
         except SystemExit:  # Save and quit.
-            save_game(handler, "savegame.sav")
+            autosaver.flush()
+            save_game(handler)
             raise
         except BaseException:  # Save on any other unexpected exception.
-            save_game(handler, "savegame.sav")
+            autosaver.flush()
+            save_game(handler)
             raise
 
 
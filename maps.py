@@ -1,6 +1,9 @@
 from __future__ import annotations
 
-from typing import Iterable, Iterator, Optional, Tuple, List, TYPE_CHECKING
+from typing import Callable, Iterable, Iterator, Optional, Set, Tuple, List, TYPE_CHECKING
+import logging
+import random
+import threading
 
 import numpy as np  # type: ignore
 from tcod.console import Console
@@ -12,6 +15,7 @@ import math
 
 from pprint import pprint
 
+from component_store import ComponentStore
 from components.ai import HostileEnemy, HostileHumanEnemy
 from components.equipment import Equipment
 from components.fighter import Fighter
@@ -22,12 +26,18 @@ from components.lore import Lore
 
 from entity import Actor, Item
 from faction import Faction
+from floors import FloorRegistry
+from lighting import LightingSystem
+from navigation import NavigationGrid
+from spatial_index import SpatialIndex
 import tile_types
 
 if TYPE_CHECKING:
     from engine import Engine
     from entity import Entity
 
+logger = logging.getLogger(__name__)
+
 class Tile:
 
     def __init__(self, height,temp,precip,drainage, biome):
@@ -44,6 +54,8 @@ class Tile:
     prosperity = 0
 
 class GameMap:
+    upstairs_location: Optional[Tuple[int, int]] = None  # Where the stairs up are, on floors below the overworld.
+
     def __init__(
         self, engine: Engine, width: int, height: int, music: str,entities: Iterable[Entity] = ()
     ):
@@ -56,16 +68,40 @@ class GameMap:
         
         self.tiles = np.full((width, height), fill_value=tile_types.wall, order="F")
 
-        self.visible = np.full(
-            (width, height), fill_value=False, order="F"
-        )  # Tiles the player can currently see
         self.explored = np.full(
             (width, height), fill_value=False, order="F"
         )  # Tiles the player has seen before
 
-        self.light_levels = np.full((width, height), fill_value=1.0, order="F")
+        self.rebuild_derived_state()
 
         self.downstairs_location = (0, 0)
+        self.player_start = (0, 0)  # Where the player arrives, on floors generated without them.
+        self.rooms: List = []  # The rooms procgen dug out, if the generator has rooms.
+
+    def rebuild_derived_state(self) -> None:
+        """Build the lookups, visibility and light map, which can all be worked out from the entities and tiles.
+
+        Saves leave these out.  The visible area and light map stay blank until the engine next updates them.
+        """
+        # Per-tile lookup of the entities above, kept current by add_entity, remove_entity and relocate_entity.
+        self.spatial_index = SpatialIndex(self.width, self.height)
+        self.light_sources: Set[Entity] = set()
+        # Positions and combat stats of the actors, mirrored into arrays for batch queries.
+        self.components = ComponentStore()
+        for entity in self.entities:
+            self.spatial_index.add(entity)
+            if entity.light_source:
+                self.light_sources.add(entity)
+            if isinstance(entity, Actor):
+                self.components.add(entity)
+
+        self.visible = np.full(
+            (self.width, self.height), fill_value=False, order="F"
+        )  # Tiles the player can currently see
+
+        self.light_levels = np.full((self.width, self.height), fill_value=1.0, order="F")
+        self.lighting = LightingSystem(self)
+        self.navigation = NavigationGrid(self)
     
     @property
     def gamemap(self) -> GameMap:
@@ -95,7 +131,7 @@ class GameMap:
 
     @property
     def lights(self):
-        yield from(entity for entity in self.entities if entity.light_source and entity.light_source.radius > 0)
+        yield from(entity for entity in self.light_sources if entity.light_source.radius > 0)
 
     def get_size(self):
         return self.width, self.height
@@ -103,23 +139,66 @@ class GameMap:
     def reveal_map(self):
         self.explored = np.full((self.width, self.height), fill_value=True, order="F")
 
+    def add_entity(self, entity: Entity) -> None:
+        """Add an entity to this map, or re-index it if it is already here."""
+        self.entities.add(entity)
+        self.spatial_index.add(entity)
+        self.navigation.update_entity(entity)
+        if entity.light_source:
+            self.light_sources.add(entity)
+        if isinstance(entity, Actor):
+            self.components.add(entity)
+
+    def remove_entity(self, entity: Entity) -> None:
+        """Remove an entity from this map."""
+        self.entities.remove(entity)
+        self.spatial_index.remove(entity)
+        self.navigation.remove_entity(entity)
+        self.light_sources.discard(entity)
+        self.components.remove(entity)
+
+    def relocate_entity(self, entity: Entity) -> None:
+        """Update the lookups that depend on where an entity on this map is, or whether it blocks movement."""
+        self.spatial_index.update(entity)
+        self.navigation.update_entity(entity)
+        self.components.update_position(entity)
+
+    def tiles_changed(self, x_slice: slice = slice(None), y_slice: slice = slice(None)) -> None:
+        """Let the navigation grid and lighting know that tiles in this region were replaced."""
+        self.navigation.refresh_tiles(x_slice, y_slice)
+        self.lighting.invalidate()
+
+    def get_entities_at_location(self, x: int, y: int) -> Set[Entity]:
+        """Return every entity on the given tile."""
+        return self.spatial_index.at(x, y)
+
+    def get_entities_in_rect(self, x1: int, y1: int, x2: int, y2: int) -> Iterator[Entity]:
+        """Iterate over the entities inside the rectangle with inclusive corners (x1, y1) and (x2, y2)."""
+        return self.spatial_index.in_rect(x1, y1, x2, y2)
+
+    def get_entities_in_radius(self, x: int, y: int, radius: float) -> Iterator[Entity]:
+        """Iterate over the entities within `radius` tiles of (x, y)."""
+        return self.spatial_index.in_radius(x, y, radius)
+
+    def get_nearest_entities(
+        self, x: int, y: int, k: int = 1, predicate: Optional[Callable[[Entity], bool]] = None,
+    ) -> List[Entity]:
+        """Return the `k` entities closest to (x, y) that match `predicate`, nearest first."""
+        return self.spatial_index.nearest(x, y, k, predicate)
+
     def get_blocking_entity_at_location(
         self, location_x: int, location_y: int,
     ) -> Optional[Entity]:
-        for entity in self.entities:
-            if (
-                entity.blocks_movement
-                and entity.x == location_x
-                and entity.y == location_y
-            ):
+        for entity in self.spatial_index.at(location_x, location_y):
+            if entity.blocks_movement:
                 return entity
         
         return None
 
     def get_actor_at_location(self, x: int, y: int) -> Optional[Actor]:
-        for actor in self.actors:
-            if actor.x == x and actor.y == y:
-                return actor
+        for entity in self.spatial_index.at(x, y):
+            if isinstance(entity, Actor) and entity.is_alive:
+                return entity
 
         return None
     
@@ -172,53 +251,51 @@ class GameMap:
         If it isn't, but it's in the "explored" array, then draw it with the "dark" colors.
         Otherwise, the default is "SHROUD".
         """
+        s_x, s_y = self.get_viewport_slices()
+        graphics = self.get_tile_graphics(s_x, s_y)
+        self.render_lighting(console, s_x, s_y, graphics)
+        self.render_entities(console)
 
+    def get_viewport_slices(self) -> Tuple[slice, slice]:
+        """Return the slices of the map arrays that the viewport shows."""
         o_x, o_y, e_x, e_y = self.get_viewport()
-        s_x = slice(o_x, e_x+1)
-        s_y = slice(o_y,e_y+1)
-        viewport_tiles    = self.tiles[s_x,s_y]#[o_x:e_x+1,o_y:e_y + 1]
-        viewport_visible  = self.visible[s_x,s_y]
-        viewport_explored = self.explored[s_x,s_y]
+        return slice(o_x, e_x+1), slice(o_y,e_y+1)
 
-        # print(f'({o_x},{o_y}), ({e_x},{e_y})')
-        # print(f'Viewport Tiles: ({len(viewport_tiles)},{len(viewport_tiles[0])})')
-        # print(f'Viewport Visible: ({len(viewport_visible)},{len(viewport_visible[0])})')
-        # print(f'Viewport Explored: ({len(viewport_explored)},{len(viewport_explored[0])})')
+    def get_tile_graphics(self, s_x: slice, s_y: slice) -> np.ndarray:
+        """Return the unlit graphics of the viewport: "dark" colors where explored, "SHROUD" elsewhere."""
+        viewport_explored = self.explored[s_x,s_y]
 
-        console.tiles_rgb[0 : self.engine.game_world.viewport_width, 0 : self.engine.game_world.viewport_height] = np.select(
+        return np.select(
             condlist=[viewport_explored],
-            choicelist=[viewport_tiles["dark"]],
+            choicelist=[self.tiles[s_x,s_y]["dark"]],
             default=tile_types.SHROUD,
         )
 
-        player = self.engine.player
-        # Add our player light to our light map
-        light_levels = self.light_levels.copy()
-        viewport_light_levels = light_levels[s_x,s_y]
-        visible_light_levels = np.select(condlist=[viewport_visible], choicelist=[viewport_light_levels], default=1)
-        # Try some more dynamic lighting
-        lit = np.where(visible_light_levels < 1.0)
-        #print(lit)
-        # print(f'Player is at ({player.x},{player.y}).  These tile are lit: {lit}')
-
-        for i in range(len(lit[0])):
-            x, y = lit[0][i], lit[1][i]
-            brightness_diff = visible_light_levels[x][y]
-            # distance = self.engine.player.distance(x + o_x, y + o_y)
-            #brightness_diff = distance / (self.engine.player.visibility+2)
-            # print(f'({x},{y}) is lit, translated to ({x-o_x},{y-o_y}) in viewport.  Distance to player: {distance}.')
-            light_fg = viewport_tiles[x][y]['light']['fg']
-            light_bg = viewport_tiles[x][y]['light']['bg']
-            dark_fg = viewport_tiles[x][y]['dark']['fg']
-            dark_bg = viewport_tiles[x][y]['dark']['bg']
-            new_fg = []
-            new_bg = []
-            for j in range(0,3):
-                new_fg.append(light_fg[j] - int((light_fg[j] - dark_fg[j]) * brightness_diff))
-                new_bg.append(light_bg[j] - int((light_bg[j] - dark_bg[j]) * brightness_diff))
-            # print(f'Light fg:{light_fg}, bg:{light_bg}, Dark fg:{dark_fg}, bg{dark_bg}.  Multiplier: {brightness_diff}.  New fg:{new_fg}, bg:{new_bg}')
-            console.tiles_rgb['bg'][x,y] = tuple(new_bg)
-            console.tiles_rgb['fg'][x,y] = tuple(new_fg)
+    def render_lighting(self, console: Console, s_x: slice, s_y: slice, graphics: np.ndarray) -> None:
+        """Light the visible tiles of the viewport graphics by the light map, and draw them to the console."""
+        viewport_tiles    = self.tiles[s_x,s_y]
+        viewport_visible  = self.visible[s_x,s_y]
+
+        visible_light_levels = np.where(viewport_visible, self.light_levels[s_x, s_y], 1.0)
+        lit = visible_light_levels < 1.0
+
+        # Blend every lit tile from its "light" towards its "dark" colors by its light level, all at once.
+        # Signed math keeps channels where the dark color is brighter than the light one from wrapping around.
+        weight = visible_light_levels[..., np.newaxis]
+        blended = graphics.copy()
+        for channel in ("fg", "bg"):
+            light = viewport_tiles["light"][channel].astype(np.int16)
+            dark = viewport_tiles["dark"][channel]
+            blended[channel] = light - ((light - dark) * weight).astype(np.int16)
+
+        console.tiles_rgb[0 : self.engine.game_world.viewport_width, 0 : self.engine.game_world.viewport_height] = np.where(
+            lit, blended, graphics
+        )
+
+    def render_entities(self, console: Console) -> None:
+        """Draw the entities standing on visible, lit tiles, on top of the map."""
+        o_x, o_y, _, _ = self.get_viewport()
+        light_levels = self.light_levels
 
         entities_sorted_for_rendering = sorted(
             self.entities, key=lambda x: x.render_order.value
@@ -236,7 +313,8 @@ class GameMap:
 
 class GameWorld:
     """
-    Holds the settings for the GameMap, and generates new maps when moving down the stairs.
+    Holds the settings for the GameMap, generates new maps when moving down the stairs, and keeps the floors
+    the player has left so they can go back up.
     """
     engine: Engine
     viewport_width: int
@@ -279,6 +357,14 @@ class GameWorld:
         self.room_max_size = room_max_size
 
         self.current_floor = current_floor
+        # The seed of the floor below.  It is drawn on the main thread, so prefetching doesn't change the game's rolls.
+        self.next_floor_seed: Optional[int] = None
+        self._prefetch: Optional[FloorPrefetch] = None
+        # Whether to generate the floor below in the background.  Headless runs and benchmarks turn it off, so a
+        # worker thread doesn't add noise to their timings.  It isn't saved.
+        self.prefetch = True
+        # The floors the player has left, to go back to.
+        self.floors = FloorRegistry(self)
 
         self.factions = None
 
@@ -313,30 +399,116 @@ class GameWorld:
             map_height=random_map_height,
             engine=self.engine,
         )
-    def generate_floor(self) -> None:
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_prefetch"] = None
+        del state["prefetch"]
+        return state
+
+    def __setstate__(self, state):
+        # Worlds saved before floors had seeds draw the next one when it is needed.
+        self.__dict__.update(next_floor_seed=None, _prefetch=None, prefetch=True)
+        self.__dict__.update(state)
+        if "floors" not in state:
+            self.floors = FloorRegistry(self)  # Nor did worlds from before the player could go back up.
+
+    def build_floor(self, floor: int, seed: int) -> GameMap:
+        """Generate floor number `floor` from `seed`.
+
+        This reads nothing but the world's settings and changes nothing, so it can run on any thread.  The
+        same floor and seed always give the same map, wherever it was generated.
+        """
         from procgen import generate_bsp_dungeon
         from procgen import generate_dungeon
 
-        self.current_floor += 1
+        rng = random.Random(seed)
+        random_map_width = rng.randint(self.min_map_width+1, self.min_map_width+128)
+        random_map_height = rng.randint(self.min_map_height+1, self.min_map_height+128)
 
-        random_map_width = randint(self.min_map_width+1, self.min_map_width+128)
-        random_map_height = randint(self.min_map_height+1, self.min_map_height+128)
-        
-        if(self.current_floor % 3):
-            self.engine.game_map = generate_dungeon(
-                max_rooms=self.max_rooms,
-                room_min_size=self.room_min_size,
-                room_max_size=self.room_max_size,
-                map_width=random_map_width,
-                map_height=random_map_height,
-                engine=self.engine,
-            )
+        generate = generate_dungeon if floor % 3 else generate_bsp_dungeon
+        return generate(
+            max_rooms=self.max_rooms,
+            room_min_size=self.room_min_size,
+            room_max_size=self.room_max_size,
+            map_width=random_map_width,
+            map_height=random_map_height,
+            engine=self.engine,
+            floor_number=floor,
+            rng=rng,
+        )
+
+    def prefetch_next_floor(self) -> None:
+        """Start generating the floor below on a worker thread, unless it exists or that has already started."""
+        floor = self.current_floor + 1
+        if floor in self.floors:
+            return
+        if self.next_floor_seed is None:
+            self.next_floor_seed = random.getrandbits(64)
+        if not self.prefetch:
+            return  # The seed is drawn all the same, so the game's rolls don't depend on prefetching.
+        if self._prefetch is None or self._prefetch.key != (floor, self.next_floor_seed):
+            self._prefetch = FloorPrefetch(self, floor, self.next_floor_seed)
+
+    def generate_floor(self, floor: int) -> GameMap:
+        """Generate a floor the player hasn't been to, using the prefetched one if there is one."""
+        if self.next_floor_seed is None:
+            self.next_floor_seed = random.getrandbits(64)
+        seed = self.next_floor_seed
+        prefetch, self._prefetch = self._prefetch, None
+
+        game_map = None
+        if prefetch is not None and prefetch.key == (floor, seed):
+            game_map = prefetch.result()
+        if game_map is None:
+            game_map = self.build_floor(floor, seed)
+
+        self.next_floor_seed = random.getrandbits(64)
+        # Names come from the random module, so they are given out here on the main thread, in a set order.
+        for actor in sorted(game_map.actors, key=lambda actor: (actor.x, actor.y)):
+            if actor.gen_name:
+                actor.name = actor.generate_russian_name()
+        return game_map
+
+    def descend(self) -> None:
+        """Move the player down a floor, generating it if they haven't been there before."""
+        floor = self.current_floor + 1
+        if floor in self.floors:
+            game_map = self.floors.take(floor)
         else:
-            self.engine.game_map = generate_bsp_dungeon(
-                max_rooms=self.max_rooms,
-                room_min_size=self.room_min_size,
-                room_max_size=self.room_max_size,
-                map_width=random_map_width,
-                map_height=random_map_height,
-                engine=self.engine,
-            )
\ No newline at end of file
+            game_map = self.generate_floor(floor)
+        self.enter_floor(floor, game_map, game_map.upstairs_location)
+
+    def ascend(self) -> None:
+        """Move the player back up a floor, to its stairs down."""
+        floor = self.current_floor - 1
+        game_map = self.floors.take(floor)
+        self.enter_floor(floor, game_map, game_map.downstairs_location)
+
+    def enter_floor(self, floor: int, game_map: GameMap, location: Tuple[int, int]) -> None:
+        """Put the player at `location` on `game_map`, and keep the floor they left."""
+        old_map = self.engine.game_map
+        self.engine.player.place(*location, game_map)
+        self.floors.store(self.current_floor, old_map)
+        self.current_floor = floor
+        self.engine.game_map = game_map
+
+
+class FloorPrefetch:
+    """A floor being generated on a worker thread, before the player goes down to it."""
+
+    def __init__(self, world: GameWorld, floor: int, seed: int):
+        self.key = floor, seed
+        self.game_map: Optional[GameMap] = None
+        self.thread = threading.Thread(target=self.run, args=(world,), name="floor-prefetch", daemon=True)
+        self.thread.start()
+
+    def run(self, world: GameWorld) -> None:
+        try:
+            self.game_map = world.build_floor(*self.key)
+        except Exception:
+            logger.exception("Generating floor %d in the background failed", self.key[0])
+
+    def result(self) -> Optional[GameMap]:
+        """Wait for the floor to be finished and return it, or None if generating it failed."""
+        self.thread.join()
+        return self.game_map
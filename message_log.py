@@ -1,17 +1,40 @@
-from typing import Iterable, List, Reversible, Tuple
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Reversible, Tuple
+import bisect
+import collections
+import itertools
+import json
+import lzma
+import os
+import tempfile
 import textwrap
+import weakref
 
 import tcod
 
 import color
+import savefile
+
+# How many messages a log keeps in memory before it moves the oldest ones to its archive file.
+DEFAULT_CAPACITY = 1000
+# How many widths a message keeps its wrappings at, which is more than the game draws the log at.
+MAX_WRAP_WIDTHS = 4
 
 
 class Message:
+    # Wrappings by width, as (count, lines).  The same messages are drawn every frame, at the width of the log
+    # panel and of whichever log viewer is open, so each width is kept rather than just the last one.
+    _wrapped: Optional[Dict[int, Tuple[int, List[str]]]] = None
+
     def __init__(self, text: str, fg: Tuple[int, int, int]):
         self.plain_text = text
         self.fg = fg
         self.count = 1
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_wrapped", None)
+        return state
+
     @property
     def full_text(self) -> str:
         """The full text of this message, including the count if necessary."""
@@ -19,10 +42,70 @@ class Message:
             return f"{self.plain_text} (x{self.count})"
         return self.plain_text
 
+    def wrap(self, width: int) -> List[str]:
+        """Return the full text wrapped to `width`, reusing an earlier wrapping to that width when nothing changed."""
+        if self._wrapped is None:
+            self._wrapped = {}
+        wrapped = self._wrapped.get(width)
+        if wrapped is None or wrapped[0] != self.count:
+            if len(self._wrapped) >= MAX_WRAP_WIDTHS:
+                self._wrapped.clear()  # Start over rather than grow, should the widths ever change.
+            wrapped = self._wrapped[width] = (self.count, list(MessageLog.wrap(self.full_text, width)))
+        return wrapped[1]
+
 
 class MessageLog:
-    def __init__(self) -> None:
-        self.messages: List[Message] = []
+    """
+    The most recent messages, held in memory in a ring buffer of at most `capacity` messages.
+
+    When the buffer is full the oldest quarter is appended to an lzma compressed archive file,
+    which `iter_all` reads back.  A `capacity` of None keeps every message in memory.  Each spill is a chunk
+    of the archive that can be read back by itself, so paging through old lines only reads the chunks shown.
+    """
+
+    def __init__(self, capacity: Optional[int] = DEFAULT_CAPACITY) -> None:
+        self.messages: Deque[Message] = collections.deque()
+        self.capacity = capacity
+        self.archived = 0  # The number of messages moved to the archive.
+        self.archive_path: Optional[str] = None
+        self.archive_chunks: List[Tuple[int, int]] = []  # The byte offset and message count of each spill.
+        self.version = 0  # Bumped on every change, so renderers can tell when the log needs redrawing.
+        # Line offsets of each message as (width, version, offsets), for paging through the log by line.
+        self._line_index: Optional[Tuple[int, int, List[int]]] = None
+        # Line offsets of each archive chunk as (width, archived, offsets), and the last chunk read back.
+        self._archive_index: Optional[Tuple[int, int, List[int]]] = None
+        self._page: Optional[Tuple[int, List[Message]]] = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_finalizer", None)
+        state["_line_index"] = None
+        state["_archive_index"] = None
+        state["_page"] = None
+        # Save the archive itself, still compressed, rather than a path to a temporary file.  Only the part
+        # written so far is saved, so later spills don't matter.
+        state["archive_path"] = None
+        state["archive_data"] = b""
+        if self.archive_path is not None:
+            state["archive_data"] = savefile.Deferred(
+                path=self.archive_path, length=os.path.getsize(self.archive_path)
+            )
+        return state
+
+    def __setstate__(self, state):
+        archive_data = savefile.resolve(state.pop("archive_data", b""))
+        # Logs saved before the buffer was bounded have none of these.
+        self.__dict__.update(capacity=DEFAULT_CAPACITY, archived=0, archive_path=None, version=0, _line_index=None)
+        self.__dict__.update(_archive_index=None, _page=None)
+        self.__dict__.update(state)
+        if "archive_chunks" not in state:
+            # Archives saved before chunks were tracked are read back as one chunk.
+            self.archive_chunks = [(0, self.archived)] if self.archived else []
+        self.messages = collections.deque(self.messages)
+        if archive_data:
+            self._open_archive()
+            with open(self.archive_path, "wb") as f:
+                f.write(archive_data)
 
     def add_message(
         self, text: str, fg: Tuple[int, int, int] = color.white, *, stack: bool = True,
@@ -36,6 +119,60 @@ class MessageLog:
             self.messages[-1].count += 1
         else:
             self.messages.append(Message(text, fg))
+            if self.capacity is not None and len(self.messages) > self.capacity:
+                self.spill(max(1, self.capacity // 4))
+        self.version += 1
+
+    def _open_archive(self) -> None:
+        """Create the temporary archive file, which is deleted along with this log."""
+        fd, self.archive_path = tempfile.mkstemp(prefix="lurker-log-", suffix=".jsonl.xz")
+        os.close(fd)
+        self._finalizer = weakref.finalize(self, os.remove, self.archive_path)
+
+    def spill(self, count: int) -> None:
+        """Move the oldest `count` messages from memory to the archive."""
+        if self.archive_path is None:
+            self._open_archive()
+        count = min(count, len(self.messages))
+        self.archive_chunks.append((os.path.getsize(self.archive_path), count))
+        # Each append adds another lzma stream to the file, which lzma.open reads back as one.
+        with lzma.open(self.archive_path, "at", encoding="utf-8") as f:
+            for _ in range(count):
+                message = self.messages.popleft()
+                f.write(json.dumps([message.plain_text, message.fg, message.count]) + "\n")
+                self.archived += 1
+
+    def iter_archived(self) -> Iterator[Message]:
+        """Read back the messages moved to the archive, oldest first."""
+        if self.archive_path is None:
+            return
+        with lzma.open(self.archive_path, "rt", encoding="utf-8") as f:
+            for line in f:
+                yield self._decode(line)
+
+    @staticmethod
+    def _decode(line: str) -> Message:
+        text, fg, count = json.loads(line)
+        message = Message(text, tuple(fg))
+        message.count = count
+        return message
+
+    def read_chunk(self, index: int) -> List[Message]:
+        """Read back one chunk of the archive, keeping the last one read for the next call."""
+        page = self._page
+        if page is None or page[0] != index:
+            start, count = self.archive_chunks[index]
+            with open(self.archive_path, "rb") as raw:
+                raw.seek(start)
+                with lzma.open(raw, "rt", encoding="utf-8") as f:
+                    messages = [self._decode(line) for line in itertools.islice(f, count)]
+            page = self._page = (index, messages)
+        return page[1]
+
+    def iter_all(self) -> Iterator[Message]:
+        """Every message this log was given, oldest first, including archived ones."""
+        yield from self.iter_archived()
+        yield from self.messages
 
     def render(
         self, console: tcod.Console, x: int, y: int, width: int, height: int,
@@ -46,6 +183,72 @@ class MessageLog:
         """
         self.render_messages(console, x, y, width, height, self.messages)
 
+    def line_offsets(self, width: int) -> List[int]:
+        """Return the first wrapped line of each message in memory, plus the total line count at the end."""
+        index = self._line_index
+        if index is None or index[0] != width or index[1] != self.version:
+            offsets = [0]
+            for message in self.messages:
+                offsets.append(offsets[-1] + len(message.wrap(width)))
+            index = self._line_index = (width, self.version, offsets)
+        return index[2]
+
+    def archive_line_offsets(self, width: int) -> List[int]:
+        """Return the first wrapped line of each archive chunk, plus the archive's line count at the end.
+
+        The archive only grows when messages are spilled, so this reads it through once per width and spill.
+        """
+        index = self._archive_index
+        if index is None or index[0] != width or index[1] != self.archived:
+            offsets = [0]
+            for chunk in range(len(self.archive_chunks)):
+                offsets.append(offsets[-1] + sum(len(message.wrap(width)) for message in self.read_chunk(chunk)))
+            index = self._archive_index = (width, self.archived, offsets)
+        return index[2]
+
+    def line_count(self, width: int) -> int:
+        """The number of lines every message, archived ones included, takes up when wrapped to `width`."""
+        return self.archive_line_offsets(width)[-1] + self.line_offsets(width)[-1]
+
+    def iter_lines(self, width: int, start: int, stop: int) -> Iterator[Tuple[str, Tuple[int, int, int]]]:
+        """Yield the wrapped lines numbered `start` up to `stop` as (text, color), skipping the messages before them.
+
+        Lines are numbered over the archived messages followed by the ones in memory.
+        """
+        start = max(0, start)
+        archive_offsets = self.archive_line_offsets(width)
+        archived_lines = archive_offsets[-1]
+        if start < archived_lines:
+            # Page in the archive from the chunk holding `start`, then carry on into the messages in memory.
+            first_chunk = bisect.bisect_right(archive_offsets, start) - 1
+            line_number = archive_offsets[first_chunk]
+            messages: Iterable[Message] = itertools.chain(
+                itertools.chain.from_iterable(
+                    self.read_chunk(chunk) for chunk in range(first_chunk, len(self.archive_chunks))
+                ),
+                self.messages,
+            )
+        else:
+            offsets = self.line_offsets(width)
+            first = bisect.bisect_right(offsets, start - archived_lines) - 1
+            line_number = archived_lines + offsets[first]
+            messages = itertools.islice(self.messages, first, None)
+        for message in messages:
+            for line in message.wrap(width):
+                if line_number >= stop:
+                    return
+                if line_number >= start:
+                    yield line, message.fg
+                line_number += 1
+
+    def render_lines(
+        self, console: tcod.Console, x: int, y: int, width: int, height: int, last_line: int,
+    ) -> None:
+        """Render the lines ending at `last_line`, with that line at the bottom of the area."""
+        first_line = last_line - height + 1
+        for line_number, (line, fg) in enumerate(self.iter_lines(width, first_line, last_line + 1), max(0, first_line)):
+            console.print(x=x, y=y + line_number - first_line, string=line, fg=fg)
+
     @staticmethod
     def wrap(string: str, width: int) -> Iterable[str]:
         """Return a wrapped text message."""
@@ -71,8 +274,8 @@ class MessageLog:
         y_offset = height - 1
 
         for message in reversed(messages):
-            for line in reversed(list(cls.wrap(message.full_text, width))):
+            for line in reversed(message.wrap(width)):
                 console.print(x=x, y=y + y_offset, string=line, fg=message.fg)
                 y_offset -= 1
                 if y_offset < 0:
-                    return  # No more space to print messages.
\ No newline at end of file
+                    return  # No more space to print messages.
@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+from typing import Callable, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+import numpy as np  # type: ignore
+import tcod
+
+if TYPE_CHECKING:
+    from entity import Entity
+    from maps import GameMap
+
+# Step costs shared by every pathfinder, so A* paths and flow fields agree on what is "shorter".
+CARDINAL_COST = 2
+DIAGONAL_COST = 3
+
+# Extra cost of walking through a tile held by a blocking entity.
+# A lower number means more enemies will crowd behind each other in
+# hallways.  A higher number means enemies will take longer paths in
+# order to surround the player.
+CROWD_COST = 10
+
+NEIGHBOURS = (
+    (-1, -1), (0, -1), (1, -1),
+    (-1, 0), (1, 0),
+    (-1, 1), (0, 1), (1, 1),
+)
+
+
+def movement_cost(gamemap: GameMap) -> np.ndarray:
+    """Return a cost array for pathfinding on `gamemap`, where 0 marks impassable tiles."""
+    # Copy the walkable array.
+    cost = np.array(gamemap.tiles["walkable"], dtype=np.int16, order="F")
+
+    for entity in gamemap.entities:
+        # Check that an enitiy blocks movement and the cost isn't zero (blocking.)
+        if entity.blocks_movement and cost[entity.x, entity.y]:
+            cost[entity.x, entity.y] += CROWD_COST
+
+    return cost
+
+
+class FlowField:
+    """
+    A map of the walking distance from every tile to a single target.
+
+    It is computed with one Dijkstra pass, after which any number of actors can find
+    their next step towards the target by looking at their neighbouring tiles.
+    """
+
+    def __init__(self, cost: np.ndarray, target: Tuple[int, int]):
+        self.target = target
+        self.distance = tcod.path.maxarray(cost.shape, dtype=np.int32, order="F")
+        self.distance[target] = 0
+        tcod.path.dijkstra2d(self.distance, cost, CARDINAL_COST, DIAGONAL_COST, out=self.distance)
+        self.unreachable = int(np.iinfo(self.distance.dtype).max)
+
+    def is_reachable(self, x: int, y: int) -> bool:
+        return int(self.distance[x, y]) != self.unreachable
+
+    def next_step(
+        self, x: int, y: int, is_blocked: Optional[Callable[[int, int], bool]] = None
+    ) -> Optional[Tuple[int, int]]:
+        """Return the neighbouring tile that gets closest to the target, or None if no step gets closer.
+
+        Tiles for which `is_blocked` returns True are skipped, so actors step around each other.
+        """
+        width, height = self.distance.shape
+        best_distance = int(self.distance[x, y])
+        best_step = None
+        for dx, dy in NEIGHBOURS:
+            nx, ny = x + dx, y + dy
+            if not (0 <= nx < width and 0 <= ny < height):
+                continue
+            distance = int(self.distance[nx, ny])
+            if distance >= best_distance:
+                continue
+            if is_blocked and is_blocked(nx, ny):
+                continue
+            best_distance = distance
+            best_step = nx, ny
+        return best_step
+
+
+class CachedPath:
+    """A path found by a NavigationGrid, remembered so later turns can keep walking it."""
+
+    def __init__(self, origin: Tuple[int, int], steps: List[Tuple[int, int]], generation: int):
+        self.origin = origin
+        self.steps = steps
+        self.generation = generation  # NavigationGrid.generation when the path was found.
+
+    def remaining_from(self, position: Tuple[int, int]) -> Optional[List[Tuple[int, int]]]:
+        """Return the steps still ahead of someone standing on `position`, or None if it isn't on this path."""
+        if position == self.origin:
+            return list(self.steps)
+        try:
+            return self.steps[self.steps.index(position) + 1 :]
+        except ValueError:
+            return None
+
+
+class NavigationGrid:
+    """
+    The pathfinding cost of every tile on a GameMap, kept up to date instead of rebuilt for every path.
+
+    The grid is built from the tiles the first time it is needed, since maps are dug out after they are created.
+    After that, moving, spawning and dying blocking entities adjust single tiles, and `refresh_tiles` re-reads
+    walkability for a changed region.  Every change stamps the tiles it touched, which is how cached paths can
+    tell whether anything along their route changed since they were found.
+    """
+
+    def __init__(self, gamemap: GameMap):
+        self.gamemap = gamemap
+        self._cost: Optional[np.ndarray] = None
+        self._changed_at: Optional[np.ndarray] = None
+        self._blockers: Dict[Entity, Tuple[int, int]] = {}
+        self.generation = 0
+
+    @property
+    def cost(self) -> np.ndarray:
+        """The cost array, where 0 marks impassable tiles.  It must not be modified by callers."""
+        if self._cost is None:
+            self.rebuild()
+        return self._cost
+
+    def rebuild(self) -> None:
+        """Build the grid from scratch from the map's tiles and blocking entities."""
+        gamemap = self.gamemap
+        self._cost = movement_cost(gamemap)
+        self._changed_at = np.zeros((gamemap.width, gamemap.height), dtype=np.int64, order="F")
+        self._blockers = {
+            entity: (entity.x, entity.y) for entity in gamemap.entities if entity.blocks_movement
+        }
+        self.generation += 1
+
+    def _restamp(self, x: int, y: int) -> None:
+        self.generation += 1
+        self._changed_at[x, y] = self.generation
+
+    def update_entity(self, entity: Entity) -> None:
+        """Account for an entity that was added, moved, or started or stopped blocking movement."""
+        if self._cost is None:
+            return
+        old_location = self._blockers.get(entity)
+        if entity.blocks_movement and entity in self.gamemap.entities:
+            new_location = entity.x, entity.y
+        else:
+            new_location = None
+        if old_location == new_location:
+            return
+
+        if old_location is not None:
+            del self._blockers[entity]
+            if self._cost[old_location]:
+                self._cost[old_location] -= CROWD_COST
+            self._restamp(*old_location)
+        if new_location is not None:
+            self._blockers[entity] = new_location
+            if self._cost[new_location]:
+                self._cost[new_location] += CROWD_COST
+            self._restamp(*new_location)
+
+    def remove_entity(self, entity: Entity) -> None:
+        """Account for an entity that left the map."""
+        if self._cost is None or entity not in self._blockers:
+            return
+        location = self._blockers.pop(entity)
+        if self._cost[location]:
+            self._cost[location] -= CROWD_COST
+        self._restamp(*location)
+
+    def refresh_tiles(self, x_slice: slice = slice(None), y_slice: slice = slice(None)) -> None:
+        """Re-read walkability for a region of the map after its tiles were changed."""
+        if self._cost is None:
+            return
+        self._cost[x_slice, y_slice] = self.gamemap.tiles["walkable"][x_slice, y_slice]
+        x_start, x_stop, _ = x_slice.indices(self.gamemap.width)
+        y_start, y_stop, _ = y_slice.indices(self.gamemap.height)
+        for x, y in self._blockers.values():
+            if x_start <= x < x_stop and y_start <= y < y_stop and self._cost[x, y]:
+                self._cost[x, y] += CROWD_COST
+        self.generation += 1
+        self._changed_at[x_slice, y_slice] = self.generation
+
+    def is_route_current(self, path: CachedPath, route: List[Tuple[int, int]]) -> bool:
+        """Return True if none of the `route` tiles changed since `path` was found."""
+        if not route:
+            return True
+        xs, ys = zip(*route)
+        return int(self._changed_at[xs, ys].max()) <= path.generation
+
+    def find_path(self, start: Tuple[int, int], dest: Tuple[int, int]) -> CachedPath:
+        """Find a path from `start` to `dest`.  The path is empty if `dest` can't be reached."""
+        # Create a graph from the cost array and pass that graph to a new pathfinder.
+        graph = tcod.path.SimpleGraph(cost=self.cost, cardinal=CARDINAL_COST, diagonal=DIAGONAL_COST)
+        pathfinder = tcod.path.Pathfinder(graph)
+
+        pathfinder.add_root(start)  # Start position.
+
+        # Compute the path to the destination and remove the starting point.
+        path: List[List[int]] = pathfinder.path_to(dest)[1:].tolist()
+
+        # Convert from List[List[int]] to List[Tuple[int, int]].
+        return CachedPath(start, [(index[0], index[1]) for index in path], self.generation)
+
+    def reuse_path(
+        self, path: CachedPath, position: Tuple[int, int], dest: Tuple[int, int]
+    ) -> Optional[List[Tuple[int, int]]]:
+        """
+        Return the rest of a cached path for someone at `position` heading to `dest`, or None if it must be replanned.
+
+        A path stays usable while its walker is still on it, nothing changed on the tiles ahead, and `dest` is still
+        the end of the path.  If `dest` only moved to a tile next to the end, the path is extended by that one step.
+        The last tile is left out of the change check, because it is normally the target's own tile.  It changed
+        when the target stepped off it, so an extended path checks it directly and then counts as found now.
+        """
+        if self._cost is None or not path.steps:
+            return None
+        remaining = path.remaining_from(position)
+        if not remaining or not self.is_route_current(path, remaining[:-1]):
+            return None
+
+        end_x, end_y = remaining[-1]
+        if (end_x, end_y) == dest:
+            return remaining
+        if max(abs(dest[0] - end_x), abs(dest[1] - end_y)) == 1 and self.cost[dest] and self.cost[end_x, end_y]:
+            # Every tile ahead was just checked, so the extended path is as good as one found now.
+            path.steps.append(dest)
+            path.generation = self.generation
+            return remaining + [dest]
+        return None
@@ -3,9 +3,10 @@ from __future__ import annotations
 import random
 import itertools
 from uuid import uuid4
-from typing import Dict, Iterator, List, Tuple, TYPE_CHECKING
+from typing import Dict, Iterator, List, Optional, Tuple, TYPE_CHECKING
 
 import tcod
+import tcod.random
 
 import entity_factories
 from maps import GameMap
@@ -85,6 +86,7 @@ def get_entities_at_random(
     weighted_chances_by_floor: Dict[int, List[Tuple[Entity, int]]],
     number_of_entities: int,
     floor: int,
+    rng: Optional[random.Random] = None,
 ) -> List[Entity]:
     entity_weighted_chances = {}
 
@@ -101,7 +103,7 @@ def get_entities_at_random(
     entities = list(entity_weighted_chances.keys())
     entity_weighted_chance_values = list(entity_weighted_chances.values())
 
-    chosen_entities = random.choices(
+    chosen_entities = (rng or random).choices(
         entities, weights=entity_weighted_chance_values, k=number_of_entities
     )
 
@@ -135,53 +137,53 @@ class RectangularRoom:
             and self.y2 >= other.y1
         )
 
-def place_dungeon_entities(room: RectangularRoom, dungeon: GameMap, floor_number: int,) -> None:
-    number_of_monsters = random.randint(
+def place_dungeon_entities(room: RectangularRoom, dungeon: GameMap, floor_number: int, rng: random.Random) -> None:
+    number_of_monsters = rng.randint(
         0, get_max_value_for_floor(max_monsters_by_floor, floor_number)
     )
-    number_of_items = random.randint(
+    number_of_items = rng.randint(
         0, get_max_value_for_floor(max_items_by_floor, floor_number)
     )
 
     monsters: List[Entity] = get_entities_at_random(
-        enemy_chances, number_of_monsters, floor_number
+        enemy_chances, number_of_monsters, floor_number, rng
     )
     items: List[Entity] = get_entities_at_random(
-        item_chances, number_of_items, floor_number
+        item_chances, number_of_items, floor_number, rng
     )
 
     for entity in monsters + items:
-        x = random.randint(room.x1 + 1, room.x2 - 1)
-        y = random.randint(room.y1 + 1, room.y2 - 1)
+        x = rng.randint(room.x1 + 1, room.x2 - 1)
+        y = rng.randint(room.y1 + 1, room.y2 - 1)
 
-        if not any(entity.x == x and entity.y == y for entity in dungeon.entities):
-            entity.spawn(dungeon, x, y)
+        if (x, y) != dungeon.player_start and not dungeon.get_entities_at_location(x, y):
+            entity.spawn(dungeon, x, y, rng)
 
-def place_labs_entities(room: RectangularRoom, dungeon: GameMap, floor_number: int,) -> None:
-    number_of_monsters = random.randint(
+def place_labs_entities(room: RectangularRoom, dungeon: GameMap, floor_number: int, rng: random.Random) -> None:
+    number_of_monsters = rng.randint(
         0, get_max_value_for_floor(max_monsters_by_floor, floor_number)
     )
-    number_of_items = random.randint(
+    number_of_items = rng.randint(
         0, get_max_value_for_floor(max_items_by_floor, floor_number)
     )
     
-    bonus = random.randint(0, int(floor_number/2))
+    bonus = rng.randint(0, int(floor_number/2))
     number_of_items += bonus
     number_of_monsters += bonus
 
     monsters: List[Entity] = get_entities_at_random(
-        enemy_chances, number_of_monsters, floor_number+1
+        enemy_chances, number_of_monsters, floor_number+1, rng
     )
     items: List[Entity] = get_entities_at_random(
-        item_chances, number_of_items, floor_number+1
+        item_chances, number_of_items, floor_number+1, rng
     )
 
     for entity in monsters + items:
-        x = random.randint(room.x1 + 1, room.x2 - 1)
-        y = random.randint(room.y1 + 1, room.y2 - 1)
+        x = rng.randint(room.x1 + 1, room.x2 - 1)
+        y = rng.randint(room.y1 + 1, room.y2 - 1)
 
-        if not any(entity.x == x and entity.y == y for entity in dungeon.entities):
-            entity.spawn(dungeon, x, y)
+        if (x, y) != dungeon.player_start and not dungeon.get_entities_at_location(x, y):
+            entity.spawn(dungeon, x, y, rng)
 
 def place_overworld_entities(overworld: GameMap, floor_number: int,) -> None:
     number_of_monsters = random.randint(
@@ -202,18 +204,18 @@ def place_overworld_entities(overworld: GameMap, floor_number: int,) -> None:
         x = random.randint(1, overworld.width-1)
         y = random.randint(1, overworld.height-1)
 
-        if not any(entity.x == x and entity.y == y for entity in overworld.entities):
+        if not overworld.get_entities_at_location(x, y):
             entity.spawn(overworld, x, y)
 
     # print(overworld.tiles)
 
 def tunnel_between(
-    start: Tuple[int, int], end: Tuple[int, int]
+    start: Tuple[int, int], end: Tuple[int, int], rng: random.Random
 ) -> Iterator[Tuple[int, int]]:
     """Return an L-shaped tunnel between these two points."""
     x1, y1 = start
     x2, y2 = end
-    if random.random() < 0.5:  # 50% chance.
+    if rng.random() < 0.5:  # 50% chance.
         # Move horizontally, then vertically.
         corner_x, corner_y = x2, y1
     else:
@@ -233,22 +235,27 @@ def generate_dungeon(
     map_width: int,
     map_height: int,
     engine: Engine,
+    floor_number: int,
+    rng: random.Random,
 ) -> GameMap:
-    """Generate a new dungeon map."""
-    player = engine.player
+    """Generate a new dungeon map, drawing every roll from `rng`.
+
+    The player isn't put on the map, only given a place to start at in `player_start`, so this is safe to
+    run on another thread while the game goes on.
+    """
     exploring_music = "exploring_music"
-    dungeon = GameMap(engine, map_width, map_height, exploring_music, entities=[player])
+    dungeon = GameMap(engine, map_width, map_height, exploring_music)
 
     rooms: List[RectangularRoom] = []
 
     center_of_last_room = (0, 0)
 
     for r in range(max_rooms):
-        room_width = random.randint(room_min_size, room_max_size)
-        room_height = random.randint(room_min_size, room_max_size)
+        room_width = rng.randint(room_min_size, room_max_size)
+        room_height = rng.randint(room_min_size, room_max_size)
 
-        x = random.randint(0, dungeon.width - room_width - 1)
-        y = random.randint(0, dungeon.height - room_height - 1)
+        x = rng.randint(0, dungeon.width - room_width - 1)
+        y = rng.randint(0, dungeon.height - room_height - 1)
 
         # "RectangularRoom" class makes rectangles easier to work with
         new_room = RectangularRoom(x, y, room_width, room_height)
@@ -263,15 +270,15 @@ def generate_dungeon(
 
         if len(rooms) == 0:
             # The first room, where the player starts.
-            player.place(*new_room.center, dungeon)
+            dungeon.player_start = new_room.center
         else:  # All rooms after the first.
             # Dig out a tunnel between this room and the previous one.
-            for x, y in tunnel_between(rooms[-1].center, new_room.center):
+            for x, y in tunnel_between(rooms[-1].center, new_room.center, rng):
                 dungeon.tiles[x, y] = tile_types.floor
 
             center_of_last_room = new_room.center
 
-        place_dungeon_entities(new_room, dungeon, engine.game_world.current_floor)
+        place_dungeon_entities(new_room, dungeon, floor_number, rng)
         
         dungeon.tiles[center_of_last_room] = tile_types.down_stairs
         dungeon.downstairs_location = center_of_last_room
@@ -279,6 +286,11 @@ def generate_dungeon(
         # Finally, append the new room to the list.
         rooms.append(new_room)
 
+    dungeon.rooms = rooms
+    # The stairs up go in last, so no tunnel digs over them.
+    dungeon.tiles[dungeon.player_start] = tile_types.up_stairs
+    dungeon.upstairs_location = dungeon.player_start
+    dungeon.tiles_changed()
     return dungeon
 
 DEPTH = 5
@@ -292,11 +304,12 @@ def generate_bsp_dungeon(
     map_width: int,
     map_height: int,
     engine: Engine,
+    floor_number: int,
+    rng: random.Random,
 ) -> GameMap:
-    """Generate a new dungeon map."""
-    player = engine.player
+    """Generate a new dungeon map of rooms split up by a BSP tree, like `generate_dungeon` does."""
     exploring_music = "exploring_music"
-    map = GameMap(engine, map_width, map_height, music=exploring_music, entities=[player])
+    map = GameMap(engine, map_width, map_height, music=exploring_music)
 
     #Empty global list for storing room coordinates
     rooms: List[RectangularRoom] = []
@@ -313,7 +326,8 @@ def generate_bsp_dungeon(
         room_min_size, 
         room_min_size, 
         1.5, 
-        1.5
+        1.5,
+        seed=tcod.random.Random(seed=rng.getrandbits(32)),
     )
 
     #Traverse the nodes and create rooms                            
@@ -334,11 +348,11 @@ def generate_bsp_dungeon(
 
             if len(rooms) == 0:
             # The first room, where the player starts.
-                player.place(*new_room.center, map)
+                map.player_start = new_room.center
             else:      
                 center_of_last_room = new_room.center
 
-            place_labs_entities(new_room, map, engine.game_world.current_floor)
+            place_labs_entities(new_room, map, floor_number, rng)
 
             # Finally, append the new room to the list.
             rooms.append(new_room)
@@ -346,6 +360,10 @@ def generate_bsp_dungeon(
     # print(len(rooms))
     map.tiles[center_of_last_room] = tile_types.down_stairs
     map.downstairs_location = center_of_last_room
+    map.tiles[map.player_start] = tile_types.up_stairs
+    map.upstairs_location = map.player_start
+    map.rooms = rooms
+    map.tiles_changed()
 
     return map
 
@@ -397,6 +415,7 @@ def generate_random_overworld(
     stair_y = random.randint(1,worldmap.height-1)
     worldmap.tiles[stair_x,stair_y] = tile_types.down_stairs
     worldmap.downstairs_location = (stair_x,stair_y)
+    worldmap.tiles_changed()
 
     return worldmap
 
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Tuple, TYPE_CHECKING
+from typing import List, Tuple, TYPE_CHECKING
 
 import color
 import tcod
@@ -15,7 +15,7 @@ def get_names_at_location(x: int, y: int, game_map: GameMap) -> str:
         return ""
 
     names = ", ".join(
-        entity.name for entity in game_map.entities if entity.x == x and entity.y == y
+        entity.name for entity in game_map.get_entities_at_location(x, y)
     )
 
     return names.capitalize()
@@ -128,6 +128,16 @@ def render_names_at_mouse_location(
 
     console.print(x=x+1,y=y+1, string=names_at_mouse_location)
 
+def render_debug_info(
+    console: Console, lines: List[str], location: Tuple[int, int]
+) -> None:
+    """
+    Render debug output over the top of the map, one line per entry.
+    """
+    x, y = location
+    for i, line in enumerate(lines):
+        console.print(x=x, y=y + i, string=line, fg=color.yellow, bg=color.black)
+
 def draw_window(console, x, y, width, height, title):
   console.draw_frame(
       x=x,
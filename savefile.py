@@ -0,0 +1,418 @@
+"""The save file format.
+
+A save is a small container of named sections:
+
+    magic (8 bytes) | header length (4 bytes, little endian) | header (JSON) | section data ...
+
+The header records the format version, a summary of the game for save menus (see `save_info`) and, for
+each section, where its data is, which codec compressed it and, for arrays, the dtype and shape.  The current map's tiles and explored area are stored as arrays; with
+the "raw" codec they are memory mapped on load rather than read in.  Everything else goes in the "engine"
+section as a pickle which leaves out state that can be rebuilt: the tracery grammar, the visible area, the
+light map and the map's lookups.  Those are rebuilt on load.  The sound is left out too, and a loaded game
+gets a NullSound until the code that loaded it hands over the real one.  Large parts of the game that don't change once
+made, such as the floors the player has left, already packed by their registry (see floors.py), and message
+log archives, are left out of that pickle as `Deferred` references and get "deferred" sections of their own,
+which are filled in by whichever thread writes the save.
+
+Files that don't start with the magic bytes, such as the lzma compressed pickles older versions of the game
+wrote, are rejected with SaveFormatError: the game state has changed too much since for them to load.
+"""
+from __future__ import annotations
+
+import base64
+import bz2
+import io
+import json
+import lzma
+import os
+import pickle
+import random
+import struct
+import time
+import zlib
+from typing import Any, BinaryIO, Callable, Dict, List, NamedTuple, Optional, Tuple, TYPE_CHECKING
+
+import numpy as np  # type: ignore
+
+if TYPE_CHECKING:
+    from engine import Engine
+    from maps import GameMap
+
+MAGIC = b"LURKSAV\x00"
+FORMAT_VERSION = 2
+ALIGNMENT = 64  # Section data starts on these boundaries, which memory mapping is happiest with.
+
+# name: (compress, decompress)
+CODECS: Dict[str, Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {
+    "raw": (bytes, bytes),
+    "zlib": (lambda data: zlib.compress(data, 6), zlib.decompress),
+    "lzma": (lambda data: lzma.compress(data, preset=1), lzma.decompress),
+    "bz2": (bz2.compress, bz2.decompress),
+}
+
+# The codec of each section, unless save is told otherwise.  Raw arrays load memory mapped.
+DEFAULT_CODECS = {
+    "engine": "zlib",
+    "tiles": "raw",
+    "explored": "raw",
+    "deferred": "raw",  # Their data is compressed already.
+}
+
+# Arrays of the current map that are saved as their own sections.
+MAP_ARRAYS = ("tiles", "explored")
+# What a map can work out again from its tiles and entities, so saves leave it out.  See GameMap.rebuild_derived_state.
+DERIVED_STATE = ("visible", "light_levels", "spatial_index", "light_sources", "components", "lighting", "navigation")
+
+
+class SaveFormatError(Exception):
+    """Raised when a file is not a save this version of the game can read."""
+
+
+class Deferred:
+    """
+    Part of an object's pickled state that a save keeps in a section of its own, written by whichever thread
+    writes the save rather than while the game waits.
+
+    It is either an immutable `value`, pickled when the save is written, one that `factory` makes then, or the
+    first `length` bytes of the file at `path`, which are copied into the save without being read into memory.
+    Loading a save gives the owner's __setstate__ the value or the file's bytes in its place.  Pickled any other
+    way, such as by deepcopy, the Deferred itself comes back, with any factory's value made, and `resolve` turns
+    it into the same.
+    """
+
+    def __init__(
+        self,
+        value: Any = None,
+        path: Optional[str] = None,
+        length: int = 0,
+        factory: Optional[Callable[[], Any]] = None,
+    ):
+        self.value = value
+        self.path = path
+        self.length = length
+        self.factory = factory
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.factory is not None:
+            state.update(value=self.factory(), factory=None)
+        return state
+
+    def get(self) -> Any:
+        if self.factory is not None:
+            return self.factory()
+        if self.path is None:
+            return self.value
+        with open(self.path, "rb") as f:
+            return f.read(self.length)
+
+
+def resolve(value: Any) -> Any:
+    """Return what a Deferred found in some unpickled state stands for, or `value` itself if it isn't one."""
+    return value.get() if isinstance(value, Deferred) else value
+
+
+class _FileSlice(NamedTuple):
+    """The start of an open file, to be copied into a save section as it is."""
+    file: BinaryIO
+    length: int
+
+    def copy_to(self, f: BinaryIO) -> None:
+        remaining = self.length
+        while remaining:
+            chunk = self.file.read(min(remaining, 1 << 20))
+            if not chunk:
+                raise OSError(f"{self.file.name} is shorter than the {self.length} bytes expected.")
+            f.write(chunk)
+            remaining -= len(chunk)
+
+
+class _EnginePickler(pickle.Pickler):
+    """
+    Pickles an Engine, swapping the map arrays and rebuildable state for references to them.
+
+    Deferred parts are swapped for references too, and collected in `deferred`.
+    """
+
+    def __init__(self, file: BinaryIO, engine: Engine):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        game_map = engine.game_map
+        self.deferred: List[Deferred] = []
+        self.references: Dict[int, str] = {id(engine.sound): "sound"}
+        if engine.game_rules is not None:
+            self.references[id(engine.game_rules)] = "game_rules"
+        for name in MAP_ARRAYS:
+            self.references[id(getattr(game_map, name))] = f"array:{name}"
+        for name in DERIVED_STATE:
+            self.references[id(getattr(game_map, name))] = "derived"
+
+    def persistent_id(self, obj: Any) -> Optional[str]:
+        if isinstance(obj, Deferred):
+            self.deferred.append(obj)
+            return f"deferred:{len(self.deferred) - 1}"
+        return self.references.get(id(obj))
+
+
+class _EngineUnpickler(pickle.Unpickler):
+    def __init__(self, file: BinaryIO, arrays: Dict[str, np.ndarray], deferred: Dict[int, Any]):
+        super().__init__(file)
+        self.arrays = arrays
+        self.deferred = deferred
+
+    def persistent_load(self, pid: str) -> Any:
+        if pid.startswith("array:"):
+            return self.arrays[pid[len("array:"):]]
+        if pid.startswith("deferred:"):
+            return self.deferred[int(pid[len("deferred:"):])]
+        return None  # Rebuilt once the whole engine is loaded.
+
+    def find_class(self, module: str, name: str) -> Any:
+        if (module, name) == ("sound", "Sound"):
+            # Older saves hold the game's Sound, which would open the audio device on whatever thread loads them.
+            from sound import NullSound
+
+            return NullSound
+        return super().find_class(module, name)
+
+
+# The most cells a save's thumbnail of the explored map has across and down.
+THUMBNAIL_SIZE = (32, 16)
+
+
+class Snapshot(NamedTuple):
+    """
+    The uncompressed sections of a save, taken from an engine at one moment, and its summary.
+
+    A deferred section's data is the Deferred whose value is still to be made and pickled, or an open file to
+    copy from, so a snapshot that isn't written must be closed.
+    """
+    sections: List[Tuple[Dict, Any]]
+    info: Dict
+
+    def close(self) -> None:
+        for info, data in self.sections:
+            if isinstance(data, _FileSlice):
+                data.file.close()
+
+
+def pack_thumbnail(explored: np.ndarray) -> Dict:
+    """Shrink the explored map to at most THUMBNAIL_SIZE cells, each set if any tile in it was explored."""
+    width, height = explored.shape
+    step_x = -(-width // THUMBNAIL_SIZE[0])
+    step_y = -(-height // THUMBNAIL_SIZE[1])
+    cells_x, cells_y = -(-width // step_x), -(-height // step_y)
+    padded = np.zeros((cells_x * step_x, cells_y * step_y), dtype=bool)
+    padded[:width, :height] = explored
+    cells = padded.reshape(cells_x, step_x, cells_y, step_y).any(axis=(1, 3))
+    return {"width": cells_x, "height": cells_y, "bits": base64.b64encode(np.packbits(cells)).decode()}
+
+
+def unpack_thumbnail(thumbnail: Dict) -> np.ndarray:
+    """Return a packed thumbnail as a (width, height) boolean array."""
+    width, height = thumbnail["width"], thumbnail["height"]
+    bits = np.unpackbits(np.frombuffer(base64.b64decode(thumbnail["bits"]), dtype=np.uint8))
+    return bits[: width * height].reshape(width, height).astype(bool)
+
+
+def save_info(engine: Engine) -> Dict:
+    """Summarise a game for the save's header, which menus read without loading the rest of the save."""
+    player = engine.player
+    return {
+        "name": player.name,
+        "level": player.level.current_level,
+        "floor": engine.game_world.current_floor,
+        "turn": engine.turn,
+        "playtime": engine.playtime,
+        "saved_at": time.time(),
+        "thumbnail": pack_thumbnail(engine.game_map.explored),
+    }
+
+
+def snapshot(engine: Engine) -> Snapshot:
+    """Serialize `engine` into uncompressed sections.
+
+    This is the only part of saving that reads the game, so once it returns the game can carry on while
+    `write` pickles the deferred parts, compresses and writes the snapshot, on another thread if need be.
+    The files of deferred parts are opened here, so they can be written even if the game replaces them.
+    """
+    # Nothing stays mapped from a file that the save might replace.
+    release_mapped_arrays(engine)
+    # Loading puts the random module back how it was, so journaled turns replay with the same rolls.
+    engine.rng_state = random.getstate()
+    game_map = engine.game_map
+
+    buffer = io.BytesIO()
+    pickler = _EnginePickler(buffer, engine)
+    pickler.dump(engine)
+    sections: List[Tuple[Dict, Any]] = [({"name": "engine"}, buffer.getvalue())]
+    for index, deferred in enumerate(pickler.deferred):
+        if deferred.path is None:
+            sections.append(({"name": "deferred", "index": index, "kind": "value"}, deferred))
+        else:
+            data = _FileSlice(open(deferred.path, "rb"), deferred.length)
+            sections.append(({"name": "deferred", "index": index, "kind": "file"}, data))
+    for name in MAP_ARRAYS:
+        array = np.asfortranarray(getattr(game_map, name))
+        info = {
+            "name": name,
+            "dtype": np.lib.format.dtype_to_descr(array.dtype),
+            "shape": array.shape,
+        }
+        sections.append((info, array.tobytes(order="F")))
+    return Snapshot(sections, save_info(engine))
+
+
+def write(snapshot: Snapshot, filename: str, codecs: Optional[Dict[str, str]] = None) -> None:
+    """Compress a snapshot's sections with the codecs named in `codecs` and write them to `filename`.
+
+    The file is written next to `filename` and then moved over it, so a failed save never leaves a broken file.
+    The snapshot is closed once written.
+    """
+    try:
+        _write(snapshot, filename, {**DEFAULT_CODECS, **(codecs or {})})
+    finally:
+        snapshot.close()
+
+
+def _write(snapshot: Snapshot, filename: str, codecs: Dict[str, str]) -> None:
+    # Compress the sections, then lay them out after a header which says where each one is.
+    entries = []
+    payloads: List[Any] = []
+    for info, data in snapshot.sections:
+        if isinstance(data, _FileSlice):
+            # Copied into the file as it is, a piece at a time.
+            entries.append({**info, "codec": "raw", "length": data.length})
+            payloads.append(data)
+            continue
+        if info["name"] == "deferred":
+            data = pickle.dumps(data.get(), protocol=pickle.HIGHEST_PROTOCOL)
+        codec = codecs[info["name"]]
+        payload = CODECS[codec][0](data)
+        entries.append({**info, "codec": codec, "length": len(payload)})
+        payloads.append(payload)
+
+    def layout(header_length: int) -> int:
+        offset = len(MAGIC) + 4 + header_length
+        for entry in entries:
+            offset += -offset % ALIGNMENT
+            entry["offset"] = offset
+            offset += entry["length"]
+        return offset
+
+    # The offsets change the header's length, so lay out until the length settles.
+    header = b""
+    while True:
+        layout(len(header))
+        new_header = json.dumps(
+            {"version": FORMAT_VERSION, "info": snapshot.info, "sections": entries}
+        ).encode()
+        if len(new_header) == len(header):
+            break
+        header = new_header
+
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    temp_filename = filename + ".tmp"
+    with open(temp_filename, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        for entry, payload in zip(entries, payloads):
+            f.write(b"\0" * (entry["offset"] - f.tell()))
+            if isinstance(payload, _FileSlice):
+                payload.copy_to(f)
+            else:
+                f.write(payload)
+    os.replace(temp_filename, filename)
+
+
+def save(engine: Engine, filename: str, codecs: Optional[Dict[str, str]] = None) -> None:
+    """Save `engine` to `filename`, compressing each section with the codec named in `codecs`."""
+    write(snapshot(engine), filename, codecs)
+
+
+def read_header(f: BinaryIO) -> Dict:
+    """Read the header of an open save file."""
+    if f.read(len(MAGIC)) != MAGIC:
+        raise SaveFormatError("This is not a save, or it is from an older version of the game that can't be loaded.")
+    (header_length,) = struct.unpack("<I", f.read(4))
+    header = json.loads(f.read(header_length))
+    if header["version"] > FORMAT_VERSION:
+        raise SaveFormatError(f"This save is from a newer version of the game (format {header['version']}).")
+    return header
+
+
+def read_info(filename: str) -> Optional[Dict]:
+    """Read just the summary from the header of a save."""
+    with open(filename, "rb") as f:
+        header = read_header(f)
+    return header.get("info")
+
+
+def load(filename: str) -> Engine:
+    """Load an Engine from `filename`."""
+    from engine import Engine
+
+    with open(filename, "rb") as f:
+        header = read_header(f)
+        arrays: Dict[str, np.ndarray] = {}
+        deferred: Dict[int, Any] = {}
+        engine_data = b""
+        for entry in header["sections"]:
+            codec = entry["codec"]
+            if entry["name"] in ("engine", "deferred"):
+                f.seek(entry["offset"])
+                data = CODECS[codec][1](f.read(entry["length"]))
+                if entry["name"] == "engine":
+                    engine_data = data
+                else:
+                    deferred[entry["index"]] = pickle.loads(data) if entry["kind"] == "value" else data
+                continue
+            dtype = np.lib.format.descr_to_dtype(entry["dtype"])
+            shape = tuple(entry["shape"])
+            if codec == "raw":
+                # Copy on write: the game can change the array without touching the file.
+                arrays[entry["name"]] = np.memmap(
+                    filename, dtype=dtype, mode="c", offset=entry["offset"], shape=shape, order="F"
+                )
+            else:
+                f.seek(entry["offset"])
+                data = CODECS[codec][1](f.read(entry["length"]))
+                arrays[entry["name"]] = np.frombuffer(data, dtype=dtype).reshape(shape, order="F").copy(order="F")
+
+    engine = _EngineUnpickler(io.BytesIO(engine_data), arrays, deferred).load()
+    assert isinstance(engine, Engine)
+    rebuild(engine)
+    return engine
+
+
+def rebuild(engine: Engine) -> None:
+    """Rebuild the state a save leaves out."""
+    import procgen
+    from sound import NullSound
+
+    engine.game_rules = procgen.load_rules()
+    # The audio device belongs to the main thread, so whoever loaded the game gives it the real Sound.
+    engine.sound = NullSound()
+    if engine.rng_state is not None:
+        random.setstate(engine.rng_state)
+    engine.game_map.rebuild_derived_state()
+    engine.update_fov()
+    engine.update_light_levels()
+    # Just as they were when the save was made, so loading doesn't wake anyone the game itself wouldn't have.
+    engine.enemies_in_view = {id(actor) for actor in engine.visible_enemies()}
+
+
+def release_mapped_arrays(engine: Engine) -> None:
+    """Read any memory mapped map arrays into memory, so the file they were loaded from can be replaced or deleted.
+
+    Only the current map can hold them: the floor registry copies the arrays of every floor it is given.
+    """
+    release_map_arrays(engine.game_map)
+
+
+def release_map_arrays(game_map: GameMap) -> None:
+    """Read the arrays of one map into memory if they are memory mapped."""
+    for name in MAP_ARRAYS:
+        array = getattr(game_map, name)
+        if isinstance(array, np.memmap):
+            setattr(game_map, name, np.array(array, order="F"))
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import heapq
+import itertools
+from typing import Dict, Iterable, Iterator, List, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from entity import Actor
+
+# Time units an action takes for an actor moving at NORMAL_SPEED.  One player turn at normal speed is one ACTION_COST.
+ACTION_COST = 100
+NORMAL_SPEED = 100
+
+
+def action_delay(cost: int, speed: int) -> int:
+    """Return how long an actor with the given speed is busy after an action of the given cost."""
+    return max(cost * NORMAL_SPEED // max(speed, 1), 1)
+
+
+class TurnScheduler:
+    """
+    Decides which actors act next, by keeping them in a heap ordered by the time of their next action.
+
+    Actors that are woken, fast, slow or resting simply get pushed further or nearer into the future,
+    so a turn only costs something for the actors that are actually due.  Removing an actor only forgets
+    its entry; the stale heap item is skipped when it comes up.
+    """
+
+    def __init__(self):
+        self.now = 0
+        self._heap: List[Tuple[int, int, Actor]] = []
+        self._entries: Dict[Actor, int] = {}  # The sequence number of each actor's live heap item.
+        self._sequence = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, actor: Actor) -> bool:
+        return actor in self._entries
+
+    def schedule(self, actor: Actor, time: int) -> None:
+        """Have `actor` act at the given time, replacing any earlier entry for it."""
+        sequence = next(self._sequence)
+        self._entries[actor] = sequence
+        heapq.heappush(self._heap, (time, sequence, actor))
+
+    def unschedule(self, actor: Actor) -> None:
+        """Stop scheduling `actor`.  Unknown actors are ignored."""
+        if self._entries.pop(actor, None) is not None and len(self._heap) > 2 * len(self._entries) + 16:
+            self._compact()
+
+    def sync(self, woken: Iterable[Actor], asleep: Iterable[Actor]) -> None:
+        """Schedule actors that just woke up to act now, in the order given, and drop the ones that fell asleep."""
+        for actor in asleep:
+            self.unschedule(actor)
+        for actor in woken:
+            if actor not in self._entries:
+                self.schedule(actor, self.now)
+
+    def wake(self, actor: Actor) -> None:
+        """Bring a scheduled actor's next action forward to now, e.g. after it heard something."""
+        if actor in self._entries:
+            self.schedule(actor, self.now)
+
+    def advance(self, elapsed: int) -> None:
+        self.now += elapsed
+
+    def due(self) -> Iterator[Tuple[int, Actor]]:
+        """Pop and yield (time, actor) for every action due by now.
+
+        An actor that is rescheduled to a time that is still due while iterating is yielded again.
+        """
+        heap = self._heap
+        while heap and heap[0][0] <= self.now:
+            time, sequence, actor = heapq.heappop(heap)
+            if self._entries.get(actor) != sequence:
+                continue  # Replaced or unscheduled since it was pushed.
+            del self._entries[actor]
+            yield time, actor
+
+    def _compact(self) -> None:
+        self._heap = [item for item in self._heap if self._entries.get(item[2]) == item[1]]
+        heapq.heapify(self._heap)
@@ -2,14 +2,11 @@
 from __future__ import annotations
 
 import copy
-import lzma
-import pickle
-import traceback
-from turtle import back
-from typing import Optional
-from main import main
+import functools
+from typing import List, Optional
 from sound import Sound
 
+import numpy as np  # type: ignore
 import tcod
 
 import color
@@ -17,6 +14,10 @@ from engine import Engine
 import entity_factories
 from maps import GameWorld
 import input_handlers
+import journal
+import loading
+import savefile
+import slots
 
 from skill import handguns, rifles, shotguns, medical, blades
 
@@ -24,13 +25,20 @@ from russian_names import RussianNames
 
 import procgen
 
-# Load the background image and remove the alpha channel.
-# background_image = tcod.image.load(".\img\menu_background.png")[:, :, :3]
-background_image = tcod.image.load(".\img\menu_background2.png")[:, :, :3]
+@functools.lru_cache(maxsize=None)
+def load_background_image():
+    """Load the main menu background image the first time it is needed, without its alpha channel."""
+    # return tcod.image.load(".\img\menu_background.png")[:, :, :3]
+    return tcod.image.load(".\img\menu_background2.png")[:, :, :3]
 
 
-def new_game() -> Engine:
-    """Return a brand new game session as an Engine instance."""
+def new_game(sound: Optional[Sound] = None, progress: loading.Progress = loading.no_progress) -> Engine:
+    """Return a brand new game session as an Engine instance.
+
+    Pass a `sound` (such as a NullSound) to use it instead of opening the audio device.  `progress` is told
+    which stage the setup is at.  No music is started, since this may run on a worker thread; see
+    `start_music`.
+    """
     # map_width = 80
     # map_height = 43
 
@@ -44,16 +52,19 @@ def new_game() -> Engine:
     room_min_size = 8
     max_rooms = 75
 
+    progress("Loading the rules", 0.0)
     player = copy.deepcopy(entity_factories.player)
 
-    engine = Engine(player=player)
+    engine = Engine(player=player, sound=sound)
     
     engine.game_rules = procgen.load_rules()
+    engine.save_path = slots.new_slot_path(player.name)
 
     # print(f"Game rules: {engine.game_rules}")
     # for i in range(0,10):
     #     print(engine.game_rules.flatten(f"{i+1}. {player.name}#fake_postmortem#"))
 
+    progress("Generating the overworld", 0.2)
     engine.game_world = GameWorld(
         engine=engine,
         max_rooms=max_rooms,
@@ -64,9 +75,11 @@ def new_game() -> Engine:
     )
     engine.game_world.generate_overworld()
     # engine.game_world.generate_floor()
+    progress("Lighting the map", 0.6)
     engine.update_fov()
     engine.update_light_levels()
     
+    progress("Founding the factions", 0.7)
     engine.game_world.generate_factions()
 
     engine.message_log.add_message(
@@ -77,8 +90,7 @@ def new_game() -> Engine:
         f"You are {player.name}, a {player.role.name.capitalize()}.", color.red
     )
 
-    engine.sound.play_music(engine.game_map.music)
-
+    progress("Packing your kit", 0.9)
     knife = copy.deepcopy(entity_factories.kitchen_knife)
     # sword = copy.deepcopy(entity_factories.sword)
     shirt = copy.deepcopy(entity_factories.shirt)
@@ -117,11 +129,21 @@ def new_game() -> Engine:
     return engine
 
 
-def load_game(filename: str) -> Engine:
-    """Load an Engine instance from a file."""
-    with open(filename, "rb") as f:
-        engine = pickle.loads(lzma.decompress(f.read()))
-    assert isinstance(engine, Engine)
+def start_music(engine: Engine) -> None:
+    """Play the music of the map the player is on."""
+    engine.sound.play_music(engine.game_map.music)
+
+
+def load_game(filename: str, progress: loading.Progress = loading.no_progress) -> Engine:
+    """Load an Engine instance from a file, then replay the turns its journal has since then.
+
+    The engine comes back with a NullSound, for whoever owns the audio device to replace.
+    """
+    progress("Reading the save", 0.0)
+    engine = savefile.load(filename)
+    progress("Replaying the journal", 0.8)
+    journal.replay(engine, filename + ".journal")
+    engine.save_path = filename
     return engine
 
 class MainMenu(input_handlers.BaseEventHandler):
@@ -131,10 +153,18 @@ class MainMenu(input_handlers.BaseEventHandler):
         self.sound = Sound()
         self.main_menu_music = self.sound.play_music("main_menu")
         # self.sound.test_sound()
+        self.menu_console: Optional[tcod.Console] = None
 
     def on_render(self, console: tcod.Console) -> None:
+        """Render the main menu, which never changes, from an offscreen copy drawn the first time."""
+        if self.menu_console is None or self.menu_console.width != console.width or self.menu_console.height != console.height:
+            self.menu_console = tcod.Console(console.width, console.height, order="F")
+            self.draw_menu(self.menu_console)
+        self.menu_console.blit(console)
+
+    def draw_menu(self, console: tcod.Console) -> None:
         """Render the main menu on a background image."""
-        console.draw_semigraphics(background_image, 0, 0)
+        console.draw_semigraphics(load_background_image(), 0, 0)
 
         console.print(
             console.width // 2,
@@ -154,7 +184,7 @@ class MainMenu(input_handlers.BaseEventHandler):
 
         menu_width = 24
         for i, text in enumerate(
-            ["[N] Play a new game", "[C] Continue last game", "[Q] Quit"]
+            ["[N] Play a new game", "[C] Continue last game", "[L] Load a saved game", "[Q] Quit"]
         ):
             console.print(
                 console.width // 2,
@@ -172,17 +202,98 @@ class MainMenu(input_handlers.BaseEventHandler):
         if event.sym in (tcod.event.K_q, tcod.event.K_ESCAPE):
             raise SystemExit()
         elif event.sym == tcod.event.K_c:
-            try:
-                self.main_menu_music.stop()
-                return input_handlers.MainGameEventHandler(load_game("savegame.sav"))
-            except FileNotFoundError:
+            saves = slots.list_slots()
+            if not saves:
+                return input_handlers.PopupMessage(self, "No saved game to load.")
+            # The newest save that can be loaded; failing that, loading an incompatible one says why it can't.
+            loadable = [save for save in saves if save.info is not None]
+            return self.load((loadable or saves)[0].path)
+        elif event.sym == tcod.event.K_l:
+            saves = slots.list_slots()
+            if not saves:
                 return input_handlers.PopupMessage(self, "No saved game to load.")
-            except Exception as exc:
-                traceback.print_exc()  # Print to stderr.
-                return input_handlers.PopupMessage(self, f"Failed to load save:\n{exc}")
+            return SaveSlotMenu(self, saves)
         elif event.sym == tcod.event.K_n:
             self.sound.play_sound('new_game', volume=0.7)
             self.main_menu_music.stop()
-            return input_handlers.MainGameEventHandler(new_game())
+            return loading.LoadingScreen(
+                self,
+                "New game",
+                lambda progress: new_game(sound=self.sound, progress=progress),
+                self.new_game_failed,
+                on_loaded=start_music,
+            )
+
+        return None
+
+    def load(self, path: str) -> input_handlers.BaseEventHandler:
+        """Load the save at `path` in the background and start playing it."""
+        self.main_menu_music.stop()
+        return loading.LoadingScreen(
+            self, "Loading", lambda progress: load_game(path, progress), self.load_failed, on_loaded=self.use_sound
+        )
 
+    def use_sound(self, engine: Engine) -> None:
+        engine.sound = self.sound
+
+    def new_game_failed(self, exc: Exception) -> input_handlers.BaseEventHandler:
+        self.main_menu_music = self.sound.play_music("main_menu")
+        return input_handlers.PopupMessage(self, f"Failed to start a new game:\n{exc}")
+
+    def load_failed(self, exc: Exception) -> input_handlers.BaseEventHandler:
+        """Tell the player why a save didn't load, and bring the menu music back."""
+        self.main_menu_music = self.sound.play_music("main_menu")
+        if isinstance(exc, FileNotFoundError):
+            return input_handlers.PopupMessage(self, "No saved game to load.")
+        return input_handlers.PopupMessage(self, f"Failed to load save:\n{exc}")
+
+
+class SaveSlotMenu(input_handlers.BaseEventHandler):
+    """List the saved games, from their headers only, with a thumbnail of the selected one's map."""
+
+    def __init__(self, main_menu: MainMenu, saves: List[slots.Slot]):
+        self.main_menu = main_menu
+        self.saves = saves
+        self.cursor = 0
+
+    def on_render(self, console: tcod.Console) -> None:
+        self.main_menu.on_render(console)
+        width = min(console.width - 4, 64)
+        x = (console.width - width) // 2
+        height = min(len(self.saves), console.height // 2 - 4) + 2
+        y = 2
+
+        console.draw_frame(x, y, width, height, title="Load a saved game", clear=True, fg=color.white, bg=color.black)
+        first = max(0, self.cursor - (height - 3))
+        for i, save in enumerate(self.saves[first : first + height - 2]):
+            selected = first + i == self.cursor
+            console.print(
+                x + 1, y + 1 + i, save.title[: width - 2].ljust(width - 2),
+                fg=color.black if selected else color.menu_text,
+                bg=color.menu_text if selected else color.black,
+            )
+
+        info = self.saves[self.cursor].info
+        if info is not None:
+            explored = savefile.unpack_thumbnail(info["thumbnail"])
+            thumb_x = (console.width - explored.shape[0]) // 2
+            thumb_y = y + height + 1
+            console.draw_frame(
+                thumb_x - 1, thumb_y - 1, explored.shape[0] + 2, explored.shape[1] + 2,
+                fg=color.white, bg=color.black,
+            )
+            area = console.rgb[thumb_x : thumb_x + explored.shape[0], thumb_y : thumb_y + explored.shape[1]]
+            area["ch"] = np.where(explored, ord("#"), ord(" "))
+            area["fg"] = color.menu_text
+            area["bg"] = color.black
+
+    def ev_keydown(self, event: tcod.event.KeyDown) -> Optional[input_handlers.BaseEventHandler]:
+        if event.sym in (tcod.event.K_UP, tcod.event.K_KP_8):
+            self.cursor = max(0, self.cursor - 1)
+        elif event.sym in (tcod.event.K_DOWN, tcod.event.K_KP_2):
+            self.cursor = min(len(self.saves) - 1, self.cursor + 1)
+        elif event.sym in input_handlers.CONFIRM_KEYS:
+            return self.main_menu.load(self.saves[self.cursor].path)
+        elif event.sym == tcod.event.K_ESCAPE:
+            return self.main_menu
         return None
\ No newline at end of file
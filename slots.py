@@ -0,0 +1,106 @@
+"""Save slots: one save file per game, kept in the saves directory, and a cached index of their headers."""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import re
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+import savefile
+
+logger = logging.getLogger(__name__)
+
+SAVE_DIR = "saves"
+INDEX_FILENAME = os.path.join(SAVE_DIR, "index.json")
+# Where games were saved before there were slots.  Those saves can't be loaded any more, but while the file
+# exists it is listed, so players see what became of their game.
+LEGACY_SAVE = "savegame.sav"
+
+
+class Slot(NamedTuple):
+    path: str
+    info: Optional[Dict]  # The summary from the save's header, or None for a save this version can't load.
+    modified: float
+
+    @property
+    def title(self) -> str:
+        """A one line description of the save for menus."""
+        if self.info is None:
+            return f"{os.path.basename(self.path)} (incompatible save)"
+        info = self.info
+        minutes = int(info["playtime"] // 60)
+        return (
+            f"{info['name']}, level {info['level']}, floor {info['floor']}, "
+            f"turn {info['turn']}, {minutes // 60}:{minutes % 60:02}"
+        )
+
+
+def new_slot_path(player_name: str) -> str:
+    """Return an unused save path for a new game, named after its player."""
+    stem = re.sub(r"[^A-Za-z0-9]+", "-", player_name).strip("-").lower() or "game"
+    stem = f"{stem}-{time.strftime('%Y%m%d-%H%M%S')}"
+    path = os.path.join(SAVE_DIR, f"{stem}.sav")
+    number = 1
+    while os.path.exists(path):
+        number += 1
+        path = os.path.join(SAVE_DIR, f"{stem}-{number}.sav")
+    return path
+
+
+def _read_index() -> Dict[str, Dict]:
+    try:
+        with open(INDEX_FILENAME, "r", encoding="utf-8") as f:
+            return json.load(f)["slots"]
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def _write_index(entries: Dict[str, Dict]) -> None:
+    os.makedirs(SAVE_DIR, exist_ok=True)
+    temp_filename = INDEX_FILENAME + ".tmp"
+    with open(temp_filename, "w", encoding="utf-8") as f:
+        json.dump({"slots": entries}, f)
+    os.replace(temp_filename, INDEX_FILENAME)
+
+
+def list_slots() -> List[Slot]:
+    """Return every save, most recently saved first.
+
+    Only saves whose size or modification time changed since the index was last written have their headers
+    read; the rest come from the index.  Nothing past a save's header is ever read.  Saves in a format this
+    version can't load, including the old savegame.sav, are listed with no info.  Files that can't be read
+    at all are left out.
+    """
+    paths = []
+    if os.path.isdir(SAVE_DIR):
+        paths = [entry.path for entry in os.scandir(SAVE_DIR) if entry.name.endswith(".sav") and entry.is_file()]
+    if os.path.isfile(LEGACY_SAVE):
+        paths.append(LEGACY_SAVE)
+
+    cached = _read_index()
+    entries: Dict[str, Dict] = {}
+    for path in paths:
+        stat = os.stat(path)
+        entry = cached.get(path)
+        if entry is None or entry["mtime"] != stat.st_mtime or entry["size"] != stat.st_size:
+            try:
+                info = savefile.read_info(path)
+            except savefile.SaveFormatError:
+                info = None
+            except (OSError, ValueError):
+                logger.warning("Can't read the header of %s", path, exc_info=True)
+                continue
+            entry = {"mtime": stat.st_mtime, "size": stat.st_size, "info": info}
+        entries[path] = entry
+
+    if entries != cached:
+        try:
+            _write_index(entries)
+        except OSError:
+            logger.warning("Can't write the save index", exc_info=True)
+
+    slots = [Slot(path, entry["info"], entry["mtime"]) for path, entry in entries.items()]
+    slots.sort(key=lambda slot: slot.modified, reverse=True)
+    return slots
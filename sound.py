@@ -85,3 +85,38 @@ class Sound:
             signature, samplerate = soundfile.read(file=filename,dtype='float32')
             return signature, samplerate
 
+
+class NullChannel:
+    """Stands in for a playing channel when nothing is being played."""
+    busy = False
+
+    def stop(self):
+        pass
+
+
+class NullMixer:
+    """Stands in for the SDL mixer when there is no audio device."""
+
+    def play(self, *args, **kwargs):
+        return NullChannel()
+
+    def stop(self):
+        pass
+
+
+class NullSound(Sound):
+    """A Sound that never opens an audio device or reads audio files, for headless runs."""
+
+    def __init__(self):
+        self.mixer = NullMixer()
+        self.load_sound_files()
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.mixer = NullMixer()
+
+    def play_music(self, music: str = "", volume: float = 0.1, loops: int = 0):
+        return NullChannel()
+
+    def play_sound(self, soundId=None, volume: float = 0.2):
+        return NullChannel()
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import math
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from entity import Entity
+
+EMPTY_CELL: frozenset = frozenset()
+
+
+class SpatialIndex:
+    """
+    Keeps track of which entities sit on which tile of a GameMap.
+
+    Every entity is stored in a per-cell set, so point lookups only touch the entities on that tile.
+    Cells are also grouped into square buckets, which lets rectangle, radius and nearest-neighbour
+    queries visit only the occupied buckets around the query instead of every entity on the map.
+    """
+
+    def __init__(self, width: int, height: int, bucket_size: int = 8):
+        self.width, self.height = width, height
+        self.bucket_size = bucket_size
+        self._cells: Dict[Tuple[int, int], Set[Entity]] = {}
+        self._buckets: Dict[Tuple[int, int], Set[Entity]] = {}
+        self._locations: Dict[Entity, Tuple[int, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._locations)
+
+    def __contains__(self, entity: Entity) -> bool:
+        return entity in self._locations
+
+    def _bucket_of(self, x: int, y: int) -> Tuple[int, int]:
+        return x // self.bucket_size, y // self.bucket_size
+
+    def _insert(self, entity: Entity, location: Tuple[int, int]) -> None:
+        self._locations[entity] = location
+        self._cells.setdefault(location, set()).add(entity)
+        self._buckets.setdefault(self._bucket_of(*location), set()).add(entity)
+
+    def _discard(self, entity: Entity, location: Tuple[int, int]) -> None:
+        cell = self._cells[location]
+        cell.discard(entity)
+        if not cell:
+            del self._cells[location]
+        bucket_key = self._bucket_of(*location)
+        bucket = self._buckets[bucket_key]
+        bucket.discard(entity)
+        if not bucket:
+            del self._buckets[bucket_key]
+
+    def add(self, entity: Entity) -> None:
+        """Index an entity at its current location, or re-index it if it is already known."""
+        if entity in self._locations:
+            self.update(entity)
+        else:
+            self._insert(entity, (entity.x, entity.y))
+
+    def remove(self, entity: Entity) -> None:
+        """Stop tracking an entity.  Unknown entities are ignored."""
+        location = self._locations.pop(entity, None)
+        if location is not None:
+            self._discard(entity, location)
+
+    def update(self, entity: Entity) -> None:
+        """Move an indexed entity to the cell matching its current x and y."""
+        old_location = self._locations.get(entity)
+        new_location = (entity.x, entity.y)
+        if old_location is None or old_location == new_location:
+            return
+        self._discard(entity, old_location)
+        self._insert(entity, new_location)
+
+    def at(self, x: int, y: int) -> Set[Entity]:
+        """Return the entities on the given tile.  The returned set must not be modified."""
+        return self._cells.get((x, y), EMPTY_CELL)
+
+    def in_rect(self, x1: int, y1: int, x2: int, y2: int) -> Iterator[Entity]:
+        """Iterate over the entities inside the rectangle with inclusive corners (x1, y1) and (x2, y2)."""
+        bx1, by1 = self._bucket_of(max(x1, 0), max(y1, 0))
+        bx2, by2 = self._bucket_of(min(x2, self.width - 1), min(y2, self.height - 1))
+        for bx in range(bx1, bx2 + 1):
+            for by in range(by1, by2 + 1):
+                for entity in self._buckets.get((bx, by), EMPTY_CELL):
+                    if x1 <= entity.x <= x2 and y1 <= entity.y <= y2:
+                        yield entity
+
+    def in_radius(self, x: int, y: int, radius: float) -> Iterator[Entity]:
+        """Iterate over the entities within `radius` tiles of (x, y), using the same distance as Entity.distance."""
+        reach = int(radius)
+        for entity in self.in_rect(x - reach, y - reach, x + reach, y + reach):
+            if math.sqrt((entity.x - x) ** 2 + (entity.y - y) ** 2) <= radius:
+                yield entity
+
+    def nearest(
+        self,
+        x: int,
+        y: int,
+        k: int = 1,
+        predicate: Optional[Callable[[Entity], bool]] = None,
+        max_distance: Optional[float] = None,
+    ) -> List[Entity]:
+        """
+        Return up to `k` entities closest to (x, y), nearest first.
+
+        Buckets are searched in growing square rings around the query point, and the search stops
+        as soon as no unvisited bucket can hold anything closer than the k-th candidate found so far.
+        """
+        size = self.bucket_size
+        origin_x, origin_y = self._bucket_of(x, y)
+        last_ring = max(
+            origin_x,
+            origin_y,
+            (self.width - 1) // size - origin_x,
+            (self.height - 1) // size - origin_y,
+        )
+        candidates: List[Tuple[float, Entity]] = []
+
+        for ring in range(last_ring + 1):
+            for bx in range(origin_x - ring, origin_x + ring + 1):
+                step = 1 if ring == 0 or bx in (origin_x - ring, origin_x + ring) else 2 * ring
+                for by in range(origin_y - ring, origin_y + ring + 1, step):
+                    for entity in self._buckets.get((bx, by), EMPTY_CELL):
+                        if predicate and not predicate(entity):
+                            continue
+                        distance = math.sqrt((entity.x - x) ** 2 + (entity.y - y) ** 2)
+                        if max_distance is None or distance <= max_distance:
+                            candidates.append((distance, entity))
+
+            # Anything in the next ring is at least this far away.
+            next_ring_distance = ring * size + 1
+            if max_distance is not None and next_ring_distance > max_distance:
+                break
+            if len(candidates) >= k:
+                candidates.sort(key=lambda candidate: candidate[0])
+                del candidates[k:]
+                if candidates[-1][0] <= next_ring_distance:
+                    break
+
+        candidates.sort(key=lambda candidate: candidate[0])
+        return [entity for _, entity in candidates[:k]]
@@ -0,0 +1,29 @@
+import os
+
+import actions
+import autosave
+import headless
+import journal
+
+
+def test_autosaver_journals_a_new_game_without_a_saves_directory(tmp_path, monkeypatch):
+    engine = headless.new_game(seed=1)  # Reads the game's data files, so before leaving the checkout.
+    monkeypatch.chdir(tmp_path)
+
+    autosaver = autosave.Autosaver()
+    autosaver.update(engine)
+
+    assert engine.journal is not None
+    assert os.path.isfile(engine.save_path + ".journal")
+    autosaver.detach()
+
+
+def test_fire_action_without_an_item_is_recorded():
+    engine = headless.new_game(seed=1)
+    action = actions.FireAction(engine.player, None)
+
+    entry = journal.encode_action(engine, action)
+
+    assert entry == ["FireAction", None, None]
+    decoded = journal.decode_action(engine, entry)
+    assert isinstance(decoded, actions.FireAction) and decoded.item is None
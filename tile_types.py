@@ -45,6 +45,7 @@ sword_tile = 263
 shield_tile = 264
 # stairsdown_tile = 265
 stairsdown_tile = ord('>')
+stairsup_tile = ord('<')
 dagger_tile = 266
 
 floor = new_tile(
@@ -71,6 +72,12 @@ down_stairs = new_tile(
     dark=(stairsdown_tile, (0, 0, 100), (50, 50, 150)),
     light=(stairsdown_tile, (255, 255, 255), (200, 180, 50)),
 )
+up_stairs = new_tile(
+    walkable=True,
+    transparent=True,
+    dark=(stairsup_tile, (0, 0, 100), (50, 50, 150)),
+    light=(stairsup_tile, (255, 255, 255), (200, 180, 50)),
+)
 
 beach = new_tile(
     walkable=True,
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import collections
+import contextlib
+import logging
+import os
+import time
+from typing import Deque, Dict, Iterator, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# A turn (player action and world update) or a frame slower than this many milliseconds is logged.
+# It can be overridden with the LURKER_TURN_BUDGET_MS environment variable.
+DEFAULT_BUDGET_MS = float(os.environ.get("LURKER_TURN_BUDGET_MS", 100))
+
+
+class Sample(NamedTuple):
+    turn: int
+    total: float  # Seconds spent in all phases.
+    phases: Dict[str, float]  # Seconds per phase.
+    kind: str = "turn"  # "turn" for a player action and the world's reply to it, "frame" for drawing the screen.
+
+    @property
+    def label(self) -> str:
+        return f"Turn {self.turn}" if self.kind == "turn" else f"Frame at turn {self.turn}"
+
+
+class PhaseTimer:
+    """
+    Records how long each phase of a turn takes, such as the player action, the AIs, lighting, FOV and rendering.
+
+    Phase times accumulate until `finish` closes the sample, which then goes into a fixed-size ring buffer
+    of recent samples.  Each turn is a sample, and so is each frame: several turns can pass between frames
+    when input is coalesced, and each still gets its own sample.  Samples that go over the budget are logged
+    with their phase breakdown.
+    """
+
+    def __init__(self, capacity: int = 256, budget_ms: float = DEFAULT_BUDGET_MS):
+        self.samples: Deque[Sample] = collections.deque(maxlen=capacity)
+        self.budget_ms = budget_ms
+        self._current: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        """Add time spent in a phase to the current sample."""
+        self._current[name] = self._current.get(name, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Time the body of a with statement as the given phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def finish(self, turn: int, kind: str = "turn") -> None:
+        """Close the current sample, of the given kind, if anything was timed since the last one."""
+        if not self._current:
+            return
+        phases, self._current = self._current, {}
+        # AI classes are timed as "ai.<name>" parts of the overall "ai" phase, so leave them out of the total.
+        total = sum(seconds for name, seconds in phases.items() if "." not in name)
+        sample = Sample(turn, total, phases, kind)
+        self.samples.append(sample)
+        if total * 1000 > self.budget_ms:
+            logger.warning("%s took %.1f ms (budget %.1f ms): %s", sample.label, total * 1000, self.budget_ms, describe(sample))
+
+    def averages(self) -> Dict[str, float]:
+        """Return the average milliseconds spent in each phase, over the buffered samples that include it.
+
+        Frames only time rendering and turns everything else, so counting both would understate every phase.
+        """
+        totals: Dict[str, float] = {}
+        counts: Dict[str, int] = {}
+        for sample in self.samples:
+            for name, seconds in sample.phases.items():
+                totals[name] = totals.get(name, 0.0) + seconds
+                counts[name] = counts.get(name, 0) + 1
+        return {name: seconds * 1000 / counts[name] for name, seconds in totals.items()}
+
+    def slowest(self, count: int = 3) -> List[Sample]:
+        """Return the slowest buffered samples, slowest first."""
+        return sorted(self.samples, key=lambda sample: sample.total, reverse=True)[:count]
+
+
+class NullTimer(PhaseTimer):
+    """A timer that records nothing, for screens that have no engine to report to."""
+
+    def add(self, name: str, seconds: float) -> None:
+        pass
+
+    def finish(self, turn: int, kind: str = "turn") -> None:
+        pass
+
+
+NULL_TIMER = NullTimer(capacity=1)
+
+
+def describe(sample: Sample, limit: Optional[int] = None) -> str:
+    """Return the phases of a sample as a line of "name ms" pairs, slowest first, keeping at most `limit` phases."""
+    phases = sorted(sample.phases.items(), key=lambda item: item[1], reverse=True)[:limit]
+    return " ".join(f"{name} {seconds * 1000:.1f}" for name, seconds in phases)
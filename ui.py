@@ -92,6 +92,33 @@ class BasicMenu:
                         string=opt,
                         alignment=tcod.LEFT)
 
+class CachedPane:
+  """ A pane that is drawn into its own offscreen console, and only redrawn when its key changes.
+  Every frame the offscreen console is just blitted onto the root console.  The key should be a
+  value that changes whenever anything the pane shows changes, like a tuple of the stats it displays."""
+  def __init__(self, draw):
+    self.draw = draw # Called as draw(console, x, y, width, height) to draw the pane
+    self.console = None
+    self.key = None
+    self.stale = True
+    self.redraws = 0
+
+  def invalidate(self):
+    """ Force a redraw on the next render, whatever the key is. """
+    self.stale = True
+
+  def render(self, console, x, y, width, height, key):
+    if self.console is None or (self.console.width, self.console.height) != (width, height):
+      self.console = tcod.Console(width, height, order="F")
+      self.stale = True
+    if self.stale or key != self.key:
+      self.console.clear()
+      self.draw(self.console, 0, 0, width, height)
+      self.key = key
+      self.stale = False
+      self.redraws += 1
+    self.console.blit(console, dest_x=x, dest_y=y, width=width, height=height)
+
 class InfoPane:
   """ Displays info about an entity. """
   def __init__(self, x, y, entity):